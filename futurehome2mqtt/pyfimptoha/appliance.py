@@ -6,6 +6,8 @@ Creates switch in Home Assistant based on FIMP services
 import json
 import typing
 
+import pyfimptoha.translation as translation
+
 
 def new_switch(
         mqtt,
@@ -52,6 +54,7 @@ def new_switch(
 
     # Merge default_component with switch_component
     merged_component = {**default_component, **switch_component}
+    merged_component = translation.apply(mqtt, merged_component, translation.report("evt.binary.report"))
     payload = json.dumps(merged_component)
     mqtt.publish(f"homeassistant/switch/{identifier}/config", payload)
 
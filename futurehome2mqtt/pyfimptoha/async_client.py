@@ -0,0 +1,202 @@
+import asyncio
+import threading
+
+import paho.mqtt.client as mqtt
+
+from pyfimptoha.mqtt_client import MqttClient, PendingRequest
+
+
+class AsyncMqttClient(MqttClient):
+    """
+    Runs paho on an asyncio event loop instead of paho's background thread.
+    The socket is watched with add_reader/add_writer, so connecting, request
+    waits and publish flushes are futures on the loop instead of sleeps or
+    threads blocking on events.
+    """
+    def __init__(self):
+        super().__init__()
+        self.loop = None
+        self._loop_thread = None
+        self._misc_task = None
+        self._connack_future = None
+        self._disconnected = None
+        self._reconnect_task = None
+        self._flush_waiters = []
+
+    async def connect_async(self, timeout=None):
+        """
+        Connects and returns once CONNACK is received or `timeout`
+        (`connect_timeout` by default) has passed
+        """
+        if timeout is None:
+            timeout = self._connect_timeout
+
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread = threading.current_thread()
+        self._network_thread = self._loop_thread
+        self._connack_future = self.loop.create_future()
+        self._disconnected = self.loop.create_future()
+
+        self._create_client()
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+        try:
+            self.client.connect(self._server, self._port, 60)
+        except OSError as e:
+            print(f"MQTT client: Could not connect to {self._server}:{self._port}: {e}")
+            return False
+
+        try:
+            await asyncio.wait_for(self._connack_future, timeout)
+        except asyncio.TimeoutError:
+            print(f"MQTT client: No answer from the broker within {timeout} seconds")
+
+        return self.connected
+
+    async def wait_closed(self, timeout=None):
+        """
+        Returns whether the client has been disconnected on purpose within
+        `timeout`. When the connection is lost, it reconnects by itself.
+        """
+        try:
+            await asyncio.wait_for(asyncio.shield(self._disconnected), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def is_alive(self):
+        """
+        Whether the connection is up, or is being reconnected and hasn't been
+        down for longer than DISCONNECTED_TIMEOUT
+        """
+        reconnect_task = self._reconnect_task
+        if not self.connected and reconnect_task is not None and reconnect_task.done():
+            print("MQTT client: Reconnecting has stopped")
+            return False
+        return self._reconnecting()
+
+    async def _reconnect(self):
+        """
+        Reconnects with exponential backoff and jitter until connected
+        """
+        delay = self.reconnect_delay()
+        while not self.connected:
+            print(f"MQTT client: Reconnecting in {delay:.1f} seconds")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+
+            self._connack_future = self.loop.create_future()
+            try:
+                self.client.reconnect()
+            except OSError as e:
+                print(f"MQTT client: Could not reconnect: {e}")
+                continue
+
+            try:
+                await asyncio.wait_for(self._connack_future, self._connect_timeout)
+            except asyncio.TimeoutError:
+                print(f"MQTT client: No answer from the broker within {self._connect_timeout} seconds")
+        self._reconnect_task = None
+
+    def on_socket_open(self, client, userdata, sock):
+        self.loop.add_reader(sock, client.loop_read)
+        self._misc_task = self.loop.create_task(self._misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+            self._misc_task = None
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    async def _misc_loop(self):
+        """
+        Periodic paho housekeeping (keepalive pings, retries)
+        """
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    def on_connect(self, client, userdata, flags, rc):
+        super().on_connect(client, userdata, flags, rc)
+        if not self._connack_future.done():
+            self._connack_future.set_result(rc)
+
+    def on_disconnect(self, client, userdata, rc):
+        super().on_disconnect(client, userdata, rc)
+        self._wake_flush_waiters()
+
+        if rc == mqtt.MQTT_ERR_SUCCESS:
+            if not self._disconnected.done():
+                self._disconnected.set_result(rc)
+        elif self._reconnect_task is None:
+            self._reconnect_task = self.loop.create_task(self._reconnect())
+
+    def _publish(self, topic, payload, retain=False):
+        # The socket callbacks may only be touched from the loop thread
+        if threading.current_thread() is not self._loop_thread:
+            self._wait_for_queue()
+            self.loop.call_soon_threadsafe(super()._publish, topic, payload, retain)
+            return
+        super()._publish(topic, payload, retain)
+
+    def on_publish(self, client, userdata, mid):
+        super().on_publish(client, userdata, mid)
+        if not self._unpublished_mids:
+            self._wake_flush_waiters()
+
+    def call_later(self, delay, callback):
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, callback)
+
+    async def flush(self, timeout=10):
+        """
+        Waits until every message published so far has been sent to the broker
+        """
+        if not self._unpublished_mids or not self.connected:
+            return True
+
+        waiter = self.loop.create_future()
+        self._flush_waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def _wake_flush_waiters(self):
+        waiters, self._flush_waiters = self._flush_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def wait_request(self, request: PendingRequest, timeout=5, finish=True):
+        """
+        Waits for the reply of a request from `send_request` without blocking
+        the loop. With `finish=False` the request is kept after a timeout, so
+        it can be waited for again.
+        """
+        if request.done():
+            self.finish_request(request)
+            return request.response
+
+        if request.future is None:
+            request.future = self.loop.create_future()
+        try:
+            # Shielded, so the future outlives a timeout
+            return await asyncio.wait_for(asyncio.shield(request.future), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if finish or request.done():
+                self.finish_request(request)
+
+    async def request(self, command_topic, event_topic, data, is_correct=None, timeout=5):
+        request = self.send_request(command_topic, event_topic, data, is_correct)
+        return await self.wait_request(request, timeout)
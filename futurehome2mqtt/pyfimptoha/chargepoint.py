@@ -1,14 +1,21 @@
+import asyncio
 import json
+import time
 
+import pyfimptoha.coalescing as coalescing
+import pyfimptoha.translation as translation
 from pyfimptoha.helpers.MqttDevice import MqttDevice
 from pyfimptoha.helpers.MqttDeviceService import MqttDeviceService
 
+# Shown by the min current sensor, in A
+MIN_CURRENT = 6
 
-def get_max_current(mqtt, chargepoint_service):
+
+def request_max_current(mqtt, chargepoint_service, on_response=None):
     def is_correct(msg, data):
         return "type" in data and data["type"] == "evt.max_current.report"
 
-    d = mqtt.send_and_wait(
+    return mqtt.send_request(
         chargepoint_service.command_topic,
         chargepoint_service.state_topic,
         {
@@ -18,35 +25,72 @@ def get_max_current(mqtt, chargepoint_service):
             "val_t": "null",
             "val": None,
         },
-        is_correct
+        is_correct,
+        on_response=on_response
     )
 
-    if d is None:
-        return None
+def get_max_currents(mqtt, chargepoint_services, timeout=5):
+    """
+    Asks all chargepoints for max_current at once and collects the replies
+    with one shared deadline. Returns max_current by service identifier.
+    """
+    requests = {
+        service.identifier: request_max_current(mqtt, service)
+        for service in chargepoint_services
+    }
 
-    msg, data = d
-    return data["val"]
+    deadline = time.monotonic() + timeout
+    max_currents = {}
+    for identifier, request in requests.items():
+        response = request.wait(max(0, deadline - time.monotonic()))
+        mqtt.finish_request(request)
+        if response is not None:
+            msg, data = response
+            max_currents[identifier] = data["val"]
+
+    return max_currents
+
+async def get_max_currents_async(mqtt, chargepoint_services, timeout=5):
+    """
+    Same as `get_max_currents`, but waits on the event loop of an `AsyncMqttClient`
+    """
+    requests = {
+        service.identifier: request_max_current(mqtt, service)
+        for service in chargepoint_services
+    }
+
+    responses = await asyncio.gather(
+        *[mqtt.wait_request(request, timeout) for request in requests.values()]
+    )
+
+    max_currents = {}
+    for identifier, response in zip(requests.keys(), responses):
+        if response is not None:
+            msg, data = response
+            max_currents[identifier] = data["val"]
+
+    return max_currents
 
 def chargepoint(
     mqtt,
-    mqtt_device: MqttDevice
+    mqtt_device: MqttDevice,
+    max_current
 ):
     chargepoint_service = mqtt_device.get_service("chargepoint")
 
     if "evt.max_current.report" in chargepoint_service.intf:
         max_current_sensor(mqtt, chargepoint_service)
-
-    max_current = get_max_current(mqtt, chargepoint_service)
-    if max_current is None:
-        print("Could not determine max_current")
-        return
-
     if "evt.cable_lock.report" in chargepoint_service.intf:
         cable_lock(mqtt, chargepoint_service)
     if "evt.state.report" in chargepoint_service.intf:
         state(mqtt, chargepoint_service)
     if "evt.current_session.report" in chargepoint_service.intf:
-        current(mqtt, chargepoint_service, max_current)
+        if max_current is not None:
+            current(mqtt, chargepoint_service, max_current)
+        else:
+            # The number entity needs max_current, keep the one from before rather than removing it
+            print("Could not determine max_current, keeping the charge current entity as it was")
+            mqtt.keep_discovery_config(current_config_topic(chargepoint_service))
     if "cmd.charge.start" in chargepoint_service.intf and "cmd.charge.stop" in chargepoint_service.intf:
         charging(mqtt, chargepoint_service)
 
@@ -60,7 +104,7 @@ def cable_lock(
 ):
     local_identifier = chargepoint_service.identifier + "_cable_lock"
     lock_component = {
-        "command_topic": chargepoint_service.command_topic,
+        "command_topic": coalescing.command_topic(mqtt, chargepoint_service.command_topic),
         "name": "Cable lock",
         "value_template": """
             {% if value_json.type == 'evt.cable_lock.report' %}
@@ -87,6 +131,9 @@ def cable_lock(
         "unique_id": local_identifier
     }
     merged_component = {**chargepoint_service.get_default_component(), **lock_component}
+    merged_component = translation.apply(
+        mqtt, merged_component, translation.report("evt.cable_lock.report", translation.locked)
+    )
     payload = json.dumps(merged_component)
     mqtt.publish(f"homeassistant/lock/{local_identifier}/config", payload)
 
@@ -109,6 +156,7 @@ def state(
         "unique_id": local_identifier
     }
     merged_component = {**chargepoint_service.get_default_component(), **x_component}
+    merged_component = translation.apply(mqtt, merged_component, translation.report("evt.state.report"))
     payload = json.dumps(merged_component)
     mqtt.publish(f"homeassistant/sensor/{local_identifier}/config", payload)
 
@@ -120,7 +168,7 @@ def current(
     local_identifier = chargepoint_service.identifier + "_current"
     x_component = {
         "name": "Charge current",
-        "command_topic": chargepoint_service.command_topic,
+        "command_topic": coalescing.command_topic(mqtt, chargepoint_service.command_topic),
         "value_template": """
             {% if value_json.type == 'evt.current_session.report' and value_json.props.offered_current != '0' %}
                 {{ value_json.props.offered_current | int }}
@@ -144,8 +192,12 @@ def current(
         "unique_id": local_identifier
     }
     merged_component = {**chargepoint_service.get_default_component(), **x_component}
+    merged_component = translation.apply(mqtt, merged_component, offered_current)
     payload = json.dumps(merged_component)
-    mqtt.publish(f"homeassistant/number/{local_identifier}/config", payload)
+    mqtt.publish(current_config_topic(chargepoint_service), payload)
+
+def current_config_topic(chargepoint_service):
+    return f"homeassistant/number/{chargepoint_service.identifier}_current/config"
 
 def max_current_sensor(
     mqtt,
@@ -166,6 +218,7 @@ def max_current_sensor(
         "unique_id": local_identifier
     }
     merged_component = {**chargepoint_service.get_default_component(), **x_component}
+    merged_component = translation.apply(mqtt, merged_component, translation.report("evt.max_current.report"))
     payload = json.dumps(merged_component)
     mqtt.publish(f"homeassistant/sensor/{local_identifier}/config", payload)
 
@@ -176,14 +229,12 @@ def min_current_sensor(
     local_identifier = chargepoint_service.identifier + "_min_current"
     x_component = {
         "name": "Min current",
-        "value_template": """
-            6
-        """,
         "unit_of_measurement": "A",
         "object_id": local_identifier,
         "unique_id": local_identifier
     }
     merged_component = {**chargepoint_service.get_default_component(), **x_component}
+    merged_component = translation.constant(mqtt, merged_component, MIN_CURRENT)
     payload = json.dumps(merged_component)
     mqtt.publish(f"homeassistant/sensor/{local_identifier}/config", payload)
 
@@ -194,7 +245,7 @@ def charging(
     local_identifier = chargepoint_service.identifier + "_charging"
     x_component = {
         "name": "Charging",
-        "command_topic": chargepoint_service.command_topic,
+        "command_topic": coalescing.command_topic(mqtt, chargepoint_service.command_topic),
         "value_template": """
             {% if value_json.type == 'evt.state.report' %}
                 {% if value_json.val == 'charging' %}
@@ -239,5 +290,23 @@ def charging(
         "unique_id": local_identifier
     }
     merged_component = {**chargepoint_service.get_default_component(), **x_component}
+    merged_component = translation.apply(mqtt, merged_component, translation.report("evt.state.report", charging_state))
+    merged_component = translation.apply_availability(
+        mqtt, merged_component, translation.report("evt.state.report", charging_availability)
+    )
     payload = json.dumps(merged_component)
-    mqtt.publish(f"homeassistant/switch/{local_identifier}/config", payload)
\ No newline at end of file
+    mqtt.publish(f"homeassistant/switch/{local_identifier}/config", payload)
+
+def offered_current(data):
+    """
+    Extracts the charge current, see translation.py
+    """
+    if data["type"] != "evt.current_session.report" or data["props"]["offered_current"] == "0":
+        return None
+    return int(float(data["props"]["offered_current"]))
+
+def charging_state(val):
+    return "ON" if val == "charging" else "OFF"
+
+def charging_availability(val):
+    return "online" if val in ["charging", "ready_to_charge"] else "offline"
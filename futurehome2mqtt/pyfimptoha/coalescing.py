@@ -0,0 +1,17 @@
+"""
+Coalescing of the commands sent by sliders, enabled with the `command_debounce` option.
+"""
+
+
+def command_topic(mqtt, topic, group=None):
+    """
+    Returns the topic Home Assistant should send the commands for the FIMP
+    command `topic` to: the proxy topic of the CommandCoalescer, or `topic`
+    itself if coalescing is disabled. All commands of an entity whose
+    slider commands are coalesced go through the proxy, in one `group`,
+    so they stay in order.
+    """
+    coalescer = mqtt.command_coalescer
+    if coalescer is None:
+        return topic
+    return coalescer.proxy(topic, group)
@@ -0,0 +1,81 @@
+"""
+Seeds the statuses from one vinculum pd7 request for the `state` component,
+instead of a get_report per service, enabled with the `bulk_state` option.
+
+Vinculum answers with the last known values of every device service:
+`val.param.state.devices[].services[].attributes[].values[]`, where the
+attribute is the name of the report, e.g. `lvl` for `evt.lvl.report`.
+"""
+import json
+
+from pyfimptoha.helpers.ReportScheduler import report_event
+from pyfimptoha.helpers.StateCache import StateCache
+
+
+def is_state_response(data):
+    val = data.get("val")
+    return isinstance(val, dict) and isinstance(val.get("param"), dict) and "state" in val["param"]
+
+
+def _key(topic, payload):
+    try:
+        return StateCache.key(topic, json.loads(payload))
+    except (ValueError, AttributeError):
+        return None
+
+
+def statuses(data, is_entity_report):
+    """
+    Yields a status, shaped like the FIMP event it stands for, for every
+    value in the `state` response an entity is built from, according to
+    `is_entity_report(topic, event_type)`
+    """
+    state = data["val"]["param"]["state"] or {}
+    for device in state.get("devices") or []:
+        for service in device.get("services") or []:
+            topic = f"pt:j1/mt:evt{service['addr']}"
+            for attribute in service.get("attributes") or []:
+                event_type = f"evt.{attribute['name']}.report"
+                if not is_entity_report(topic, event_type):
+                    continue
+
+                for value in attribute.get("values") or []:
+                    if value.get("val") is None:
+                        continue
+                    yield topic, json.dumps({
+                        "props": value.get("props") or {},
+                        "serv": service["name"],
+                        "type": event_type,
+                        "val": value["val"],
+                        "val_t": value.get("val_t"),
+                        "src": "homeassistant"
+                    })
+
+
+def apply(data, is_entity_report, statuses_list, get_reports_list):
+    """
+    Returns the statuses and get_report requests, with the values of the
+    `state` response replacing the statuses of the same reports, and
+    without the get_report requests the response already answered.
+    Only the reports of the entities built in the discovery are used, so
+    devices the discovery skipped, and alarms and scenes, are left out.
+    """
+    state_statuses = {}
+    covered = set()
+    for topic, payload in statuses(data, is_entity_report):
+        event = json.loads(payload)
+        state_statuses[StateCache.key(topic, event)] = (topic, payload)
+        covered.add((topic, event["type"]))
+
+    merged = [
+        (topic, payload) for topic, payload in statuses_list
+        if _key(topic, payload) not in state_statuses
+    ]
+    merged.extend(state_statuses.values())
+
+    remaining = [
+        get_report for get_report in get_reports_list
+        if report_event(get_report[0], get_report[2]) not in covered
+    ]
+    print(f"Device state: {len(state_statuses)} values, {len(get_reports_list) - len(remaining)} get_report requests not needed")
+    return merged, remaining
@@ -0,0 +1,198 @@
+import threading
+import time
+
+from pyfimptoha.helpers.TimerWheel import TimerWheel
+from pyfimptoha.mqtt_client import Subscriptions, is_republished
+
+STATS = ["min", "max", "mean", "last"]
+
+
+def parse_windows(value):
+    """
+    Parses the aggregate_windows option: comma separated window lengths in
+    whole seconds, e.g. `10,60,900`
+    """
+    windows = []
+    # bashio passes "null" for an option that isn't set
+    if value is None or value.strip() == "null":
+        return windows
+
+    for window in value.split(","):
+        window = window.strip()
+        if not window:
+            continue
+
+        try:
+            seconds = int(window)
+        except ValueError:
+            seconds = None
+        if seconds is None or seconds <= 0:
+            print(f"Ignoring invalid aggregate window: {window}, must be a whole number of seconds above 0")
+            continue
+        windows.append(seconds)
+    return windows
+
+
+def close_delay(window, now):
+    """
+    Seconds from `now` until the window ends, with the windows aligned to the
+    clock. A window that would end right away, because the timer fired a
+    moment before the boundary, is joined with the next one.
+    """
+    delay = window - now % window
+    if delay < window / 10:
+        delay += window
+    return delay
+
+
+def window_label(window):
+    """
+    E.g. `10s`, `1m`, `15m`, `1h`
+    """
+    if window % 3600 == 0:
+        return f"{window // 3600}h"
+    if window % 60 == 0:
+        return f"{window // 60}m"
+    return f"{window}s"
+
+
+class _Window:
+    """
+    Running min/max/time weighted mean of one series over the current window.
+    The last value carries over into the next window, as it is still the state.
+    """
+    __slots__ = ("start", "min", "max", "integral", "last", "last_time")
+
+    def __init__(self):
+        self.start = None
+        self.min = None
+        self.max = None
+        self.integral = 0.0
+        self.last = None
+        self.last_time = None
+
+    def add(self, value, now):
+        if self.last is not None:
+            self.integral += self.last * (now - self.last_time)
+        if self.start is None:
+            self.start = now
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.last = value
+        self.last_time = now
+
+    def close(self, now):
+        """
+        Returns the stats of the window and starts the next one, or None if
+        there was no value yet
+        """
+        if self.last is None:
+            return None
+
+        self.integral += self.last * (now - self.last_time)
+        duration = now - self.start
+        stats = {
+            "min": self.min,
+            "max": self.max,
+            "mean": self.integral / duration if duration > 0 else self.last,
+            "last": self.last,
+        }
+
+        self.start = now
+        self.min = self.max = self.last
+        self.integral = 0.0
+        self.last_time = now
+        return stats
+
+
+class Aggregator:
+    """
+    Publishes min, max, mean and last of a series, like the power of an
+    electricity meter, once per window instead of every sample. The mean
+    is weighted by how long each value was the state, as meters report on
+    change rather than at a fixed rate.
+
+    Each series keeps one running window per window length, so memory
+    doesn't grow with the number of samples. The windows are aligned to
+    the clock and all series of a window length are closed by one timer.
+    The stats are published to `fh/<identifier>_<stat>_<window>/state`.
+    """
+    def __init__(self, mqtt, windows, wheel: TimerWheel = None):
+        self._mqtt = mqtt
+        self._windows = sorted(set(windows))
+        self._wheel = wheel or mqtt.wheel
+        self._lock = threading.Lock()
+        # FIMP event topic -> identifier -> (extractor, window by length)
+        self._series = {}
+        self._subscriptions = Subscriptions(mqtt)
+        self._started = False
+
+    def register(self, event_topic, identifier, extractor):
+        """
+        Returns the state topics by (stat, window label) of the series
+        extracted for `identifier`
+        """
+        with self._lock:
+            self._series.setdefault(event_topic, {})[identifier] = (
+                extractor, {window: _Window() for window in self._windows}
+            )
+            start = not self._started
+            self._started = True
+
+        if start:
+            for window in self._windows:
+                self._schedule(window)
+
+        self._subscriptions.add(event_topic, on_dict_message=self.on_event)
+
+        return {
+            (stat, window_label(window)): self.state_topic(identifier, stat, window)
+            for window in self._windows for stat in STATS
+        }
+
+    @staticmethod
+    def state_topic(identifier, stat, window):
+        return f"fh/{identifier}_{stat}_{window_label(window)}/state"
+
+    def remove(self, event_topic):
+        with self._lock:
+            self._series.pop(event_topic, None)
+        self._subscriptions.remove(event_topic)
+
+    def on_event(self, msg, data):
+        # Statuses republished by the add-on aren't new samples
+        if is_republished(data):
+            return None
+
+        now = time.time()
+        with self._lock:
+            for extractor, windows in self._series.get(msg.topic, {}).values():
+                try:
+                    value = extractor(data)
+                except (KeyError, TypeError, ValueError, AttributeError):
+                    continue
+                if value is None:
+                    continue
+
+                for aggregate in windows.values():
+                    aggregate.add(float(value), now)
+        return None
+
+    def _schedule(self, window):
+        delay = close_delay(window, time.time())
+        self._wheel.schedule(("aggregate", window), delay, lambda: self._close(window))
+
+    def _close(self, window):
+        now = time.time()
+        published = []
+        with self._lock:
+            for series in self._series.values():
+                for identifier, (extractor, windows) in series.items():
+                    stats = windows[window].close(now)
+                    if stats is not None:
+                        published.append((identifier, stats))
+        self._schedule(window)
+
+        for identifier, stats in published:
+            for stat, value in stats.items():
+                self._mqtt.publish(self.state_topic(identifier, stat, window), str(round(value, 1)), retain=True)
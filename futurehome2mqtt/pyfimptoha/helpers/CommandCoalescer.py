@@ -0,0 +1,145 @@
+import json
+import threading
+import time
+
+from pyfimptoha.helpers.TimerWheel import TimerWheel
+from pyfimptoha.mqtt_client import Subscriptions, is_republished
+
+
+class CommandCoalescer:
+    """
+    Proxies the commands Home Assistant sends while a slider is dragged
+    (brightness, color temperature, setpoint, charge current). Home Assistant
+    sends them to `fh/cmd<address>` instead of the FIMP command topic, and
+    only the latest command of a burst is sent on to FIMP, once no new one
+    has arrived for `delay` seconds. The Z-Wave network then doesn't have to
+    work through every intermediate value before the final one.
+
+    A command equal to the last one sent is dropped while that one is still
+    in flight, that is until the device reports on the service again, or at
+    most IN_FLIGHT_TIME seconds.
+
+    The other commands of an entity, like turning a light on or off, go
+    through the proxy as well, but are sent right away. The slider commands
+    of the same group (the entity) waiting before them are sent first, so
+    the commands reach FIMP in the order they were given.
+    """
+    IN_FLIGHT_TIME = 5
+    # Templates that don't render strict JSON have no type, they are all slider commands
+    DEBOUNCED_COMMANDS = [None, "cmd.lvl.set", "cmd.color.set", "cmd.setpoint.set", "cmd.current_session.set_current"]
+
+    def __init__(self, mqtt, delay, wheel: TimerWheel = None):
+        self._mqtt = mqtt
+        self._delay = delay
+        self._wheel = wheel or mqtt.wheel
+        self._lock = threading.Lock()
+        # FIMP command topic by proxy topic, and the group of each command topic
+        self._command_topics = {}
+        self._groups = {}
+        # Latest command payload by (command topic, type), waiting for the burst to end
+        self._pending = {}
+        # (payload, time) last sent by (command topic, type), until the device reports
+        self._in_flight = {}
+        # Of the proxy and event topics
+        self._subscriptions = Subscriptions(mqtt)
+
+    @staticmethod
+    def proxy_topic(command_topic):
+        return command_topic.replace("pt:j1/mt:cmd", "fh/cmd", 1)
+
+    @staticmethod
+    def event_topic(command_topic):
+        return command_topic.replace("pt:j1/mt:cmd", "pt:j1/mt:evt", 1)
+
+    def proxy(self, command_topic, group=None):
+        """
+        Returns the topic Home Assistant should send the commands for
+        `command_topic` to. Commands are kept in order within `group`, by
+        default the command topic itself.
+        """
+        proxy_topic = self.proxy_topic(command_topic)
+        with self._lock:
+            self._command_topics[proxy_topic] = command_topic
+            self._groups[command_topic] = group or command_topic
+
+        self._subscriptions.add(proxy_topic, on_raw_message=self.on_command)
+        self._subscriptions.add(self.event_topic(command_topic), on_dict_message=self.on_event)
+        return proxy_topic
+
+    def remove(self, command_topic):
+        """
+        Stops proxying the commands of a removed service. Commands still
+        waiting for their burst to end are dropped.
+        """
+        with self._lock:
+            self._command_topics.pop(self.proxy_topic(command_topic), None)
+            self._groups.pop(command_topic, None)
+            keys = [key for key in self._pending if key[0] == command_topic]
+            for key in keys:
+                del self._pending[key]
+            for key in [key for key in self._in_flight if key[0] == command_topic]:
+                del self._in_flight[key]
+
+        for key in keys:
+            self._wheel.cancel(("command", key))
+        self._subscriptions.remove(self.proxy_topic(command_topic))
+        self._subscriptions.remove(self.event_topic(command_topic))
+
+    def on_command(self, msg):
+        command_topic = self._command_topics.get(msg.topic)
+        if command_topic is None:
+            return
+
+        payload = msg.payload.decode("utf-8")
+        command_type = self._command_type(payload)
+        if command_type not in self.DEBOUNCED_COMMANDS:
+            self._flush(self._groups.get(command_topic))
+            self._mqtt.publish(command_topic, payload)
+            return
+
+        key = (command_topic, command_type)
+        with self._lock:
+            self._pending[key] = payload
+        # Scheduling again pushes the command back until the burst is over
+        self._wheel.schedule(("command", key), self._delay, lambda: self._send(key))
+
+    def _flush(self, group):
+        """
+        Sends the commands of `group` waiting for their burst to end
+        """
+        with self._lock:
+            keys = [key for key in self._pending if self._groups.get(key[0]) == group]
+        for key in keys:
+            self._wheel.cancel(("command", key))
+            self._send(key)
+
+    @staticmethod
+    def _command_type(payload):
+        # The templates don't always render strict JSON, fall back to one command per topic
+        try:
+            return json.loads(payload).get("type")
+        except (ValueError, AttributeError):
+            return None
+
+    def on_event(self, msg, data):
+        if is_republished(data):
+            return None
+
+        command_topic = msg.topic.replace("pt:j1/mt:evt", "pt:j1/mt:cmd", 1)
+        with self._lock:
+            for key in [key for key in self._in_flight if key[0] == command_topic]:
+                del self._in_flight[key]
+        return None
+
+    def _send(self, key):
+        with self._lock:
+            payload = self._pending.pop(key, None)
+            if payload is None:
+                return
+            now = time.monotonic()
+            in_flight = self._in_flight.get(key)
+            if in_flight is not None and in_flight[0] == payload and now - in_flight[1] < self.IN_FLIGHT_TIME:
+                return
+            self._in_flight[key] = (payload, now)
+
+        self._mqtt.publish(key[0], payload)
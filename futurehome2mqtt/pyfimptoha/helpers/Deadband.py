@@ -0,0 +1,111 @@
+import threading
+
+from pyfimptoha.helpers.Throttle import match_rule
+from pyfimptoha.helpers.TimerWheel import TimerWheel
+
+
+def parse_rules(value):
+    """
+    Parses the deadband option: comma separated `<key>:<threshold>[%][:<heartbeat>]`,
+    with the heartbeat in seconds. E.g. `sensor_temp:0.2,meter_elec_W:5%:600`
+    """
+    rules = []
+    # bashio passes "null" for an option that isn't set
+    if value is None or value.strip() == "null":
+        return rules
+
+    for rule in value.split(","):
+        rule = rule.strip()
+        if not rule:
+            continue
+
+        parts = rule.split(":")
+        try:
+            key = parts[0]
+            relative = parts[1].endswith("%")
+            threshold = float(parts[1].rstrip("%"))
+            heartbeat = float(parts[2]) if len(parts) > 2 and parts[2] else None
+        except (IndexError, ValueError):
+            print(f"Ignoring invalid deadband rule: {rule}")
+            continue
+        rules.append((key, threshold, relative, heartbeat))
+    return rules
+
+
+class Deadband:
+    """
+    Drops numeric states which differ less than a threshold from the last
+    state sent for the entity. The threshold is absolute, or relative to the
+    last sent state when given in percent. Non-numeric states always pass.
+
+    With a heartbeat the latest state is sent when nothing was sent for that
+    long, so small drifts still reach Home Assistant eventually.
+
+    Rules are matched on the entity identifier like the throttle rules.
+    """
+    def __init__(self, rules, send, wheel: TimerWheel):
+        self._rules = sorted(rules, key=lambda rule: len(rule[0]), reverse=True)
+        self._send = send
+        self._wheel = wheel
+        self._lock = threading.Lock()
+        # (threshold, relative, heartbeat) by state topic
+        self._limits = {}
+        self._last_sent = {}
+        self._latest = {}
+
+    def add(self, state_topic, identifier):
+        rule = self.rule(identifier)
+        with self._lock:
+            if rule is None:
+                self._limits.pop(state_topic, None)
+            else:
+                self._limits[state_topic] = rule[1:]
+
+    def rule(self, identifier):
+        return match_rule(self._rules, identifier)
+
+    def remove(self, state_topic):
+        with self._lock:
+            self._limits.pop(state_topic, None)
+            self._last_sent.pop(state_topic, None)
+            self._latest.pop(state_topic, None)
+        # Shares the wheel with the throttle
+        self._wheel.cancel(("deadband", state_topic))
+
+    def offer(self, state_topic, payload):
+        """
+        Returns whether `payload` differs enough from the last sent state to be sent
+        """
+        limits = self._limits.get(state_topic)
+        if limits is None:
+            return True
+
+        threshold, relative, heartbeat = limits
+        try:
+            value = float(payload)
+        except ValueError:
+            return True
+
+        with self._lock:
+            self._latest[state_topic] = payload
+            last_sent = self._last_sent.get(state_topic)
+            if last_sent is not None:
+                limit = threshold * abs(last_sent) / 100 if relative else threshold
+                if abs(value - last_sent) < limit:
+                    return False
+
+            self._last_sent[state_topic] = value
+        if heartbeat:
+            self._wheel.schedule(("deadband", state_topic), heartbeat, lambda: self._heartbeat(state_topic))
+        return True
+
+    def _heartbeat(self, state_topic):
+        with self._lock:
+            limits = self._limits.get(state_topic)
+            payload = self._latest.get(state_topic)
+            if limits is None or payload is None:
+                return
+            self._last_sent[state_topic] = float(payload)
+
+        self._wheel.schedule(("deadband", state_topic), limits[2], lambda: self._heartbeat(state_topic))
+        self._send(state_topic, payload)
@@ -0,0 +1,37 @@
+from pyfimptoha.helpers.MqttDevice import MqttDevice
+
+
+class DiscoveryIndex:
+    """
+    Lookups over the devices and rooms reported by FIMP. Built once per
+    discovery pass and passed to the builders, so they don't have to scan
+    the whole device or room list for every device.
+    """
+    def __init__(self, devices, rooms):
+        self.room_aliases = {room["id"]: room["alias"] for room in rooms}
+        self.devices_by_thing = {}
+        self._mqtt_devices = {}
+
+        for device in devices:
+            thing_id = device.get("thing")
+            if thing_id is not None:
+                self.devices_by_thing.setdefault(thing_id, []).append(device)
+
+    def room_alias(self, room_id):
+        return self.room_aliases.get(room_id)
+
+    def thing_devices(self, thing_id):
+        """
+        Devices (channels) belonging to the same physical thing
+        """
+        return self.devices_by_thing.get(thing_id, [])
+
+    def mqtt_device(self, device):
+        """
+        The MqttDevice for `device`, built once per pass
+        """
+        mqtt_device = self._mqtt_devices.get(device["id"])
+        if mqtt_device is None or mqtt_device.device_data is not device:
+            mqtt_device = MqttDevice(device, self.room_alias(device["room"]))
+            self._mqtt_devices[device["id"]] = mqtt_device
+        return mqtt_device
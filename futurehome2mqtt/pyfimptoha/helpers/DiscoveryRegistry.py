@@ -0,0 +1,90 @@
+import hashlib
+
+from pyfimptoha.helpers.storage import load_json, save_json
+
+
+class DiscoveryRegistry:
+    """
+    Keeps a hash of every discovery config that has been published, persisted
+    between runs, so unchanged configs aren't sent to Home Assistant again.
+    Configs that weren't published during a discovery pass are returned by
+    `end_pass` so they can be removed.
+
+    Each config is tagged with `owner` (e.g. the device) at the time it is
+    published, so a pass can also be limited to the configs of one owner.
+    """
+    FILE = "discovery_hashes.json"
+
+    def __init__(self, data_path):
+        self._data_path = data_path
+        self._hashes = load_json(data_path, self.FILE) or {}
+        self._seen = set()
+        self._owners = {}
+        self._pass_owner = None
+        self.owner = None
+
+    @staticmethod
+    def hash(payload):
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=8).hexdigest()
+
+    def is_changed(self, topic, payload):
+        """
+        Records the config as part of the current pass and returns whether it
+        differs from what was published last
+        """
+        digest = self.hash(payload)
+        self._seen.add(topic)
+        self._owners[topic] = self.owner
+        if self._hashes.get(topic) == digest:
+            return False
+
+        self._hashes[topic] = digest
+        return True
+
+    def keep(self, topic):
+        """
+        Records a config published before as part of the current pass, without
+        its payload. Returns False if it isn't known.
+        """
+        if topic not in self._hashes:
+            return False
+        self._seen.add(topic)
+        self._owners[topic] = self.owner
+        return True
+
+    def begin_pass(self, owner=None):
+        """
+        Starts a pass over all configs, or only over the configs of `owner`
+        """
+        self._seen = set()
+        self._pass_owner = owner
+        self.owner = owner
+
+    def abort_pass(self):
+        """
+        Ends the current pass without removing the configs not published in it
+        """
+        self._pass_owner = None
+        self.owner = None
+        save_json(self._data_path, self.FILE, self._hashes)
+
+    def end_pass(self):
+        """
+        Returns the topics that disappeared since the last pass and saves the hashes
+        """
+        if self._pass_owner is None:
+            removed = [topic for topic in self._hashes if topic not in self._seen]
+        else:
+            removed = [
+                topic for topic, owner in self._owners.items()
+                if owner == self._pass_owner and topic not in self._seen
+            ]
+
+        for topic in removed:
+            self._hashes.pop(topic, None)
+            self._owners.pop(topic, None)
+        self._pass_owner = None
+        self.owner = None
+
+        save_json(self._data_path, self.FILE, self._hashes)
+        return removed
@@ -0,0 +1,135 @@
+import threading
+import time
+
+from pyfimptoha.helpers.storage import load_json, save_json
+from pyfimptoha.mqtt_client import Subscriptions, is_republished
+
+
+class EnergyIntegrator:
+    """
+    Integrates the power of electricity meters without an energy (kWh)
+    report into energy, so Home Assistant doesn't need an integration
+    helper per meter.
+
+    Each power report adds the trapezoid between it and the previous report
+    to the total, which is published to `fh/<identifier>/state` in kWh.
+    Negative power (export) doesn't count, as the total only increases.
+    The totals are saved to the data directory a while after they change,
+    and on shutdown, and continue from there after a restart. Energy used
+    while the add-on wasn't running isn't counted.
+
+    A total is never published lower than the retained state, which may be
+    newer than the saved total after a crash. Home Assistant would take a
+    lower total for a meter reset.
+    """
+    FILE = "energy_totals.json"
+    SAVE_DELAY = 60
+
+    def __init__(self, mqtt, data_path):
+        self._mqtt = mqtt
+        self._data_path = data_path
+        self._lock = threading.Lock()
+        totals = load_json(data_path, self.FILE)
+        # kWh by identifier
+        self._totals = totals if isinstance(totals, dict) else {}
+        # (W, time) of the last report by identifier
+        self._last = {}
+        # FIMP event topic -> identifier -> extractor
+        self._series = {}
+        # Identifier by state topic
+        self._identifiers = {}
+        # Of the event topics and the retained states
+        self._subscriptions = Subscriptions(mqtt)
+        self._save_scheduled = False
+
+    @staticmethod
+    def state_topic(identifier):
+        return f"fh/{identifier}/state"
+
+    def register(self, event_topic, identifier, extractor):
+        """
+        Returns the state topic of the energy integrated from the power
+        extracted for `identifier`
+        """
+        state_topic = self.state_topic(identifier)
+        with self._lock:
+            self._series.setdefault(event_topic, {})[identifier] = extractor
+            self._totals.setdefault(identifier, 0.0)
+            self._identifiers[state_topic] = identifier
+
+        self._subscriptions.add(event_topic, on_dict_message=self.on_event)
+        # The retained total comes back right away, it is published once the meter reports
+        self._subscriptions.add(state_topic, on_raw_message=self.on_state)
+        return state_topic
+
+    def remove(self, event_topic):
+        with self._lock:
+            topics = [event_topic]
+            for identifier in self._series.pop(event_topic, {}):
+                self._last.pop(identifier, None)
+                state_topic = self.state_topic(identifier)
+                self._identifiers.pop(state_topic, None)
+                topics.append(state_topic)
+
+        for topic in topics:
+            self._subscriptions.remove(topic)
+
+    def on_state(self, msg):
+        """
+        Continues from the retained total when it is higher than the saved one
+        """
+        try:
+            total = float(msg.payload.decode("utf-8"))
+        except ValueError:
+            return
+
+        with self._lock:
+            identifier = self._identifiers.get(msg.topic)
+            if identifier is None or total <= self._totals.get(identifier, 0.0):
+                return
+            self._totals[identifier] = total
+
+    def on_event(self, msg, data):
+        # Statuses republished by the add-on aren't new reports
+        if is_republished(data):
+            return None
+
+        now = time.monotonic()
+        published = []
+        with self._lock:
+            for identifier, extractor in self._series.get(msg.topic, {}).items():
+                try:
+                    power = extractor(data)
+                except (KeyError, TypeError, ValueError, AttributeError):
+                    continue
+                if power is None:
+                    continue
+
+                last = self._last.get(identifier)
+                self._last[identifier] = (float(power), now)
+                if last is None:
+                    continue
+
+                hours = (now - last[1]) / 3600
+                energy = (last[0] + float(power)) / 2 * hours / 1000
+                if energy > 0:
+                    self._totals[identifier] += energy
+                    published.append((identifier, self._totals[identifier]))
+
+            schedule_save = bool(published) and not self._save_scheduled
+            self._save_scheduled = self._save_scheduled or schedule_save
+
+        for identifier, total in published:
+            self._publish(identifier, total)
+        if schedule_save:
+            self._mqtt.call_later(self.SAVE_DELAY, self.save)
+        return None
+
+    def _publish(self, identifier, total):
+        self._mqtt.publish(self.state_topic(identifier), str(round(total, 3)), retain=True)
+
+    def save(self):
+        with self._lock:
+            self._save_scheduled = False
+            totals = dict(self._totals)
+        save_json(self._data_path, self.FILE, totals)
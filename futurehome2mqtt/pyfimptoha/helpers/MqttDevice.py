@@ -11,39 +11,70 @@ def get_adapter_name(device):
     return adapter
 
 class MqttDevice(object):
+    """
+    Immutable view of a FIMP device. Services and the device info shared by
+    all discovery configs are built once, so builders can ask for them as
+    often as they like.
+    """
+    __slots__ = (
+        "device_data", "room_alias", "model", "model_alias", "adapter", "id",
+        "address", "clientName", "functionality", "device_info", "_services",
+    )
+
     def __init__(self, device_data, room_alias):
-        self.device_data = device_data
-        self.room_alias = room_alias
-        self.model = device_data["model"] if device_data.get("model") and device_data["model"] else ""
-        self.model_alias = device_data["modelAlias"] if device_data.get("modelAlias") and device_data["modelAlias"] else self.model
-        self.adapter = get_adapter_name(device_data)
-        self.id = device_data["id"]
-        self.address = device_data["fimp"]["address"]
-        self.clientName = device_data["client"]["name"]
-        self.functionality = device_data["functionality"]
+        model = device_data["model"] if device_data.get("model") and device_data["model"] else ""
+        model_alias = device_data["modelAlias"] if device_data.get("modelAlias") and device_data["modelAlias"] else model
+        adapter = get_adapter_name(device_data)
+        address = device_data["fimp"]["address"]
+        client_name = device_data["client"]["name"]
+
+        set_attribute = super().__setattr__
+        set_attribute("device_data", device_data)
+        set_attribute("room_alias", room_alias)
+        set_attribute("model", model)
+        set_attribute("model_alias", model_alias)
+        set_attribute("adapter", adapter)
+        set_attribute("id", device_data["id"])
+        set_attribute("address", address)
+        set_attribute("clientName", client_name)
+        set_attribute("functionality", device_data["functionality"])
+        device_info = {
+            "identifiers": f"{adapter}_{address}",
+            "name": f"{client_name}",
+            "suggested_area": f"{room_alias}",
+            "hw_version": f"{model}",
+            "model": f"{model_alias}",
+            "sw_version": f"{adapter}_{address}"
+        }
+        # A room missing from the room list would end up as the area "None"
+        if room_alias is None:
+            del device_info["suggested_area"]
+        # Shared by the default component of every service, must not be modified
+        set_attribute("device_info", device_info)
+        set_attribute("_services", {
+            service_name: MqttDeviceService(self, service_name, service)
+            for service_name, service in device_data["services"].items()
+        })
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
 
     def has_service(self, service_name):
-        return service_name in self.device_data["services"]
+        return service_name in self._services
 
     def get_services(self):
-        services = {}
-        for service_name, service in self.device_data["services"].items():
-            services[service_name] = MqttDeviceService(self, service_name, service)
-
-        return services
+        """
+        Cached services by name, must not be modified
+        """
+        return self._services
 
     def get_service(self, service_name):
-        services = self.get_services()
-
-        if service_name in services:
-            return services[service_name]
-
-        return None
+        return self._services.get(service_name)
 
     def get_reports_info(self, whitelist):
-        services_reports_info = [service.get_reports_info() for service_name, service in self.get_services().items() if service_name in whitelist]
         merged = []
-        for service_reports_info in services_reports_info:
-            merged.extend(service_reports_info)
+        for service_name, service in self._services.items():
+            if service_name in whitelist:
+                merged.extend(service.get_reports_info())
 
-        return merged
\ No newline at end of file
+        return merged
@@ -1,37 +1,69 @@
+from pyfimptoha.helpers.StateCache import is_state_report
+
+
 class MqttDeviceService:
+    """
+    Immutable view of one service of a FIMP device, see MqttDevice
+    """
+    __slots__ = (
+        "device", "service_data", "service_name", "identifier", "state_topic",
+        "command_topic", "intf", "_default_component", "_reports_info", "_state_reports",
+    )
+
     def __init__(self, device, service_name, service_data):
-        self.device = device
-        self.service_data = service_data
-        self.service_name = service_name
-        self.identifier = f"fh_{self.device.id}_{self.device.adapter}_{self.device.address}_{service_name}"
-        self.state_topic = f"pt:j1/mt:evt{self.service_data['addr']}"
-        self.command_topic = f"pt:j1/mt:cmd{self.service_data['addr']}"
-        self.intf = self.service_data['intf'] if 'intf' in self.service_data else None
+        identifier = f"fh_{device.id}_{device.adapter}_{device.address}_{service_name}"
+        state_topic = f"pt:j1/mt:evt{service_data['addr']}"
+        intf = service_data['intf'] if 'intf' in service_data else None
 
-    def get_default_component(self):
-        return {
+        set_attribute = super().__setattr__
+        set_attribute("device", device)
+        set_attribute("service_data", service_data)
+        set_attribute("service_name", service_name)
+        set_attribute("identifier", identifier)
+        set_attribute("state_topic", state_topic)
+        set_attribute("command_topic", f"pt:j1/mt:cmd{service_data['addr']}")
+        set_attribute("intf", intf)
+        set_attribute("_default_component", {
             "name": None,
-            "object_id": self.identifier,
-            "unique_id": self.identifier,
-            "device": {
-                "identifiers": f"{self.device.adapter}_{self.device.address}",
-                "name": f"{self.device.clientName}",
-                "suggested_area": f"{self.device.room_alias}",
-                "hw_version": f"{self.device.model}",
-                "model": f"{self.device.model_alias}",
-                "sw_version": f"{self.device.adapter}_{self.device.address}"
-            },
-            "state_topic": self.state_topic,
-        }
+            "object_id": identifier,
+            "unique_id": identifier,
+            "device": device.device_info,
+            "state_topic": state_topic,
+        })
+        set_attribute("_reports_info", [
+            [self.command_topic, service_name, s] for s in (intf or []) if s.endswith(".get_report")
+        ])
+        # evt.*.report of the interface, and the reports answering its get_report commands
+        state_reports = {s for s in (intf or []) if s.startswith("evt.") and s.endswith(".report")}
+        state_reports.update(
+            "evt." + s[len("cmd."):-len(".get_report")] + ".report"
+            for s in (intf or []) if s.startswith("cmd.") and s.endswith(".get_report")
+        )
+        set_attribute("_state_reports", frozenset(s for s in state_reports if is_state_report(s)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
 
-    def get_common_params(self):
+    def get_default_component(self):
+        """
+        Cached, merge it into a new dict instead of modifying it
+        """
+        return self._default_component
+
+    def get_common_params(self, mqtt):
         return {
-            # "mqtt": mqtt,
-            "device": self.device,
+            "mqtt": mqtt,
+            "device": self.device.device_data,
             "state_topic": self.state_topic,
             "identifier": self.identifier,
-            "default_component": self.get_default_component()
+            "default_component": self._default_component
         }
 
+    def get_state_reports(self):
+        """
+        The report types of the service which carry a state
+        """
+        return self._state_reports
+
     def get_reports_info(self):
-        return [[self.command_topic, self.service_name, s] for s in self.service_data["intf"] if s.endswith(".get_report")]
+        return [list(report_info) for report_info in self._reports_info]
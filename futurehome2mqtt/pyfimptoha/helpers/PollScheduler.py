@@ -0,0 +1,173 @@
+import heapq
+import itertools
+import threading
+import time
+
+from pyfimptoha.helpers.ReportScheduler import report_event
+from pyfimptoha.helpers.TimerWheel import TimerWheel
+from pyfimptoha.mqtt_client import Subscriptions, is_republished
+
+
+def _unit(data):
+    props = data.get("props")
+    return props.get("unit") if isinstance(props, dict) else None
+
+
+class _Poll:
+    __slots__ = ("key", "topic", "service", "report_name", "unit", "event_topic", "event_type",
+                 "interval", "due", "last_poll", "last_report", "average_gap")
+
+    def __init__(self, topic, service, report_name, unit, interval):
+        self.key = (topic, report_name, unit)
+        self.topic = topic
+        self.service = service
+        self.report_name = report_name
+        self.unit = unit
+        self.event_topic, self.event_type = report_event(topic, report_name)
+        self.interval = interval
+        self.due = None
+        self.last_poll = None
+        # Last report sent by the device on its own, and the average time between them
+        self.last_report = None
+        self.average_gap = None
+
+
+class PollScheduler:
+    """
+    Polls services which don't report by themselves, or not often enough,
+    with get_report requests. The requests are sent through the
+    ReportScheduler, so they are paced with the other get_report requests.
+
+    A service is polled when it hasn't reported for its interval. Meters
+    report one unit per event, so each unit is polled by itself, asking for
+    it with the get_report value, and only reports in that unit count. Every
+    report the device sends by itself pushes the next poll back, so services
+    pushing their events are never polled. The interval is twice the average
+    time between those reports, between `min_interval` and `max_interval`,
+    and `min_interval` while the device hasn't reported by itself.
+
+    The polls are kept in a heap on their due time, so one timer on the
+    wheel waits for the next one, however many services are polled. A report
+    only moves the due time of its poll, which goes back into the heap at the
+    old due time, so there is one heap entry per poll.
+    """
+    # Reports within this many seconds after a poll are taken as its answer
+    RESPONSE_TIME = 10
+    # Weight of the latest gap in the average time between reports
+    SMOOTHING = 0.3
+
+    def __init__(self, mqtt, min_interval, max_interval, wheel: TimerWheel = None):
+        self._mqtt = mqtt
+        self._min_interval = min_interval
+        self._max_interval = max(min_interval, max_interval)
+        self._wheel = wheel or mqtt.wheel
+        self._lock = threading.Lock()
+        # (due, sequence, poll)
+        self._heap = []
+        self._sequence = itertools.count()
+        # Poll by (command topic, report name, unit)
+        self._polls = {}
+        # Keys of the polls by event topic
+        self._event_topics = {}
+        self._subscriptions = Subscriptions(mqtt)
+
+    def add(self, topic, service, report_name, unit=None):
+        """
+        Starts polling a get_report request, for one `unit` of a meter or
+        any report, unless it is polled already
+        """
+        key = (topic, report_name, unit)
+        with self._lock:
+            if key in self._polls:
+                return
+            poll = _Poll(topic, service, report_name, unit, self._min_interval)
+            self._polls[key] = poll
+            self._event_topics.setdefault(poll.event_topic, set()).add(key)
+            now = time.monotonic()
+            self._schedule(poll, now + poll.interval)
+            self._start_timer(now)
+
+        self._subscriptions.add(poll.event_topic, on_dict_message=self.on_event)
+
+    def remove(self, topic):
+        """
+        Stops polling the services of a removed device, by command topic
+        """
+        with self._lock:
+            keys = [key for key in self._polls if key[0] == topic]
+            event_topics = set()
+            for key in keys:
+                poll = self._polls.pop(key)
+                event_topics.add(poll.event_topic)
+                self._event_topics.get(poll.event_topic, set()).discard(key)
+
+            unused = [event_topic for event_topic in event_topics if not self._event_topics.get(event_topic)]
+            for event_topic in unused:
+                self._event_topics.pop(event_topic, None)
+
+        for event_topic in unused:
+            self._subscriptions.remove(event_topic)
+
+    def _schedule(self, poll, due):
+        poll.due = due
+        heapq.heappush(self._heap, (due, next(self._sequence), poll))
+
+    def _start_timer(self, now):
+        # Scheduling the key again moves the timer to the first due time
+        if self._heap:
+            self._wheel.schedule(("poll",), max(0, self._heap[0][0] - now), self._poll_due)
+
+    def on_event(self, msg, data):
+        # Statuses and cached events republished by the add-on aren't reports
+        if is_republished(data):
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            for key in self._event_topics.get(msg.topic, ()):
+                poll = self._polls[key]
+                if poll.event_type != data.get("type"):
+                    continue
+                if poll.unit is not None and poll.unit != _unit(data):
+                    continue
+
+                if poll.last_poll is None or now - poll.last_poll > self.RESPONSE_TIME:
+                    self._reported(poll, now)
+                # Picked up when the heap entry at the old due time comes up
+                poll.due = now + poll.interval
+        return None
+
+    def _reported(self, poll, now):
+        """
+        Adapts the interval to a report the device sent by itself
+        """
+        if poll.last_report is not None:
+            gap = now - poll.last_report
+            if poll.average_gap is None:
+                poll.average_gap = gap
+            else:
+                poll.average_gap += self.SMOOTHING * (gap - poll.average_gap)
+            poll.interval = min(self._max_interval, max(self._min_interval, 2 * poll.average_gap))
+        poll.last_report = now
+
+    def _poll_due(self):
+        get_reports = []
+        with self._lock:
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                due, _, poll = heapq.heappop(self._heap)
+                if self._polls.get(poll.key) is not poll:
+                    # Removed
+                    continue
+                if poll.due > due:
+                    # Put off by a report
+                    self._schedule(poll, poll.due)
+                    continue
+
+                poll.last_poll = now
+                self._schedule(poll, now + poll.interval)
+                get_reports.append([poll.topic, poll.service, poll.report_name, poll.unit])
+            self._start_timer(now)
+
+        if get_reports:
+            self._mqtt.report_scheduler.add(get_reports, skip_known=False)
@@ -0,0 +1,119 @@
+import heapq
+import itertools
+import threading
+
+from pyfimptoha.helpers.TimerWheel import TimerWheel
+
+
+def adapter_of(topic):
+    """
+    Returns the adapter (`zw`, `zb` etc.) of a FIMP topic, from its `rn:` level
+    """
+    for level in topic.split("/"):
+        if level.startswith("rn:"):
+            return level[3:]
+    return None
+
+
+def report_event(topic, report_name):
+    """
+    Returns the event topic and type answering a get_report command,
+    e.g. `evt.lvl.report` for `cmd.lvl.get_report`
+    """
+    event_topic = topic.replace("pt:j1/mt:cmd", "pt:j1/mt:evt", 1)
+    event_type = "evt." + report_name[len("cmd."):-len(".get_report")] + ".report"
+    return event_topic, event_type
+
+
+class ReportScheduler:
+    """
+    Sends get_report requests at most `rate` per second per adapter, so a
+    large Z-Wave or Zigbee network isn't flooded with requests at startup and
+    the reports don't time out in the controller queue.
+
+    Requests of interactive services, like lights and locks, are sent first.
+    Requests whose answer has already been seen, because the device reported
+    by itself while the request was waiting, are skipped. With a `rate` of 0
+    everything is sent right away.
+    """
+    INTERACTIVE_SERVICES = ["out_lvl_switch", "out_bin_switch", "color_ctrl", "door_lock", "thermostat", "chargepoint"]
+
+    def __init__(self, mqtt, rate, wheel: TimerWheel = None):
+        self._mqtt = mqtt
+        self._interval = 1 / rate if rate > 0 else 0
+        self._wheel = wheel or mqtt.wheel
+        self._lock = threading.Lock()
+        # Heap of (priority, sequence, topic, service, report_name, val, skip_known) by adapter
+        self._queues = {}
+        self._queued = set()
+        # Adapters currently sending
+        self._sending = set()
+        self._sequence = itertools.count()
+
+    def priority(self, service):
+        return 0 if service in self.INTERACTIVE_SERVICES else 1
+
+    def add(self, get_reports_list, skip_known=True):
+        """
+        Queues [topic, service, report_name] get_report requests, optionally
+        with the value to send, like the unit of a meter report. Requests
+        already waiting are only queued once. Without `skip_known` they are
+        sent even if the device has reported, as for the polls.
+        """
+        start = set()
+        with self._lock:
+            for topic, service, report_name, *val in get_reports_list:
+                val = val[0] if val else None
+                if (topic, report_name, val) in self._queued:
+                    continue
+                self._queued.add((topic, report_name, val))
+
+                adapter = adapter_of(topic)
+                heapq.heappush(
+                    self._queues.setdefault(adapter, []),
+                    (self.priority(service), next(self._sequence), topic, service, report_name, val, skip_known)
+                )
+                if adapter not in self._sending:
+                    self._sending.add(adapter)
+                    start.add(adapter)
+
+        for adapter in start:
+            self._send_next(adapter)
+
+    def pending(self):
+        with self._lock:
+            return len(self._queued)
+
+    def _send_next(self, adapter):
+        while True:
+            with self._lock:
+                queue = self._queues.get(adapter)
+                if not queue:
+                    self._queues.pop(adapter, None)
+                    self._sending.discard(adapter)
+                    return
+                _, _, topic, service, report_name, val, skip_known = heapq.heappop(queue)
+                self._queued.discard((topic, report_name, val))
+
+            if skip_known and self._is_known(topic, report_name):
+                continue
+
+            self._send(topic, service, report_name, val)
+            if self._interval:
+                self._wheel.schedule(("get_report", adapter), self._interval, lambda: self._send_next(adapter))
+                return
+
+    def _is_known(self, topic, report_name):
+        state_cache = self._mqtt.state_cache
+        if state_cache is None:
+            return False
+        return state_cache.seen(*report_event(topic, report_name))
+
+    def _send(self, topic, service, report_name, val=None):
+        self._mqtt.publish_dict(topic, {
+            "serv": service,
+            "src": "homeassistant",
+            "type": report_name,
+            "val_t": "null" if val is None else "string",
+            "val": val,
+        })
@@ -0,0 +1,163 @@
+import json
+import threading
+from collections import OrderedDict
+
+from pyfimptoha.helpers.storage import load_json, save_json
+
+
+def is_state_report(event_type):
+    """
+    Whether `event_type` reports a state, like `evt.lvl.report`. Alarms and
+    scene activations are events, sending them again would set off alarms
+    and automations.
+    """
+    return (
+        isinstance(event_type, str)
+        and event_type.startswith("evt.")
+        and event_type.endswith(".report")
+        and not event_type.startswith(("evt.alarm.", "evt.scene."))
+    )
+
+
+class StateCache:
+    """
+    Latest FIMP event of every service, by topic, event type and unit (meters
+    report several units on the same topic). Fed from the events seen on the
+    hub, so Home Assistant can be given the current state after restarts
+    without asking the devices again.
+
+    Holds at most `max_entries` events, dropping the least recently updated
+    ones. With `persist` it is saved to the data directory a while after it
+    changes, and loaded again on start.
+
+    Only events for which `accepts(topic, event_type)` is true are given
+    back, that is the state reports of the entities, see
+    MqttClient.is_entity_report.
+    """
+    FILE = "state_cache.json"
+    SAVE_DELAY = 60
+
+    def __init__(self, data_path, max_entries, persist, call_later, accepts):
+        self._data_path = data_path
+        self._max_entries = max_entries
+        self._persist = persist
+        self._call_later = call_later
+        self._accepts = accepts
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._save_scheduled = False
+        # (topic, event type) received since the start, unlike the loaded events
+        self._seen = set()
+
+        if persist:
+            for entry in load_json(data_path, self.FILE) or []:
+                # Files from before the event type was saved are dropped
+                if len(entry) == 4 and is_state_report(entry[2]):
+                    key, topic, event_type, payload = entry
+                    self._entries[key] = (topic, event_type, payload)
+            self._trim()
+
+    @staticmethod
+    def key(topic, data):
+        props = data.get("props")
+        unit = props.get("unit") if isinstance(props, dict) else None
+        return f"{topic} {data.get('type')} {unit}"
+
+    def update(self, topic, data, payload):
+        key = self.key(topic, data)
+        with self._lock:
+            self._entries[key] = (topic, data.get("type"), payload)
+            self._entries.move_to_end(key)
+            self._trim()
+            self._seen.add((topic, data.get("type")))
+        self._changed()
+
+    def seen(self, topic, event_type):
+        """
+        Whether an event of `event_type` has been received on `topic` since the start
+        """
+        return (topic, event_type) in self._seen
+
+    def remove(self, topics):
+        """
+        Forgets the events of removed services
+        """
+        topics = set(topics)
+        with self._lock:
+            for key in [key for key, (topic, event_type, payload) in self._entries.items() if topic in topics]:
+                del self._entries[key]
+            self._seen = {seen for seen in self._seen if seen[0] not in topics}
+        self._changed()
+
+    def purge(self):
+        """
+        Forgets the events no longer accepted, e.g. of devices which have been
+        excluded since they were cached
+        """
+        with self._lock:
+            for key in [
+                key for key, (topic, event_type, payload) in self._entries.items()
+                if not self._accepts(topic, event_type)
+            ]:
+                del self._entries[key]
+        self._changed()
+
+    def _changed(self):
+        # Saved once for all changes within SAVE_DELAY
+        with self._lock:
+            schedule_save = self._persist and not self._save_scheduled
+            self._save_scheduled = self._save_scheduled or schedule_save
+
+        if schedule_save:
+            self._call_later(self.SAVE_DELAY, self.save)
+
+    def _trim(self):
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def merge(self, statuses, prefer_cache):
+        """
+        Returns `statuses` together with the cached events. Where both have
+        a state for the same service, the cached one is used with `prefer_cache`
+        (it was seen after the statuses were created), otherwise the status.
+        """
+        with self._lock:
+            cached = dict(self._entries)
+
+        status_keys = set()
+        merged = []
+        for topic, payload in statuses:
+            try:
+                key = self.key(topic, json.loads(payload))
+            except (ValueError, AttributeError):
+                merged.append((topic, payload))
+                continue
+
+            status_keys.add(key)
+            if not (prefer_cache and key in cached):
+                merged.append((topic, payload))
+
+        for key, (topic, event_type, payload) in cached.items():
+            if not self._accepts(topic, event_type):
+                continue
+            if prefer_cache or key not in status_keys:
+                merged.append((topic, self.as_status(payload)))
+        return merged
+
+    @staticmethod
+    def as_status(payload):
+        """
+        Marks a cached event as sent by the add-on, like the statuses, so it
+        isn't taken for a new event when it comes back
+        """
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return payload
+        return json.dumps({**data, "src": "homeassistant"})
+
+    def save(self):
+        with self._lock:
+            self._save_scheduled = False
+            entries = [[key, *entry] for key, entry in self._entries.items()]
+        save_json(self._data_path, self.FILE, entries)
@@ -0,0 +1,118 @@
+import threading
+
+from pyfimptoha.helpers.Deadband import Deadband
+from pyfimptoha.helpers.Throttle import Throttle
+from pyfimptoha.mqtt_client import Subscriptions
+
+
+class StateTranslator:
+    """
+    Translates FIMP events into plain entity states. Each FIMP event topic is
+    subscribed to once, the event is decoded once, and every entity built from
+    it gets its value extracted and published to its own state topic,
+    `fh/<identifier>/<name>`. Home Assistant then reads plain values instead of
+    evaluating a template per entity for every event.
+
+    Extractors are called with the decoded event and return the value to
+    publish, or None if the event isn't meant for the entity.
+
+    Translation of all states is only used by the components when `enabled`
+    (the translate_states option), otherwise only for the entities with a
+    throttle or deadband rule, see translates(). Components which always need it, like
+    the extended meter sensors, register regardless.
+
+    With `deadband_rules` small changes of numeric states are dropped, see
+    Deadband, and with `throttle_rules` the published states are rate limited,
+    see Throttle.
+    """
+    def __init__(self, mqtt, enabled=True, throttle_rules=None, deadband_rules=None):
+        self._mqtt = mqtt
+        self.enabled = enabled
+        self.deadband = Deadband(deadband_rules, self._send, mqtt.wheel) if deadband_rules else None
+        self.throttle = Throttle(throttle_rules, self._publish, mqtt.wheel) if throttle_rules else None
+        self._lock = threading.Lock()
+        # FIMP event topic -> state topic -> (extractor, only_changed)
+        self._extractors = {}
+        self._subscriptions = Subscriptions(mqtt)
+        # Last value published by state topic, for extractors registered with only_changed
+        self._last_values = {}
+
+    def translates(self, identifier):
+        """
+        Whether the state of `identifier` is translated: all states when
+        enabled, and otherwise those a rule applies to, as only translated
+        states can be limited
+        """
+        if self.enabled:
+            return True
+        return any(
+            limit is not None and limit.rule(identifier) is not None
+            for limit in (self.throttle, self.deadband)
+        )
+
+    def register(self, event_topic, identifier, extractor, name="state", only_changed=False):
+        """
+        Returns the state topic the values extracted for `identifier` are published to.
+        With `only_changed`, values equal to the last published one are skipped.
+        """
+        state_topic = f"fh/{identifier}/{name}"
+        with self._lock:
+            self._extractors.setdefault(event_topic, {})[state_topic] = (extractor, only_changed)
+        if self.deadband is not None:
+            self.deadband.add(state_topic, identifier)
+        if self.throttle is not None:
+            self.throttle.add(state_topic, identifier)
+
+        self._subscriptions.add(event_topic, on_dict_message=self.on_event)
+        return state_topic
+
+    def remove(self, event_topic):
+        """
+        Stops translating the events of a removed service
+        """
+        with self._lock:
+            state_topics = list(self._extractors.pop(event_topic, {}))
+            for state_topic in state_topics:
+                self._last_values.pop(state_topic, None)
+
+        for state_topic in state_topics:
+            if self.deadband is not None:
+                self.deadband.remove(state_topic)
+            if self.throttle is not None:
+                self.throttle.remove(state_topic)
+        self._subscriptions.remove(event_topic)
+
+    def on_event(self, msg, data):
+        with self._lock:
+            extractors = list(self._extractors.get(msg.topic, {}).items())
+
+        for state_topic, (extractor, only_changed) in extractors:
+            try:
+                value = extractor(data)
+            except (KeyError, TypeError, ValueError, AttributeError):
+                continue
+
+            if value is None:
+                continue
+
+            payload = str(value)
+            if only_changed:
+                with self._lock:
+                    if self._last_values.get(state_topic) == payload:
+                        continue
+                    self._last_values[state_topic] = payload
+
+            if self.deadband is not None and not self.deadband.offer(state_topic, payload):
+                continue
+
+            self._send(state_topic, payload)
+        return None
+
+    def _send(self, state_topic, payload):
+        if self.throttle is not None and not self.throttle.offer(state_topic, payload):
+            return
+        self._publish(state_topic, payload)
+
+    def _publish(self, state_topic, payload):
+        # Retained, so Home Assistant gets the last state when it (re)subscribes
+        self._mqtt.publish(state_topic, payload, retain=True)
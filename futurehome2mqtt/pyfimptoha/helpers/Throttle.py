@@ -0,0 +1,134 @@
+import threading
+import time
+
+from pyfimptoha.helpers.TimerWheel import TimerWheel
+
+
+def parse_rules(value):
+    """
+    Parses the throttle option: comma separated `<key>:<min interval>[:<max interval>]`,
+    in seconds. E.g. `meter_elec_W:5:300,meter_elec:10`
+    """
+    rules = []
+    # bashio passes "null" for an option that isn't set
+    if value is None or value.strip() == "null":
+        return rules
+
+    for rule in value.split(","):
+        rule = rule.strip()
+        if not rule:
+            continue
+
+        parts = rule.split(":")
+        try:
+            key = parts[0]
+            min_interval = float(parts[1])
+            max_interval = float(parts[2]) if len(parts) > 2 and parts[2] else None
+        except (IndexError, ValueError):
+            print(f"Ignoring invalid throttle rule: {rule}")
+            continue
+        rules.append((key, min_interval, max_interval))
+    return rules
+
+
+def match_rule(rules, identifier):
+    """
+    Returns the most specific rule whose key is the service, or the service
+    and unit, at the end of the entity identifier. `rules` must be sorted by
+    key length, longest first.
+    """
+    for rule in rules:
+        key = rule[0]
+        if identifier.endswith(f"_{key}") or f"_{key}_" in identifier:
+            return rule
+    return None
+
+
+class Throttle:
+    """
+    Limits how often the states published by the bridge are sent, by entity.
+
+    A state is published at most once per `min interval`. States arriving in
+    between are coalesced, and only the latest one is published once the
+    interval has passed, so the last value is always exact. With a
+    `max interval` the last state is published again when nothing was sent
+    for that long.
+
+    Rules are keyed on the service, or the service and unit, at the end of the
+    entity identifier (e.g. `meter_elec`, `meter_elec_W`, `sensor_temp`). The
+    most specific matching rule is used. Entities without a rule aren't limited.
+    """
+    def __init__(self, rules, publish, wheel: TimerWheel):
+        self._rules = sorted(rules, key=lambda rule: len(rule[0]), reverse=True)
+        self._publish = publish
+        self._wheel = wheel
+        self._lock = threading.Lock()
+        # (min interval, max interval) by state topic
+        self._limits = {}
+        self._last_sent = {}
+        self._last_payloads = {}
+        self._pending = {}
+
+    def add(self, state_topic, identifier):
+        rule = self.rule(identifier)
+        with self._lock:
+            if rule is None:
+                self._limits.pop(state_topic, None)
+            else:
+                self._limits[state_topic] = rule[1:]
+
+    def rule(self, identifier):
+        return match_rule(self._rules, identifier)
+
+    def remove(self, state_topic):
+        with self._lock:
+            self._limits.pop(state_topic, None)
+            self._last_sent.pop(state_topic, None)
+            self._last_payloads.pop(state_topic, None)
+            self._pending.pop(state_topic, None)
+        self._wheel.cancel(("throttle", state_topic))
+
+    def offer(self, state_topic, payload):
+        """
+        Returns whether `payload` can be published right away. If not, it is
+        kept and published by the throttle when the interval has passed.
+        """
+        limits = self._limits.get(state_topic)
+        if limits is None:
+            return True
+
+        min_interval, max_interval = limits
+        now = time.monotonic()
+        with self._lock:
+            last_sent = self._last_sent.get(state_topic)
+            if state_topic not in self._pending and (last_sent is None or now - last_sent >= min_interval):
+                self._sent(state_topic, payload, now, max_interval)
+                return True
+
+            if state_topic not in self._pending:
+                self._wheel.schedule(("throttle", state_topic), last_sent + min_interval - now, lambda: self._flush(state_topic))
+            self._pending[state_topic] = payload
+            return False
+
+    def _sent(self, state_topic, payload, now, max_interval):
+        self._last_sent[state_topic] = now
+        self._last_payloads[state_topic] = payload
+        if max_interval:
+            self._wheel.schedule(("throttle", state_topic), max_interval, lambda: self._flush(state_topic))
+
+    def _flush(self, state_topic):
+        """
+        Publishes the coalesced state, or the last one again when `max interval` has passed
+        """
+        with self._lock:
+            limits = self._limits.get(state_topic)
+            if limits is None:
+                return
+            payload = self._pending.pop(state_topic, None)
+            if payload is None:
+                payload = self._last_payloads.get(state_topic)
+            if payload is None:
+                return
+            self._sent(state_topic, payload, time.monotonic(), limits[1])
+
+        self._publish(state_topic, payload)
@@ -0,0 +1,82 @@
+import math
+import threading
+import time
+
+
+class TimerWheel:
+    """
+    Runs callbacks after a delay, for many keyed timers, on a single thread.
+
+    Timers are kept in a ring of slots, one slot per `tick`, so scheduling
+    and cancelling are O(1) and each tick only looks at one slot. Timers
+    further away than one turn of the wheel wait for their remaining rounds.
+    Scheduling a key again replaces its timer.
+
+    The thread sleeps while no timers are pending.
+    """
+    def __init__(self, tick=0.1, slots=512):
+        self._tick = tick
+        self._slots = [{} for _ in range(slots)]
+        # Slot by key
+        self._timers = {}
+        self._current = 0
+        self._next_tick = None
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def schedule(self, key, delay, callback):
+        with self._condition:
+            # Never fire early: count whole ticks after the next one
+            until_next_tick = self._tick if self._next_tick is None else self._next_tick - time.monotonic()
+            ticks = 1 + max(0, math.ceil((delay - until_next_tick) / self._tick))
+            self._cancel(key)
+            slot = (self._current + ticks) % len(self._slots)
+            rounds = (ticks - 1) // len(self._slots)
+            self._slots[slot][key] = [rounds, callback]
+            self._timers[key] = slot
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="timer-wheel", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def cancel(self, key):
+        with self._condition:
+            self._cancel(key)
+
+    def _cancel(self, key):
+        slot = self._timers.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._timers:
+                    self._next_tick = None
+                    self._condition.wait()
+
+                now = time.monotonic()
+                if self._next_tick is None:
+                    # Resuming, the pending timers were scheduled relative to now
+                    self._next_tick = now + self._tick
+                if now < self._next_tick:
+                    self._condition.wait(self._next_tick - now)
+                    continue
+
+                self._next_tick += self._tick
+                self._current = (self._current + 1) % len(self._slots)
+                due = []
+                for key, timer in list(self._slots[self._current].items()):
+                    if timer[0] > 0:
+                        timer[0] -= 1
+                        continue
+                    del self._slots[self._current][key]
+                    del self._timers[key]
+                    due.append(timer[1])
+
+            for callback in due:
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"Timer callback failed: {e}")
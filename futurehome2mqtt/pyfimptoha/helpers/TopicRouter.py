@@ -0,0 +1,80 @@
+class _Node:
+    __slots__ = ("children", "handlers")
+
+    def __init__(self):
+        self.children = {}
+        self.handlers = {}
+
+
+class TopicRouter:
+    """
+    Maps MQTT topic filters to handlers. Filters without wildcards are looked
+    up in a dict, filters with `+` or `#` are kept in a trie with one level per
+    topic level, so finding the handlers for a topic doesn't depend on the
+    number of registered filters.
+    """
+    def __init__(self):
+        self._exact = {}
+        self._root = _Node()
+
+    def add(self, topic_filter, id, handler):
+        if "+" not in topic_filter and "#" not in topic_filter:
+            self._exact.setdefault(topic_filter, {})[id] = handler
+            return
+
+        node = self._root
+        for level in topic_filter.split("/"):
+            node = node.children.setdefault(level, _Node())
+        node.handlers[id] = handler
+
+    def remove(self, topic_filter, id):
+        if "+" not in topic_filter and "#" not in topic_filter:
+            handlers = self._exact.get(topic_filter)
+            if handlers is not None:
+                handlers.pop(id, None)
+                if not handlers:
+                    del self._exact[topic_filter]
+            return
+
+        path = [self._root]
+        for level in topic_filter.split("/"):
+            node = path[-1].children.get(level)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].handlers.pop(id, None)
+
+        # Prune empty branches
+        levels = topic_filter.split("/")
+        for i in range(len(levels), 0, -1):
+            node = path[i]
+            if node.handlers or node.children:
+                break
+            del path[i - 1].children[levels[i - 1]]
+
+    def match(self, topic):
+        """
+        Returns all handlers whose filter matches `topic`
+        """
+        handlers = list(self._exact.get(topic, {}).values())
+        if self._root.children:
+            self._match(self._root, topic.split("/"), 0, handlers)
+        return handlers
+
+    def _match(self, node, levels, i, handlers):
+        multi = node.children.get("#")
+        if multi is not None:
+            # 'a/#' also matches 'a'
+            handlers.extend(multi.handlers.values())
+
+        if i == len(levels):
+            handlers.extend(node.handlers.values())
+            return
+
+        single = node.children.get("+")
+        if single is not None:
+            self._match(single, levels, i + 1, handlers)
+
+        child = node.children.get(levels[i])
+        if child is not None:
+            self._match(child, levels, i + 1, handlers)
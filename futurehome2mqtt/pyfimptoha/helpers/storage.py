@@ -0,0 +1,32 @@
+import json
+import os
+
+
+def load_json(data_path, filename):
+    """
+    Returns the content of a JSON file in the data directory, or None if it
+    doesn't exist or can't be read
+    """
+    path = os.path.join(data_path, filename)
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Could not read {path}: {e}")
+        return None
+
+
+def save_json(data_path, filename, data):
+    """
+    Writes to a temporary file first so a crash can't leave a partial file behind
+    """
+    path = os.path.join(data_path, filename)
+    try:
+        os.makedirs(data_path, exist_ok=True)
+        with open(path + ".tmp", "w") as json_file:
+            json.dump(data, json_file, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"Could not save {path}: {e}")
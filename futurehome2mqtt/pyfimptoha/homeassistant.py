@@ -1,5 +1,3 @@
-import time
-
 import pyfimptoha.sensor as sensor
 import pyfimptoha.meter_elec as meter_elec
 import pyfimptoha.chargepoint as chargepoint
@@ -9,10 +7,13 @@ import pyfimptoha.appliance as appliance
 import pyfimptoha.thermostat as thermostat
 import pyfimptoha.shortcut as shortcut_button
 import pyfimptoha.mode as mode_select
-from pyfimptoha.helpers.MqttDevice import MqttDevice
+import pyfimptoha.device_state as device_state
+from pyfimptoha.helpers.DiscoveryIndex import DiscoveryIndex
 from pyfimptoha.mqtt_client import MqttClient
 
 SUPPORTED_SENSORS = ["battery", "sensor_lumin", "sensor_presence", "sensor_temp", "sensor_humid", "sensor_contact"]
+# Services polled when they don't report by themselves, see PollScheduler
+POLLED_SERVICES = ["meter_elec"]
 
 
 def create_components(
@@ -23,11 +24,92 @@ def create_components(
         mqtt: MqttClient,
         selected_devices_mode: str,
         selected_devices: list,
-        debug: bool
+        debug: bool,
+        state=None
 ):
     """
     Creates HA components out of FIMP devices
-    by pushing them to Home Assistant using MQTT discovery
+    by pushing them to Home Assistant using MQTT discovery.
+    `state` is the vinculum response with the values of all devices, see device_state.
+    Returns the published statuses.
+    """
+
+    statuses, get_reports_list, chargepoints = create_device_components(
+        devices, rooms, mqtt, selected_devices_mode, selected_devices, debug
+    )
+
+    if chargepoints:
+        print(f"Asking {len(chargepoints)} chargepoints for max_current")
+        max_currents = chargepoint.get_max_currents(
+            mqtt,
+            [mqtt_device.get_service("chargepoint") for mqtt_device in chargepoints]
+        )
+        get_reports_list.extend(create_chargepoints(mqtt, chargepoints, max_currents, debug))
+
+    if state is not None:
+        statuses, get_reports_list = device_state.apply(state, mqtt.is_entity_report, statuses, get_reports_list)
+
+    publish_get_reports(mqtt, get_reports_list)
+    statuses.extend(create_hub_components(mqtt, mode, shortcuts, debug))
+
+    # Statuses are only useful once Home Assistant knows the entities
+    if not mqtt.flush():
+        print("Timed out waiting for the components to be sent")
+    publish_statuses(mqtt, statuses, debug)
+    return statuses
+
+
+async def create_components_async(
+        devices: list,
+        rooms: list,
+        shortcuts: list,
+        mode: str,
+        mqtt,
+        selected_devices_mode: str,
+        selected_devices: list,
+        debug: bool,
+        state=None
+):
+    """
+    Same as `create_components`, but runs on the event loop of an
+    `AsyncMqttClient`, waiting for the discovery configs to be sent
+    without blocking the loop.
+    """
+
+    statuses, get_reports_list, chargepoints = create_device_components(
+        devices, rooms, mqtt, selected_devices_mode, selected_devices, debug
+    )
+
+    if chargepoints:
+        print(f"Asking {len(chargepoints)} chargepoints for max_current")
+        max_currents = await chargepoint.get_max_currents_async(
+            mqtt,
+            [mqtt_device.get_service("chargepoint") for mqtt_device in chargepoints]
+        )
+        get_reports_list.extend(create_chargepoints(mqtt, chargepoints, max_currents, debug))
+
+    if state is not None:
+        statuses, get_reports_list = device_state.apply(state, mqtt.is_entity_report, statuses, get_reports_list)
+
+    publish_get_reports(mqtt, get_reports_list)
+    statuses.extend(create_hub_components(mqtt, mode, shortcuts, debug))
+
+    await mqtt.flush()
+    publish_statuses(mqtt, statuses, debug)
+    return statuses
+
+
+def create_device_components(
+        devices: list,
+        rooms: list,
+        mqtt: MqttClient,
+        selected_devices_mode: str,
+        selected_devices: list,
+        debug: bool
+):
+    """
+    Publishes discovery configs for all devices. Chargepoints are returned
+    separately as they need max_current before they can be created.
     """
 
     print('Received list of devices from FIMP. FIMP reported %s devices' % (len(devices)))
@@ -35,142 +117,208 @@ def create_components(
 
     get_reports_list = []
     statuses = []
+    chargepoints = []
+    index = DiscoveryIndex(devices, rooms)
 
     for device in devices:
-        # Skip device without room
-        room_id = device["room"]
-        if room_id is None:
-            continue
-
-        mqtt_device = MqttDevice(
-            device_data=device,
-            room_alias=get_room_alias(rooms, room_id)
+        mqtt.discovery_registry.owner = device_owner(device)
+        device_statuses, device_get_reports, chargepoint_device = create_device(
+            device, index, mqtt, selected_devices_mode, selected_devices, debug
         )
-        address = device["fimp"]["address"]
-        adapter = mqtt_device.adapter
-        name = device["client"]["name"]
-        vinc_id = device["id"]
-        functionality = device["functionality"]
-
-        # When debugging you have the option to (only) include or exclude (some) devices
-        # depending on 'selected_devices_mode'.
-        # Format is '<adapter_<address>', to not have conflicting addresses on different adapters
-        if selected_devices_mode != "default":
-            if selected_devices_mode == "include" and selected_devices and f"{adapter}_{address}" not in selected_devices:
-                if debug:
-                    print(f"Skipping: {adapter} {address} {name}")
-                continue
-            elif selected_devices_mode == "exclude" and f"{adapter}_{address}" in selected_devices:
-                if debug:
-                    print(f"Skipping: {adapter} {address} {name} has been configured to be excluded")
-                continue
+        statuses.extend(device_statuses)
+        get_reports_list.extend(device_get_reports)
+        if chargepoint_device is not None:
+            chargepoints.append(chargepoint_device)
 
-        if debug:
-            print(f"Creating: {adapter} {address} {name}")
-            print(f"- Functionality: {functionality}")
-
-        device_services = device["services"].keys()
-        for service_name, service in device["services"].items():
-            status = None
-
-            # Reusable
-            identifier = f"fh_{vinc_id}_{adapter}_{address}_{service_name}"
-            state_topic = f"pt:j1/mt:evt{service['addr']}"
-            command_topic = f"pt:j1/mt:cmd{service['addr']}"
-            model = device["model"] if device.get("model") and device["model"] else ""
-            model_alias = device["modelAlias"] if device.get("modelAlias") and device["modelAlias"] else model
-            default_component = {
-                "name": None,
-                "object_id": identifier,
-                "unique_id": identifier,
-                "device": {
-                    "identifiers": f"{adapter}_{address}",
-                    "name": f"{name}",
-                    "suggested_area": f"{mqtt_device.room_alias}",
-                    "hw_version": f"{model}",
-                    "model": f"{model_alias}",
-                    "sw_version": f"{adapter}_{address}"
-                },
-                "state_topic": state_topic
-            }
-            common_params = {
-                "mqtt": mqtt,
-                "device": device,
-                "state_topic": state_topic,
-                "identifier": identifier,
-                "default_component": default_component
-            }
-
-
-            # Sensors
-            # todo add more sensors: alarm_power?, sensor_power. see old sensor.py
-            if service_name in SUPPORTED_SENSORS:
-                if debug:
-                    print(f"- Service: {service_name}")
-                status = sensor.new_sensor(**common_params, service_name=service_name)
-                if status:
-                    statuses.append(status)
+    return statuses, get_reports_list, chargepoints
 
-            # Meter_elec
-            elif service_name == "meter_elec":
-                if debug:
-                    print(f"- Service: {service_name}")
-                status = meter_elec.new_sensor(**common_params, service_name=service_name)
-                if status:
-                    for s in status:
-                        statuses.append((s[0], s[1]))
 
-            # Door lock
-            elif service_name == "door_lock":
-                if debug:
-                    print(f"- Service: {service_name}")
-                status = lock.door_lock(**common_params, command_topic=command_topic)
-                if status:
-                    statuses.append(status)
-
-            # Appliance
-            elif functionality == "appliance" or device["type"]["type"] == "boiler":
-                if service_name == "out_bin_switch":
-                    if debug:
-                        print(f"- Service: {service_name}")
-                    status = appliance.new_switch(**common_params, command_topic=command_topic)
-                if status:
-                    statuses.append(status)
-
-            # Thermostat
-            elif service_name == "thermostat":
+def device_owner(device):
+    """
+    Key used to track which discovery configs belong to a device
+    """
+    return f"device_{device['id']}"
+
+
+def create_device(
+        device: dict,
+        index: DiscoveryIndex,
+        mqtt: MqttClient,
+        selected_devices_mode: str,
+        selected_devices: list,
+        debug: bool
+):
+    """
+    Publishes discovery configs for one device.
+    Returns its statuses, get_report requests and the device itself if it is a chargepoint.
+    """
+
+    get_reports_list = []
+    statuses = []
+    # Services with entities, whose reports are tracked, see track_entity_reports
+    entity_services = []
+    forget_entity_reports(mqtt, device)
+
+    # Skip device without room
+    room_id = device["room"]
+    if room_id is None:
+        return [], [], None
+
+    mqtt_device = index.mqtt_device(device)
+    address = mqtt_device.address
+    adapter = mqtt_device.adapter
+    name = device["client"]["name"]
+    functionality = device["functionality"]
+
+    # When debugging you have the option to (only) include or exclude (some) devices
+    # depending on 'selected_devices_mode'.
+    # Format is '<adapter_<address>', to not have conflicting addresses on different adapters
+    if selected_devices_mode != "default":
+        if selected_devices_mode == "include" and selected_devices and f"{adapter}_{address}" not in selected_devices:
+            if debug:
+                print(f"Skipping: {adapter} {address} {name}")
+            return [], [], None
+        elif selected_devices_mode == "exclude" and f"{adapter}_{address}" in selected_devices:
+            if debug:
+                print(f"Skipping: {adapter} {address} {name} has been configured to be excluded")
+            return [], [], None
+
+    if debug:
+        print(f"Creating: {adapter} {address} {name}")
+        print(f"- Functionality: {functionality}")
+
+    for service_name, service in mqtt_device.get_services().items():
+        status = None
+
+        # Reusable
+        command_topic = service.command_topic
+        common_params = service.get_common_params(mqtt)
+
+        # Sensors
+        # todo add more sensors: alarm_power?, sensor_power. see old sensor.py
+        if service_name in SUPPORTED_SENSORS:
+            if debug:
+                print(f"- Service: {service_name}")
+            status = sensor.new_sensor(**common_params, service_name=service_name)
+            entity_services.append(service)
+            if status:
+                statuses.append(status)
+
+        # Meter_elec
+        elif service_name == "meter_elec":
+            if debug:
+                print(f"- Service: {service_name}")
+            status = meter_elec.new_sensor(**common_params, service_name=service_name)
+            entity_services.append(service)
+            if status:
+                for s in status:
+                    statuses.append((s[0], s[1]))
+
+        # Door lock
+        elif service_name == "door_lock":
+            if debug:
+                print(f"- Service: {service_name}")
+            status = lock.door_lock(**common_params, command_topic=command_topic)
+            entity_services.append(service)
+            if status:
+                statuses.append(status)
+
+        # Appliance
+        elif functionality == "appliance" or device["type"]["type"] == "boiler":
+            if service_name == "out_bin_switch":
                 if debug:
                     print(f"- Service: {service_name}")
-                status = thermostat.new_thermostat(**common_params, command_topic=command_topic, devices=devices)
-                if status:
-                    for s in status:
-                        statuses.append((s[0], s[1]))
+                status = appliance.new_switch(**common_params, command_topic=command_topic)
+                entity_services.append(service)
+            if status:
+                statuses.append(status)
 
-        if mqtt_device.has_service("chargepoint"):
+        # Thermostat
+        elif service_name == "thermostat":
             if debug:
-                print("- Service: chargepoint")
+                print(f"- Service: {service_name}")
+            status = thermostat.new_thermostat(**common_params, command_topic=command_topic, index=index)
+            entity_services.append(service)
+            if status:
+                for s in status:
+                    statuses.append((s[0], s[1]))
 
-            get_reports_list.extend(
-                chargepoint.chargepoint(mqtt, mqtt_device)
-            )
+        if service_name in POLLED_SERVICES and mqtt.poll_scheduler is not None:
+            # Meters are asked for each of their units, a plain get_report only gets one
+            units = (service.service_data.get("props") or {}).get("sup_units") or [None]
+            for topic, serv, report_name in service.get_reports_info():
+                for unit in units if report_name == "cmd.meter.get_report" else [None]:
+                    mqtt.poll_scheduler.add(topic, serv, report_name, unit)
 
-        if mqtt_device.functionality == "lighting":
-            if debug:
-                print("- Service: lightning")
-            get_reports_list.extend(
-                light.new_light_v2(mqtt, mqtt_device)
+    chargepoint_device = None
+    if mqtt_device.has_service("chargepoint"):
+        # Created by the caller, once max_current is known
+        chargepoint_device = mqtt_device
+        entity_services.append(mqtt_device.get_service("chargepoint"))
+
+    if mqtt_device.functionality == "lighting":
+        if debug:
+            print("- Service: lightning")
+        light_get_reports = light.new_light_v2(mqtt, mqtt_device)
+        if light_get_reports is not None:
+            get_reports_list.extend(light_get_reports)
+            entity_services.extend(
+                service for service_name, service in mqtt_device.get_services().items()
+                if service_name in ["color_ctrl", "out_lvl_switch", "out_bin_switch"]
             )
 
-    print(f"Publishing {len(get_reports_list)} get_report requests")
-    for topic, service, report_name in get_reports_list:
-        mqtt.publish_dict(topic, {
-            "serv": service,
-            "src": "homeassistant",
-            "type": report_name,
-            "val_t": "null",
-            "val": None,
-        })
-    print(f"Done publishing get_report requests")
+    track_entity_reports(mqtt, entity_services)
+    return statuses, get_reports_list, chargepoint_device
+
+
+def track_entity_reports(mqtt, services):
+    """
+    Records the state reports the entities of `services` are built from,
+    the only events the state cache keeps and replays
+    """
+    if mqtt.entity_reports is None:
+        return
+    for service in services:
+        mqtt.entity_reports[service.state_topic] = service.get_state_reports()
+
+
+def forget_entity_reports(mqtt, device):
+    """
+    Forgets the state reports of a device being rebuilt or removed
+    """
+    if mqtt.entity_reports is None:
+        return
+    for service in device["services"].values():
+        mqtt.entity_reports.pop(f"pt:j1/mt:evt{service['addr']}", None)
+
+
+def create_chargepoints(mqtt, chargepoints, max_currents, debug):
+    get_reports_list = []
+    for mqtt_device in chargepoints:
+        mqtt.discovery_registry.owner = device_owner(mqtt_device.device_data)
+        if debug:
+            print(f"- Service: chargepoint ({mqtt_device.adapter} {mqtt_device.address})")
+        identifier = mqtt_device.get_service("chargepoint").identifier
+        get_reports_list.extend(
+            chargepoint.chargepoint(mqtt, mqtt_device, max_currents.get(identifier))
+        )
+    return get_reports_list
+
+
+def publish_get_reports(mqtt, get_reports_list):
+    """
+    Queues the get_report requests, which are sent paced per adapter, see ReportScheduler
+    """
+    print(f"Queueing {len(get_reports_list)} get_report requests")
+    mqtt.report_scheduler.add(get_reports_list)
+
+
+def create_hub_components(mqtt, mode, shortcuts, debug):
+    """
+    Creates the mode select and shortcut buttons on the Futurehome Smarthub device
+    """
+    statuses = []
+    mqtt.discovery_registry.owner = "hub"
 
     # Mode select (home, away, sleep, vacation)
     status = None
@@ -185,9 +333,15 @@ def create_components(
     for shortcut in shortcuts:
         shortcut_button.new_button(mqtt, shortcut, debug)
 
+    return statuses
+
 
-    time.sleep(2)
+def publish_statuses(mqtt, statuses, debug):
     print("Publishing statuses...")
+    mqtt.discovery_statuses = statuses
+    # The hub's statuses are the freshest, the cached events fill in the rest
+    if mqtt.state_cache is not None:
+        statuses = mqtt.state_cache.merge(statuses, prefer_cache=False)
     for state in statuses:
         topic = state[0]
         payload = state[1]
@@ -195,7 +349,3 @@ def create_components(
         if debug:
             print(topic)
     print("Finished pushing statuses...")
-
-def get_room_alias(rooms, room_id):
-    room_alias = [room["alias"] for room in rooms if room["id"] == room_id][0]
-    return room_alias
@@ -0,0 +1,329 @@
+import json
+import threading
+from contextlib import contextmanager
+
+import pyfimptoha.chargepoint as chargepoint
+import pyfimptoha.homeassistant as homeassistant
+import pyfimptoha.snapshot as snapshot
+from pyfimptoha.helpers.DiscoveryIndex import DiscoveryIndex
+from pyfimptoha.mqtt_client import MqttCallback, MqttClient
+
+topic_vinculum_evt = "pt:j1/mt:evt/rt:app/rn:vinculum/ad:1"
+NOTIFY_COMPONENTS = ["device", "room", "shortcut"]
+
+
+class IncrementalDiscovery:
+    """
+    Keeps Home Assistant in sync with changes made on the hub after the first
+    discovery pass. Vinculum announces changes to devices, rooms and shortcuts
+    with evt.pd7.notify. Only the components of the affected devices are
+    rebuilt with the regular builders, and only the difference is published.
+
+    Nothing here blocks, as it runs in the MQTT network thread (or on the
+    event loop in asyncio mode). For the same reason nothing may raise: an
+    exception would stop the network thread, so a malformed notification
+    or device is logged and skipped.
+    """
+    def __init__(
+            self,
+            mqtt: MqttClient,
+            command_topic: str,
+            response_topic: str,
+            discover_request: dict,
+            is_correct,
+            selected_devices_mode: str,
+            selected_devices: list,
+            debug: bool
+    ):
+        self._mqtt = mqtt
+        self._command_topic = command_topic
+        self._response_topic = response_topic
+        self._discover_request = discover_request
+        self._is_correct = is_correct
+        self._selected_devices_mode = selected_devices_mode
+        self._selected_devices = selected_devices
+        self._debug = debug
+
+        self._lock = threading.RLock()
+        self._devices = {}
+        self._rooms = []
+        self._shortcuts = []
+        self._mode = None
+        self._index = DiscoveryIndex([], [])
+        self._refresh_scheduled = False
+
+    def start(self, param):
+        """
+        Starts listening for changes, `param` is what the full discovery pass was built from
+        """
+        with self._lock:
+            self._devices = {device["id"]: device for device in param["device"]}
+            self._rooms = param["room"]
+            self._shortcuts = param["shortcut"]
+            self._mode = param["house"]["mode"]
+            self._index = DiscoveryIndex(param["device"], self._rooms)
+
+        self._mqtt.add_callback(MqttCallback(
+            topic_to_subscribe=topic_vinculum_evt,
+            on_dict_message=self.on_notify
+        ))
+
+    def on_notify(self, msg, data):
+        try:
+            self._on_notify(data)
+        except Exception as e:
+            print(f"Failed to handle vinculum notify: {e}")
+        return None
+
+    def _on_notify(self, data):
+        if data.get("type") != "evt.pd7.notify" or not isinstance(data.get("val"), dict):
+            return
+
+        val = data["val"]
+        component = val.get("component")
+        cmd = val.get("cmd")
+        if component not in NOTIFY_COMPONENTS:
+            return
+
+        if self._debug:
+            print(f"Vinculum notify: {cmd} {component} {val.get('id')}")
+
+        if component == "device" and cmd == "delete":
+            self.remove_device(val.get("id"))
+        elif component == "device" and is_full_device(val.get("param")):
+            self.update_devices([val["param"]])
+        else:
+            # Rooms, shortcuts and partial device updates need the current lists
+            self.schedule_refresh()
+
+    def schedule_refresh(self, delay=1):
+        """
+        Fetches the device, room and shortcut lists once for a burst of notifications
+        """
+        with self._lock:
+            if self._refresh_scheduled:
+                return
+            self._refresh_scheduled = True
+
+        self._mqtt.call_later(delay, self._refresh)
+
+    def _refresh(self):
+        with self._lock:
+            self._refresh_scheduled = False
+
+        self._mqtt.send_request(
+            self._command_topic,
+            self._response_topic,
+            self._discover_request,
+            self._is_correct,
+            on_response=self._on_refresh,
+            timeout=10
+        )
+
+    def _on_refresh(self, response):
+        if response is None:
+            print("No response from FIMP when refreshing devices")
+            return
+
+        msg, data = response
+        val = data.get("val")
+        param = val.get("param") if isinstance(val, dict) else None
+        if not is_discovery_param(param):
+            print("Unexpected response from FIMP when refreshing devices")
+            return
+
+        try:
+            self._refreshed(param)
+        except Exception as e:
+            print(f"Failed to refresh devices: {e}")
+
+    def _refreshed(self, param):
+        with self._lock:
+            old_aliases = {room["id"]: room["alias"] for room in self._rooms}
+            changed_rooms = {
+                room["id"] for room in param["room"] if old_aliases.get(room["id"]) != room["alias"]
+            }
+            self._rooms = param["room"]
+            self._mode = param["house"].get("mode")
+
+            devices = {device["id"]: device for device in param["device"]}
+            changed = [
+                device for device_id, device in devices.items()
+                if device_id not in self._devices
+                or device_fingerprint(device) != device_fingerprint(self._devices[device_id])
+                or device["room"] in changed_rooms
+            ]
+            removed = [device_id for device_id in self._devices if device_id not in devices]
+
+            shortcuts_changed = param["shortcut"] != self._shortcuts
+            self._shortcuts = param["shortcut"]
+
+        for device_id in removed:
+            self.remove_device(device_id)
+
+        if changed:
+            self.update_devices(changed, devices)
+
+        if shortcuts_changed:
+            self.update_hub()
+
+    def update_devices(self, changed, devices=None):
+        """
+        Rebuilds the given devices, and devices sharing a thing with them
+        (e.g. a thermostat using the temperature sensor of another channel)
+        """
+        with self._lock:
+            if devices is None:
+                devices = {**self._devices, **{device["id"]: device for device in changed}}
+            self._devices = devices
+            self._index = DiscoveryIndex(devices.values(), self._rooms)
+
+            affected = {device["id"]: device for device in changed}
+            for device in changed:
+                for sibling in self._index.thing_devices(device.get("thing")):
+                    affected.setdefault(sibling["id"], sibling)
+
+        print(f"Updating {len(affected)} devices changed on the hub")
+        for device in affected.values():
+            self.rebuild_device(device)
+
+    def rebuild_device(self, device):
+        if device["room"] is not None and "chargepoint" in device["services"]:
+            # The number entity needs max_current, build once it's known
+            service = self._index.mqtt_device(device).get_service("chargepoint")
+            chargepoint.request_max_current(
+                self._mqtt,
+                service,
+                on_response=lambda response: self._build_device(
+                    device, response[1].get("val") if response is not None else None
+                )
+            )
+        else:
+            self._build_device(device, None)
+
+    def _build_device(self, device, max_current):
+        try:
+            with self._lock, self._discovery_pass(homeassistant.device_owner(device)):
+                statuses, get_reports_list, chargepoint_device = homeassistant.create_device(
+                    device,
+                    self._index,
+                    self._mqtt,
+                    self._selected_devices_mode,
+                    self._selected_devices,
+                    self._debug
+                )
+                if chargepoint_device is not None:
+                    identifier = chargepoint_device.get_service("chargepoint").identifier
+                    get_reports_list.extend(homeassistant.create_chargepoints(
+                        self._mqtt, [chargepoint_device], {identifier: max_current}, self._debug
+                    ))
+        except Exception as e:
+            print(f"Failed to update device {device.get('id')}: {e}")
+            return
+
+        with self._lock:
+            self._replace_statuses(device_topics(device), statuses)
+
+        homeassistant.publish_get_reports(self._mqtt, get_reports_list)
+        self._publish_statuses(statuses)
+
+    def remove_device(self, device_id):
+        with self._lock:
+            device = self._devices.pop(device_id, None)
+            if device is None:
+                return
+            self._index = DiscoveryIndex(self._devices.values(), self._rooms)
+
+            print(f"Removing device {device_id}, deleted on the hub")
+            with self._discovery_pass(homeassistant.device_owner(device)):
+                pass
+            self._replace_statuses(device_topics(device), [])
+            homeassistant.forget_entity_reports(self._mqtt, device)
+            if self._mqtt.translator is not None:
+                for topic in device_topics(device):
+                    self._mqtt.translator.remove(topic)
+            if self._mqtt.state_cache is not None:
+                self._mqtt.state_cache.remove(device_topics(device))
+            if self._mqtt.poll_scheduler is not None:
+                for topic in device_topics(device):
+                    self._mqtt.poll_scheduler.remove(topic)
+            if self._mqtt.aggregator is not None:
+                for topic in device_topics(device):
+                    self._mqtt.aggregator.remove(topic)
+            if self._mqtt.energy_integrator is not None:
+                for topic in device_topics(device):
+                    self._mqtt.energy_integrator.remove(topic)
+            if self._mqtt.command_coalescer is not None:
+                for topic in device_topics(device):
+                    self._mqtt.command_coalescer.remove(topic)
+        self._save_snapshot()
+
+    def update_hub(self):
+        with self._lock:
+            with self._discovery_pass("hub"):
+                statuses = homeassistant.create_hub_components(
+                    self._mqtt, self._mode, self._shortcuts, self._debug
+                )
+            topics = {topic for topic, payload in statuses}
+            self._replace_statuses(topics, statuses)
+
+        self._publish_statuses(statuses)
+
+    @contextmanager
+    def _discovery_pass(self, owner):
+        """
+        Publishes the components of `owner` built in the block and removes
+        the ones not built again. If building fails the old components are
+        kept, rather than removing the ones not built yet.
+        """
+        self._mqtt.begin_discovery(owner)
+        try:
+            yield
+        except Exception:
+            self._mqtt.abort_discovery()
+            raise
+        self._mqtt.end_discovery()
+
+    def _replace_statuses(self, topics, statuses):
+        self._mqtt.discovery_statuses = [
+            status for status in self._mqtt.discovery_statuses if status[0] not in topics
+        ] + list(statuses)
+
+    def _publish_statuses(self, statuses):
+        self._save_snapshot()
+        if statuses:
+            # Give Home Assistant a moment to set up the entities before sending their state
+            self._mqtt.call_later(0.5, lambda: self._mqtt.publish_statuses(statuses))
+
+    def _save_snapshot(self):
+        if self._mqtt._discovery_snapshot:
+            snapshot.save(self._mqtt._data_path, self._mqtt.discovery_configs, self._mqtt.discovery_statuses)
+
+
+def is_discovery_param(param):
+    return (
+        isinstance(param, dict)
+        and isinstance(param.get("device"), list)
+        and isinstance(param.get("room"), list)
+        and isinstance(param.get("shortcut"), list)
+        and isinstance(param.get("house"), dict)
+    )
+
+
+def is_full_device(param):
+    return isinstance(param, dict) and "id" in param and "services" in param and "fimp" in param
+
+
+def device_fingerprint(device):
+    """
+    Everything the components are built from, except the device state in `param`
+    """
+    return json.dumps({key: value for key, value in device.items() if key != "param"}, sort_keys=True)
+
+
+def device_topics(device):
+    topics = set()
+    for service in device["services"].values():
+        topics.add(f"pt:j1/mt:evt{service['addr']}")
+        topics.add(f"pt:j1/mt:cmd{service['addr']}")
+    return topics
@@ -1,4 +1,5 @@
 import json
+import pyfimptoha.coalescing as coalescing
 from pyfimptoha.helpers.MqttDevice import MqttDevice
 
 def new_light_v2(mqtt, device: MqttDevice):
@@ -17,7 +18,7 @@ def new_light_v2(mqtt, device: MqttDevice):
     light_component = {
         # "schema": "template",
         "state_topic": device_services["out_bin_switch"].state_topic,
-        "command_topic": device_services["out_bin_switch"].command_topic,
+        "command_topic": coalescing.command_topic(mqtt, device_services["out_bin_switch"].command_topic, main_service.identifier),
         "state_value_template": "{% if value_json.val %}" + payload_on + "{% else %}" + payload_off + "{% endif %}",
         "payload_on": payload_on,
         "payload_off": payload_off
@@ -27,7 +28,9 @@ def new_light_v2(mqtt, device: MqttDevice):
         light_component = {
             **light_component,
             "brightness_state_topic": device_services["out_lvl_switch"].state_topic,
-            "brightness_command_topic": device_services["out_lvl_switch"].command_topic,
+            "brightness_command_topic": coalescing.command_topic(
+                mqtt, device_services["out_lvl_switch"].command_topic, main_service.identifier
+            ),
             "brightness_value_template": "{{ value_json.val | int }}",
             "brightness_command_template": """
                 {
@@ -50,7 +53,7 @@ def new_light_v2(mqtt, device: MqttDevice):
                 **light_component,
                 "color_temp_kelvin": True,
                 "color_temp_state_topic": color_ctrl.state_topic,
-                "color_temp_command_topic": color_ctrl.command_topic,
+                "color_temp_command_topic": coalescing.command_topic(mqtt, color_ctrl.command_topic, main_service.identifier),
                 "color_temp_value_template": "{{ (1000000 / value_json.val.temp) | int }}",
                 "color_temp_command_template": """
                     {
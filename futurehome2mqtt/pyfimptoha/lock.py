@@ -1,6 +1,8 @@
 import json
 import typing
 
+import pyfimptoha.translation as translation
+
 
 def door_lock(
         mqtt,
@@ -43,6 +45,9 @@ def door_lock(
 
     # Merge default_component with lock_component
     merged_component = {**default_component, **lock_component}
+    merged_component = translation.apply(
+        mqtt, merged_component, lambda data: translation.locked(data["val"]["is_secured"])
+    )
 
     payload = json.dumps(merged_component)
     mqtt.publish(f"homeassistant/lock/{identifier}/config", payload)
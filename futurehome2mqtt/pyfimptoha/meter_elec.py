@@ -1,5 +1,7 @@
 import json
 
+import pyfimptoha.translation as translation
+
 
 def new_sensor(
         mqtt,
@@ -39,9 +41,10 @@ def meter_elec_sensor(
                 {{{{ value_json.val | round(1) }}}}
             {{% endif %}}
         """
+        extractor = unit_value(unit)
 
         if unit == "kWh":
-            create_sensor("(energi)", "energy", "total_increasing", "kWh", value_template, identifier, default_component, mqtt)
+            create_sensor("(energi)", "energy", "total_increasing", "kWh", value_template, identifier, default_component, mqtt, extractor)
 
             # Queue statuses
             payload = queue_status(
@@ -56,7 +59,8 @@ def meter_elec_sensor(
                 statuses.append((state_topic, payload))
 
         elif unit == "W":
-            create_sensor("(forbruk)", "power", "measurement", "W", value_template, identifier, default_component, mqtt)
+            create_sensor("(forbruk)", "power", "measurement", "W", value_template, identifier, default_component, mqtt, extractor)
+            create_aggregate_sensors("(forbruk)", "power", "W", identifier, default_component, mqtt, extractor)
 
             # Queue statuses
             payload = queue_status(
@@ -71,16 +75,25 @@ def meter_elec_sensor(
                 statuses.append((state_topic, payload))
 
         elif unit == "V":
-            create_sensor("(volt)", "voltage", "measurement", "V", value_template, identifier, default_component, mqtt)
+            create_sensor("(volt)", "voltage", "measurement", "V", value_template, identifier, default_component, mqtt, extractor)
 
             # Queue statuses
-            # TODO: Status will be 'unknown' until first report.
+            # Not in the params, comes from the bulk state or polling, see device_state and PollScheduler
 
         elif unit == "A":
-            create_sensor("(amp)", "current", "measurement", "A", value_template, identifier, default_component, mqtt)
+            create_sensor("(amp)", "current", "measurement", "A", value_template, identifier, default_component, mqtt, extractor)
 
             # Queue statuses
-            # TODO: Status will be 'unknown' until first report.
+            # Not in the params, comes from the bulk state or polling, see device_state and PollScheduler
+
+    if "W" in sup_units and "kWh" not in sup_units and mqtt.energy_integrator is not None:
+        # Energy integrated from the power by the add-on
+        identifier = f"{identifier_for_unit}_kWh_integrated"
+        energy_topic = mqtt.energy_integrator.register(state_topic, identifier, unit_value("W"))
+        create_sensor(
+            "(energi)", "energy", "total_increasing", "kWh", "{{ value }}", identifier,
+            {**default_component, "state_topic": energy_topic}, mqtt
+        )
 
     return statuses
 
@@ -123,39 +136,65 @@ def meter_elec_ext_sensor(
                 {{{{ value_json.val.{ext_val} | round(1) }}}}
             {{% endif %}}
         """
+        # Published by the bridge, one topic per value, see translation.split
+        extractor = ext_value(ext_val)
 
         if ext_val in ["u1", "u2", "u3"]:
-            create_sensor(ext_val, "voltage", "measurement", "V", value_template, identifier, default_component, mqtt)
+            create_sensor(ext_val, "voltage", "measurement", "V", value_template, identifier, default_component, mqtt, extractor, split=True)
 
             # Queue statuses
-            # TODO: Status will be 'unknown' until first report
+            # Not in the params, comes from the bulk state or polling, see device_state and PollScheduler
 
         elif ext_val in ["i1", "i2", "i3"]:
-            create_sensor(ext_val, "current", "measurement", "A", value_template, identifier, default_component, mqtt)
+            create_sensor(ext_val, "current", "measurement", "A", value_template, identifier, default_component, mqtt, extractor, split=True)
 
             # Queue statuses
-            # TODO: Status will be 'unknown' until first report
+            # Not in the params, comes from the bulk state or polling, see device_state and PollScheduler
 
         elif ext_val in ["p_import"]:
-            create_sensor(ext_val, "power", "measurement", "W", value_template, identifier, default_component, mqtt)
+            create_sensor(ext_val, "power", "measurement", "W", value_template, identifier, default_component, mqtt, extractor, split=True)
 
             # Queue statuses
-            # TODO: Status will be 'unknown' until first report
+            # Not in the params, comes from the bulk state or polling, see device_state and PollScheduler
 
         elif ext_val in ["e_import"]:
-            create_sensor(ext_val, "energy", "total_increasing", "kWh", value_template, identifier, default_component, mqtt)
+            create_sensor(ext_val, "energy", "total_increasing", "kWh", value_template, identifier, default_component, mqtt, extractor, split=True)
 
             # Queue statuses
-            # TODO: Status will be 'unknown' until first report
+            # Not in the params, comes from the bulk state or polling, see device_state and PollScheduler
 
         elif ext_val in ["p_import_react", "p_export_react"]:
-            create_sensor(ext_val, "reactive_power", "measurement", "var", value_template, identifier, default_component, mqtt)
+            create_sensor(ext_val, "reactive_power", "measurement", "var", value_template, identifier, default_component, mqtt, extractor, split=True)
 
             # Queue statuses
-            # TODO: Status will be 'unknown' until first report
+            # Not in the params, comes from the bulk state or polling, see device_state and PollScheduler
+
 
+def unit_value(unit):
+    """
+    Extracts the value of meter reports in `unit`, see translation.py
+    """
+    def extract(data):
+        if data["props"]["unit"] != unit:
+            return None
+        return round(float(data["val"]), 1)
 
-def create_sensor(name, device_class, state_class, unit_of_measurement, value_template, identifier, default_component, mqtt):
+    return extract
+
+
+def ext_value(ext_val):
+    """
+    Extracts one value of extended meter reports, see translation.py
+    """
+    def extract(data):
+        if data["type"] != "evt.meter_ext.report" or ext_val not in data["val"]:
+            return None
+        return round(float(data["val"][ext_val]), 1)
+
+    return extract
+
+
+def create_sensor(name, device_class, state_class, unit_of_measurement, value_template, identifier, default_component, mqtt, extractor=None, split=False):
     x_component = {
         "name": f"{name}",
         "device_class": device_class,
@@ -166,5 +205,33 @@ def create_sensor(name, device_class, state_class, unit_of_measurement, value_te
         "unique_id": identifier
     }
     merged_component = {**default_component, **x_component}
+    if extractor is not None and split:
+        merged_component = translation.split(mqtt, merged_component, extractor)
+    elif extractor is not None:
+        merged_component = translation.apply(mqtt, merged_component, extractor)
     payload = json.dumps(merged_component)
     mqtt.publish(f"homeassistant/sensor/{identifier}/config", payload)
+
+
+def create_aggregate_sensors(name, device_class, unit_of_measurement, identifier, default_component, mqtt, extractor):
+    """
+    Creates min/max/mean/last sensors per window, published by the add-on, see Aggregator
+    """
+    if mqtt.aggregator is None:
+        return
+
+    state_topics = mqtt.aggregator.register(default_component["state_topic"], identifier, extractor)
+    for (stat, window), state_topic in state_topics.items():
+        aggregate_identifier = f"{identifier}_{stat}_{window}"
+        aggregate_component = {
+            "name": f"{name} {stat} {window}",
+            "device_class": device_class,
+            "state_class": "measurement",
+            "unit_of_measurement": unit_of_measurement,
+            "object_id": aggregate_identifier,
+            "unique_id": aggregate_identifier,
+            "state_topic": state_topic
+        }
+        merged_component = {**default_component, **aggregate_component}
+        payload = json.dumps(merged_component)
+        mqtt.publish(f"homeassistant/sensor/{aggregate_identifier}/config", payload)
@@ -1,5 +1,8 @@
+import itertools
 import json
 import os
+import random
+import threading
 import time
 import uuid
 from typing import Callable
@@ -8,9 +11,24 @@ from dotenv import load_dotenv
 
 import paho.mqtt.client as mqtt
 
+from pyfimptoha.helpers.DiscoveryRegistry import DiscoveryRegistry
+from pyfimptoha.helpers.ReportScheduler import ReportScheduler
+from pyfimptoha.helpers.StateCache import StateCache, is_state_report
+from pyfimptoha.helpers.TimerWheel import TimerWheel
+import pyfimptoha.helpers.Deadband as deadband
+import pyfimptoha.helpers.Throttle as throttle
+from pyfimptoha.helpers.TopicRouter import TopicRouter
+
+
+def asyncio_mode_enabled():
+    load_dotenv()
+    return os.environ.get('ASYNCIO_MODE', 'false').lower() == "true"
+
+
 class MqttCallback:
-    def __init__(self, topic_to_subscribe=None, on_dict_message=None):
+    def __init__(self, topic_to_subscribe=None, on_dict_message=None, on_raw_message=None):
         self._on_dict_message = on_dict_message
+        self._on_raw_message = on_raw_message
         self.topic_to_subscribe = topic_to_subscribe
         self.last_dict_message = None
 
@@ -22,16 +40,136 @@ class MqttCallback:
         except json.decoder.JSONDecodeError:
             pass
 
-        if self._on_dict_message and data is not None:
+        self.on_dict(msg, data)
+
+    def on_dict(self, msg, data):
+        """
+        Called with the already decoded payload. `data` is shared between
+        all callbacks matching the message, so it must not be modified.
+        `data` is None when the payload isn't JSON. Only JSON objects are
+        passed on to `on_dict_message`.
+        """
+        if self._on_raw_message:
+            self._on_raw_message(msg)
+
+        if self._on_dict_message and isinstance(data, dict):
             data = self._on_dict_message(msg, data)
             if data is not None:
                 self.last_dict_message = data
 
+
+def is_republished(data):
+    """
+    Whether a FIMP event was published by the add-on itself, like the
+    statuses and cached events, instead of reported by a device
+    """
+    return data.get("src") == "homeassistant"
+
+
+class Subscriptions:
+    """
+    The callbacks a helper has added, one per topic, so they can be removed
+    again with the services they were added for
+    """
+    def __init__(self, mqtt):
+        self._mqtt = mqtt
+        self._lock = threading.Lock()
+        # Callback id by topic
+        self._callback_ids = {}
+
+    def add(self, topic, on_dict_message=None, on_raw_message=None):
+        """
+        Subscribes to `topic`, unless it is subscribed to already
+        """
+        with self._lock:
+            if topic not in self._callback_ids:
+                self._callback_ids[topic] = self._mqtt.add_callback(MqttCallback(
+                    topic_to_subscribe=topic,
+                    on_dict_message=on_dict_message,
+                    on_raw_message=on_raw_message
+                ))
+
+    def remove(self, topic):
+        with self._lock:
+            callback_id = self._callback_ids.pop(topic, None)
+        if callback_id is not None:
+            self._mqtt.remove_callback(callback_id)
+
+
+class PendingRequest:
+    """
+    A request waiting for its reply. The reply is matched either on the
+    FIMP correlation id (`corid` of the reply equals `uid` of the request)
+    or by the `is_correct` predicate, and the waiter is woken through an event
+    as soon as the matching message arrives.
+    """
+    def __init__(self, event_topic, uid=None, is_correct: Callable = None):
+        self.event_topic = event_topic
+        self.uid = uid
+        self.callback_id = None
+        self.response = None
+        # Set by AsyncMqttClient to wait on the event loop instead
+        self.future = None
+        # Called with the response, or None on timeout, instead of waiting
+        self.on_done = None
+        self._is_correct = is_correct
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+
+    def matches(self, msg, data):
+        if self.uid is not None and data.get("corid") == self.uid:
+            return True
+        if self._is_correct is not None:
+            return bool(self._is_correct(msg, data))
+        return False
+
+    def resolve(self, msg, data):
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.response = (msg, data)
+            self._event.set()
+
+        if self.future is not None and not self.future.done():
+            self.future.set_result(self.response)
+        if self.on_done is not None:
+            self.on_done(self.response)
+        return True
+
+    def expire(self):
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self._event.set()
+
+        if self.on_done is not None:
+            self.on_done(None)
+        return True
+
+    def done(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        self._event.wait(timeout)
+        return self.response
+
+
 class MqttClient:
+    # Reconnect delay in seconds, doubled after every failed attempt
+    RECONNECT_MIN_DELAY = 1
+    RECONNECT_MAX_DELAY = 60
+    # Seconds without a connection before giving up, so the Supervisor restarts the add-on
+    DISCONNECTED_TIMEOUT = 15 * 60
+
     def __init__(self):
         load_dotenv()
 
         self.connected: bool = False
+        # Result code of the last CONNACK, None until one is received
+        self.connect_rc = None
+        self._connack = threading.Event()
+        # time.monotonic() of the disconnect, None while connected
+        self._disconnected_since = None
         self._server: str = os.environ.get('FIMP_SERVER')
         self._username: str = os.environ.get('FIMP_USERNAME')
         self._password: str = os.environ.get('FIMP_PASSWORD')
@@ -40,8 +178,91 @@ class MqttClient:
         self._debug: bool = os.environ.get('DEBUG')
         self._selected_devices_mode: str = os.environ.get('SELECTED_DEVICES_MODE')
         self._selected_devices: list = os.environ.get('SELECTED_DEVICES').split(',')
+        self._asyncio_mode: bool = asyncio_mode_enabled()
+        self._data_path: str = os.environ.get('DATA_PATH', '/data')
+        self._discovery_snapshot: bool = os.environ.get('DISCOVERY_SNAPSHOT', 'true').lower() == "true"
+        self._translate_states: bool = os.environ.get('TRANSLATE_STATES', 'false').lower() == "true"
+        self._throttle: list = throttle.parse_rules(os.environ.get('THROTTLE', ''))
+        self._deadband: list = deadband.parse_rules(os.environ.get('DEADBAND', ''))
+        self._max_queued_messages: int = int(os.environ.get('MAX_QUEUED_MESSAGES', '100'))
+        self._connect_timeout: float = float(os.environ.get('CONNECT_TIMEOUT', '10'))
+        self._persistent_session: bool = os.environ.get('PERSISTENT_SESSION', 'true').lower() == "true"
+        # QoS by topic class, see qos()
+        self._qos_policy: dict = {
+            "command": int(os.environ.get('QOS_COMMANDS', '1')),
+            "discovery": int(os.environ.get('QOS_DISCOVERY', '1')),
+            "telemetry": int(os.environ.get('QOS_TELEMETRY', '0')),
+        }
+        self._state_cache_size: int = int(os.environ.get('STATE_CACHE_SIZE', '1000'))
+        self._persist_state_cache: bool = os.environ.get('PERSIST_STATE_CACHE', 'true').lower() == "true"
+        self._get_report_rate: float = float(os.environ.get('GET_REPORT_RATE', '5'))
+        self._bulk_state: bool = os.environ.get('BULK_STATE', 'true').lower() == "true"
+        self._poll_interval: float = float(os.environ.get('POLL_INTERVAL', '300'))
+        self._poll_max_interval: float = float(os.environ.get('POLL_MAX_INTERVAL', '3600'))
+        self._integrate_energy: bool = os.environ.get('INTEGRATE_ENERGY', 'true').lower() == "true"
+        self._command_debounce: float = float(os.environ.get('COMMAND_DEBOUNCE', '0.3'))
+        # Imported here, as the aggregator imports MqttCallback from this module
+        from pyfimptoha.helpers.Aggregator import parse_windows
+        self._aggregate_windows: list = parse_windows(os.environ.get('AGGREGATE_WINDOWS', ''))
         self._topic_discover: str = "pt:j1/mt:rsp/rt:app/rn:homeassistant/ad:flow1"
+        self._topic_ha_status: str = "homeassistant/status"
+        self._topic_device_events: str = "pt:j1/mt:evt/rt:dev/#"
         self.on_message_callbacks = {}
+        self._router = TopicRouter()
+        self._callbacks_lock = threading.RLock()
+        self._subscriptions = {}
+        self._pending_requests = {}
+        self._publish_lock = threading.Lock()
+        # Notified when messages have been sent, or the connection is lost
+        self._publish_condition = threading.Condition(self._publish_lock)
+        self._unpublished_mids = set()
+        self._early_mids = set()
+        # Runs the call_later callbacks, one after the other on a single thread.
+        # The helpers schedule their timers on it too, instead of a thread each.
+        self.wheel = TimerWheel()
+        self._call_ids = itertools.count()
+        # Thread running the paho callbacks, which must never wait for the queue
+        self._network_thread = None
+        # Latest message by topic published while disconnected, sent on reconnect
+        self._offline_messages = {}
+        # Report types the entities are built from, by FIMP event topic. None
+        # before the first discovery pass, see homeassistant.track_entity_reports
+        self.entity_reports = None
+        self._full_discovery = False
+        # Discovery configs published since the last discovery pass, by topic
+        self.discovery_configs = {}
+        # Those of the pass before, during a full pass, see keep_discovery_config
+        self._previous_discovery_configs = {}
+        self.discovery_registry = DiscoveryRegistry(self._data_path)
+        # Statuses published by the last discovery pass
+        self.discovery_statuses = []
+        # StateTranslator, see translation.py
+        self.translator = None
+        # Latest event of every device service, None when disabled
+        self.state_cache = None
+        if self._state_cache_size > 0:
+            self.state_cache = StateCache(
+                self._data_path, self._state_cache_size, self._persist_state_cache, self.call_later,
+                self.is_entity_report
+            )
+        # Paces the get_report requests per adapter
+        self.report_scheduler = ReportScheduler(self, self._get_report_rate)
+        # PollScheduler, None when polling is disabled
+        self.poll_scheduler = None
+        # Aggregator, None without aggregate_windows
+        self.aggregator = None
+        # EnergyIntegrator, None when integrate_energy is disabled
+        self.energy_integrator = None
+        # CommandCoalescer, see coalescing.py
+        self.command_coalescer = None
+        # Subscribed to in on_connect
+        self._router.add(self._topic_ha_status, "homeassistant_status", MqttCallback(
+            on_raw_message=self.on_homeassistant_status
+        ))
+        if self.state_cache is not None:
+            self._router.add(self._topic_device_events, "state_cache", MqttCallback(
+                on_dict_message=self.on_device_event
+            ))
 
         if self._debug.lower() == "true":
             self._debug = True
@@ -55,90 +276,446 @@ class MqttClient:
         print('Debug: ', self._debug)
         print('Selected devices mode: ', self._selected_devices_mode)
         print('Selected devices: ', self._selected_devices)
+        print('Asyncio mode: ', self._asyncio_mode)
+        print('Data path: ', self._data_path)
+        print('Discovery snapshot: ', self._discovery_snapshot)
+        print('Translate states: ', self._translate_states)
+        print('Throttle: ', self._throttle)
+        print('Deadband: ', self._deadband)
+        print('Max queued messages: ', self._max_queued_messages)
+        print('Connect timeout: ', self._connect_timeout)
+        print('Persistent session: ', self._persistent_session)
+        print('QoS: ', self._qos_policy)
+        print('State cache size: ', self._state_cache_size)
+        print('Persist state cache: ', self._persist_state_cache)
+        print('Get report rate: ', self._get_report_rate)
+        print('Bulk state: ', self._bulk_state)
+        print('Poll interval: ', self._poll_interval)
+        print('Poll max interval: ', self._poll_max_interval)
+        print('Aggregate windows: ', self._aggregate_windows)
+        print('Integrate energy: ', self._integrate_energy)
+        print('Command debounce: ', self._command_debounce)
 
-    def connect(self):
-        self.client = mqtt.Client(client_id=self._client_id)
-        self.client.loop_start()
+    def _create_client(self):
+        # With a persistent session the broker keeps the subscriptions, and
+        # queues QoS 1 messages for them, while the add-on is disconnected
+        self.client = mqtt.Client(client_id=self._client_id, clean_session=not self._persistent_session)
 
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
         self.client.on_message = self.on_message
+        self.client.on_publish = self.on_publish
 
         self.client.username_pw_set(self._username, self._password)
-        self.client.connect(self._server, self._port, 60)
-        time.sleep(2)
+        self.client.reconnect_delay_set(self.reconnect_delay(), self.RECONNECT_MAX_DELAY)
 
+    def reconnect_delay(self):
+        """
+        First reconnect delay, with jitter so clients don't all reconnect at once
+        """
+        return self.RECONNECT_MIN_DELAY * random.uniform(0.5, 1.5)
+
+    def connect(self):
+        """
+        Connects and returns once CONNACK is received, or `connect_timeout` has passed
+        """
+        self._create_client()
+
+        self._connack.clear()
+        try:
+            self.client.connect(self._server, self._port, 60)
+        except OSError as e:
+            print(f"MQTT client: Could not connect to {self._server}:{self._port}: {e}")
+            return False
+
+        # Started after connecting, so the network thread picks up the socket right away
+        self.client.loop_start()
+        return self.wait_connected(self._connect_timeout)
+
+    def is_alive(self):
+        """
+        Whether the network thread is running, and the connection is up or
+        hasn't been down for longer than DISCONNECTED_TIMEOUT
+        """
+        if self._network_thread is None or not self._network_thread.is_alive():
+            print("MQTT client: The network thread has stopped")
+            return False
+        return self._reconnecting()
+
+    def _reconnecting(self):
+        disconnected_since = self._disconnected_since
+        if disconnected_since is not None and time.monotonic() - disconnected_since > self.DISCONNECTED_TIMEOUT:
+            print(f"MQTT client: Disconnected for more than {self.DISCONNECTED_TIMEOUT} seconds")
+            return False
+        return True
+
+    def wait_connected(self, timeout):
+        """
+        Waits for the next CONNACK, also after reconnects, and returns whether it was accepted
+        """
+        if not self._connack.wait(timeout):
+            print(f"MQTT client: No answer from the broker within {timeout} seconds")
         return self.connected
 
     def on_connect(self, client, userdata, flags, rc):
         """
         The callback for when the client receives a CONNACK response from the server.
         """
+        if self._network_thread is None:
+            self._network_thread = threading.current_thread()
+
+        self.connect_rc = rc
         if rc == 0:
-            self.connected = True
+            with self._publish_lock:
+                self.connected = True
+                self._disconnected_since = None
+                offline_messages, self._offline_messages = self._offline_messages, {}
             print("MQTT client: Connected successfully")
 
             # Subscribe to Home Assistant status where Home Assistant announces restarts
-            self.client.subscribe("homeassistant/status")
+            self.client.subscribe(self._topic_ha_status, self.qos(self._topic_ha_status))
 
             # Request FIMP devices
-            self.client.subscribe(self._topic_discover)
+            self.client.subscribe(self._topic_discover, self.qos(self._topic_discover))
+
+            # Device events, for the state cache
+            if self.state_cache is not None:
+                self.client.subscribe(self._topic_device_events, self.qos(self._topic_device_events))
+
+            # Subscriptions made before a reconnect
+            with self._callbacks_lock:
+                topics = list(self._subscriptions)
+            for topic in topics:
+                self.client.subscribe(topic, self.qos(topic))
+
+            if offline_messages:
+                print(f"MQTT client: Sending {len(offline_messages)} messages published while disconnected")
+            for topic, (payload, retain) in offline_messages.items():
+                self._publish(topic, payload, retain)
+        else:
+            print(f"MQTT client: Connection refused: {mqtt.connack_string(rc)}")
+        self._connack.set()
 
     def publish_dict(self, topic, data):
         payload = json.dumps(data)
         self.publish(topic, payload)
 
-    def publish(self, topic, payload):
-        self.client.publish(topic, payload)
+    def publish(self, topic, payload, retain=False):
+        if topic.startswith("homeassistant/") and topic.endswith("/config"):
+            self.discovery_configs[topic] = payload
+            # Configs are retained, so unchanged ones are already known by the broker
+            if not self.discovery_registry.is_changed(topic, payload):
+                return
+            retain = True
+
+        self._publish(topic, payload, retain)
+
+    def _publish(self, topic, payload, retain=False):
+        with self._publish_lock:
+            if not self.connected:
+                # Only the latest state of a topic matters once reconnected
+                self._offline_messages[topic] = (payload, retain)
+                return
+
+        self._wait_for_queue()
+        info = self.client.publish(topic, payload, qos=self.qos(topic), retain=retain)
+        if info.rc == mqtt.MQTT_ERR_SUCCESS:
+            self._track_publish(info.mid)
+        else:
+            print(f"MQTT client: Could not publish to {topic}: {mqtt.error_string(info.rc)}")
+
+    def qos(self, topic):
+        """
+        QoS for publishing to and subscribing to `topic`. FIMP commands, also
+        when proxied by the CommandCoalescer, their responses, and Home
+        Assistant discovery, shouldn't get lost in
+        a short disconnect. Telemetry is sent often enough that it doesn't matter.
+        """
+        if topic.startswith("pt:j1/mt:cmd") or topic.startswith("pt:j1/mt:rsp") or topic.startswith("fh/cmd/"):
+            return self._qos_policy["command"]
+        if topic.startswith("homeassistant/"):
+            return self._qos_policy["discovery"]
+        return self._qos_policy["telemetry"]
+
+    def _wait_for_queue(self, timeout=10):
+        """
+        Backpressure: blocks the publishing thread while `max_queued_messages`
+        messages are waiting to be sent. The network thread (and the event
+        loop in asyncio mode) never waits, as it is what empties the queue.
+        """
+        if threading.current_thread() is self._network_thread:
+            return
+
+        with self._publish_condition:
+            if not self._publish_condition.wait_for(
+                lambda: len(self._unpublished_mids) < self._max_queued_messages or not self.connected,
+                timeout
+            ):
+                print("MQTT client: Publish queue is still full, publishing anyway")
+
+    def flush(self, timeout=10):
+        """
+        Waits until every message published so far has been sent to the broker.
+        Returns False on timeout.
+        """
+        with self._publish_condition:
+            return self._publish_condition.wait_for(
+                lambda: not self._unpublished_mids or not self.connected,
+                timeout
+            )
+
+    def begin_discovery(self, owner=None):
+        """
+        Starts a discovery pass, over everything or only over the components
+        of `owner`. Configs not published again before `end_discovery`
+        are removed from Home Assistant.
+        """
+        if owner is None:
+            self._previous_discovery_configs, self.discovery_configs = self.discovery_configs, {}
+            self.entity_reports = {}
+        self._full_discovery = owner is None
+        self.discovery_registry.begin_pass(owner)
+
+    def keep_discovery_config(self, topic):
+        """
+        Keeps a config of the current pass's owner as it was, when it can't
+        be built again for now, e.g. when a value it needs didn't come.
+        Returns False if there is none.
+        """
+        payload = self.discovery_configs.get(topic) or self._previous_discovery_configs.get(topic)
+        if payload is None:
+            # Published by an earlier run, and still retained by the broker
+            return self.discovery_registry.keep(topic)
+
+        self.publish(topic, payload)
+        return True
+
+    def end_discovery(self):
+        self._previous_discovery_configs = {}
+        removed = self.discovery_registry.end_pass()
+        if self._full_discovery and self.state_cache is not None:
+            # Devices may have been excluded since their events were cached
+            self.state_cache.purge()
+        if removed:
+            print(f"Removing {len(removed)} components no longer reported by FIMP")
+        for topic in removed:
+            self.discovery_configs.pop(topic, None)
+            # An empty retained config removes the entity and clears the retained message
+            self._publish(topic, "", retain=True)
+
+    def abort_discovery(self):
+        """
+        Ends a discovery pass that failed without removing anything
+        """
+        # The configs not built again are still in Home Assistant
+        self.discovery_configs = {**self._previous_discovery_configs, **self.discovery_configs}
+        self._previous_discovery_configs = {}
+        self.discovery_registry.abort_pass()
+
+    def _track_publish(self, mid):
+        # on_publish can fire before publish() has returned the mid
+        with self._publish_lock:
+            if mid in self._early_mids:
+                self._early_mids.discard(mid)
+            else:
+                self._unpublished_mids.add(mid)
+
+    def on_publish(self, client, userdata, mid):
+        """
+        The callback for when a message has been sent to the broker
+        """
+        with self._publish_lock:
+            if mid in self._unpublished_mids:
+                self._unpublished_mids.discard(mid)
+                self._publish_condition.notify_all()
+            else:
+                self._early_mids.add(mid)
 
     def on_message(self, client, userdata, msg):
         """
         The callback for when a message is received from the server.
         """
-        for clbk in self.on_message_callbacks.values():
-            clbk.on_message(msg)
+        with self._callbacks_lock:
+            callbacks = self._router.match(msg.topic)
+
+        if not callbacks:
+            return
+
+        # Decode once and share the result with every matching callback
+        try:
+            data = json.loads(msg.payload)
+        except ValueError:
+            data = None
+
+        for clbk in callbacks:
+            # An exception would stop the network thread, and with it the add-on
+            try:
+                clbk.on_dict(msg, data)
+            except Exception as e:
+                print(f"MQTT client: Failed to handle message on {msg.topic}: {e}")
+
+    def on_homeassistant_status(self, msg):
+        """
+        Home Assistant announces restarts on homeassistant/status. As it loses
+        all state that isn't retained, the components and statuses are republished
+        from memory without asking FIMP again.
+        """
+        if msg.payload != b"online" or not self.discovery_configs:
+            return
+
+        print("Home Assistant is online. Republishing components and statuses...")
+        for topic, payload in list(self.discovery_configs.items()):
+            self._publish(topic, payload, retain=True)
+
+        # Give Home Assistant a moment to set up the entities before sending their state.
+        # Events seen since the statuses were created are newer, so they win.
+        statuses = list(self.discovery_statuses)
+        if self.state_cache is not None:
+            statuses = self.state_cache.merge(statuses, prefer_cache=True)
+        self.call_later(0.5, lambda: self.publish_statuses(statuses))
+
+    def publish_statuses(self, statuses):
+        for topic, payload in statuses:
+            self.publish(topic, payload)
+
+    def on_device_event(self, msg, data):
+        """
+        Keeps the latest state report of every entity in the state cache.
+        Statuses published by the add-on itself aren't events from the device.
+        """
+        if is_republished(data):
+            return None
+        if not self.is_entity_report(msg.topic, data.get("type")):
+            return None
+
+        self.state_cache.update(msg.topic, data, msg.payload.decode("utf-8"))
+        return None
+
+    def is_entity_report(self, topic, event_type):
+        """
+        Whether an entity shows the state reported by `event_type` events on
+        `topic`. Before the first discovery pass any state report may be.
+        """
+        if self.entity_reports is None:
+            return is_state_report(event_type)
+        return event_type in self.entity_reports.get(topic, ())
+
+    def call_later(self, delay, callback):
+        self.wheel.schedule(("call_later", next(self._call_ids)), delay, callback)
+
+    def send_request(self, command_topic, event_topic, data, is_correct: Callable = None, on_response: Callable = None, timeout=5):
+        """
+        Publishes a command and registers it as pending until the reply arrives.
+        The request gets a fresh `uid` so the reply can be matched on `corid`.
+
+        Without `on_response`, call `finish_request` when done waiting, see `send_and_wait`.
+        With `on_response`, it is called with the reply, or None after `timeout`,
+        and the request cleans up after itself. This never blocks, so it can be
+        used from message callbacks.
+        """
+        data = {**data, "uid": str(uuid.uuid4())}
+        request = PendingRequest(event_topic, uid=data["uid"], is_correct=is_correct)
 
-    def send_and_wait(self, command_topic, event_topic, data, is_correct: Callable, timeout=5):
         def on_message(msg, data):
-            if not is_correct(msg, data):
+            if request.done() or not request.matches(msg, data):
                 return None
 
+            if request.resolve(msg, data):
+                self.finish_request(request)
             return msg, data
 
-        callback = MqttCallback(
+        if on_response is not None:
+            request.on_done = on_response
+
+            def on_timeout():
+                if request.expire():
+                    self.finish_request(request)
+
+            self.call_later(timeout, on_timeout)
+
+        request.callback_id = self.add_callback(MqttCallback(
             on_dict_message=on_message,
             topic_to_subscribe=event_topic,
-        )
-        self.add_callback(callback)
+        ))
+        with self._callbacks_lock:
+            self._pending_requests[request.callback_id] = request
+
         self.publish_dict(command_topic, data)
+        return request
 
-        start_time = time.time()
-        end_time = start_time + timeout
-        while time.time() < end_time and callback.last_dict_message is None:
-            time.sleep(0.1)
+    def finish_request(self, request: PendingRequest):
+        """
+        Unregisters a pending request and its subscription. Safe to call more than once.
+        """
+        with self._callbacks_lock:
+            if self._pending_requests.pop(request.callback_id, None) is None:
+                return
+        self.remove_callback(request.callback_id)
 
-        return callback.last_dict_message
+    def send_and_wait(self, command_topic, event_topic, data, is_correct: Callable = None, timeout=5):
+        request = self.send_request(command_topic, event_topic, data, is_correct)
+        try:
+            return request.wait(timeout)
+        finally:
+            self.finish_request(request)
 
     def on_disconnect(self, client, userdata, rc):
         """
         The callback for when the client disconnects from the server.
         """
 
-        self.connected = False
+        with self._publish_lock:
+            self.connected = False
+            if self._disconnected_since is None:
+                self._disconnected_since = time.monotonic()
+            self._unpublished_mids.clear()
+            self._early_mids.clear()
+            self._publish_condition.notify_all()
+        self._connack.clear()
         print(f"MQTT client: Disconnected... Result code: {str(rc)}.")
 
+        if rc != mqtt.MQTT_ERR_SUCCESS:
+            # paho reconnects by itself, starting over with a new jittered delay
+            self.client.reconnect_delay_set(self.reconnect_delay(), self.RECONNECT_MAX_DELAY)
+
     def add_callback(self, callback: MqttCallback):
         id = str(uuid.uuid4())
-        self.on_message_callbacks[id] = callback
+        with self._callbacks_lock:
+            self.on_message_callbacks[id] = callback
+            # Callbacks without a topic receive every message
+            self._router.add(callback.topic_to_subscribe or "#", id, callback)
 
         if callback.topic_to_subscribe is not None:
-            self.client.subscribe(callback.topic_to_subscribe)
+            self._subscribe(callback.topic_to_subscribe)
 
         return id
 
     def remove_callback(self, id):
-        if id in self.on_message_callbacks:
-            if self.on_message_callbacks[id].topic_to_subscribe is not None:
-                self.client.unsubscribe(self.on_message_callbacks[id].topic_to_subscribe)
+        with self._callbacks_lock:
+            callback = self.on_message_callbacks.pop(id, None)
+            if callback is not None:
+                self._router.remove(callback.topic_to_subscribe or "#", id)
+
+        if callback is not None and callback.topic_to_subscribe is not None:
+            self._unsubscribe(callback.topic_to_subscribe)
+
+    def _subscribe(self, topic):
+        """
+        Subscriptions are reference counted so callbacks sharing a topic
+        don't unsubscribe each other.
+        """
+        with self._callbacks_lock:
+            count = self._subscriptions.get(topic, 0)
+            self._subscriptions[topic] = count + 1
+        if count == 0:
+            self.client.subscribe(topic, self.qos(topic))
 
-            self.on_message_callbacks.pop(id)
+    def _unsubscribe(self, topic):
+        with self._callbacks_lock:
+            count = self._subscriptions.get(topic, 0) - 1
+            if count > 0:
+                self._subscriptions[topic] = count
+                return
+            self._subscriptions.pop(topic, None)
+        if count == 0:
+            self.client.unsubscribe(topic)
@@ -1,6 +1,8 @@
 import json
 import typing
 
+import pyfimptoha.translation as translation
+
 
 def new_sensor(
         mqtt,
@@ -60,6 +62,7 @@ def battery(
 
     # Merge default_component with battery_component
     merged_component = {**default_component, **battery_component}
+    merged_component = translation.apply(mqtt, merged_component, translation.report("evt.lvl.report", translation.rounded(0)))
 
     payload = json.dumps(merged_component)
     mqtt.publish(f"homeassistant/sensor/{identifier}/config", payload)
@@ -104,6 +107,7 @@ def sensor_lumin(
 
     # Merge default_component with lumin_component
     merged_component = {**default_component, **lumin_component}
+    merged_component = translation.apply(mqtt, merged_component, translation.report("evt.sensor.report", translation.rounded(0)))
 
     payload = json.dumps(merged_component)
     mqtt.publish(f"homeassistant/sensor/{identifier}/config", payload)
@@ -145,6 +149,7 @@ def sensor_presence(
 
     # Merge default_component with presence_component
     merged_component = {**default_component, **presence_component}
+    merged_component = translation.apply(mqtt, merged_component, translation.report("evt.presence.report"))
 
     payload = json.dumps(merged_component)
     mqtt.publish(f"homeassistant/binary_sensor/{identifier}/config", payload)
@@ -185,11 +190,13 @@ def sensor_temp(
         """
     }
 
-    # This will prevent device name for Heatit z-trm3 to be overwritten with the sensor name
-    del default_component["device"]["name"]
+    # This will prevent device name for Heatit z-trm3 to be overwritten with the sensor name.
+    # default_component is shared, so leave it as is and merge a copy without the name
+    device_info = {key: value for key, value in default_component["device"].items() if key != "name"}
 
     # Merge default_component with temp_component
-    merged_component = {**default_component, **temp_component}
+    merged_component = {**default_component, "device": device_info, **temp_component}
+    merged_component = translation.apply(mqtt, merged_component, translation.report("evt.sensor.report", translation.rounded(1)))
 
     payload = json.dumps(merged_component)
     mqtt.publish(f"homeassistant/sensor/{identifier}/config", payload)
@@ -231,6 +238,7 @@ def sensor_humid(
 
     # Merge default_compontent with humid_component
     merged_component = {**default_component, **humid_component}
+    merged_component = translation.apply(mqtt, merged_component, translation.report("evt.sensor.report", translation.rounded(0)))
 
     payload = json.dumps(merged_component)
     mqtt.publish(f"homeassistant/sensor/{identifier}/config", payload)
@@ -280,6 +288,7 @@ def sensor_contact(
 
     # Merge default_component with presence_component
     merged_component = {**default_component, **contact_component}
+    merged_component = translation.apply(mqtt, merged_component, translation.report("evt.open.report"))
 
     payload = json.dumps(merged_component)
     mqtt.publish(f"homeassistant/binary_sensor/{identifier}/config", payload)
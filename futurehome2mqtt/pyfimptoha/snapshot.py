@@ -0,0 +1,38 @@
+from pyfimptoha.helpers.storage import load_json, save_json
+
+SNAPSHOT_FILE = "discovery_snapshot.json"
+
+
+def load(data_path):
+    """
+    Returns the discovery configs and statuses saved by the last discovery pass,
+    or None if there is no usable snapshot
+    """
+    snapshot = load_json(data_path, SNAPSHOT_FILE)
+    if not isinstance(snapshot, dict) or "configs" not in snapshot:
+        return None
+
+    return snapshot
+
+
+def save(data_path, configs, statuses):
+    snapshot = {
+        "configs": configs,
+        "statuses": [[topic, payload] for topic, payload in statuses],
+    }
+    save_json(data_path, SNAPSHOT_FILE, snapshot)
+
+
+def publish(mqtt, snapshot):
+    """
+    Publishes the discovery configs and statuses from a snapshot as they were,
+    or as last seen on the hub when the state cache has newer events
+    """
+    for topic, payload in snapshot["configs"].items():
+        mqtt.publish(topic, payload)
+
+    statuses = [(topic, payload) for topic, payload in snapshot.get("statuses", [])]
+    mqtt.discovery_statuses = statuses
+    if mqtt.state_cache is not None:
+        statuses = mqtt.state_cache.merge(statuses, prefer_cache=True)
+    mqtt.publish_statuses(statuses)
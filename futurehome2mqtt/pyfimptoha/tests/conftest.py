@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+
+from pyfimptoha.mqtt_client import MqttClient
+from pyfimptoha.tests.fakes import FakeClock, FakeMqtt, FakePahoClient, FakeWheel
+
+
+@pytest.fixture
+def wheel():
+    return FakeWheel()
+
+
+@pytest.fixture
+def mqtt(wheel):
+    """
+    The helpers' timers are on `wheel`, like they are on MqttClient.wheel
+    """
+    return FakeMqtt(wheel)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Stands in for time.time and time.monotonic, so tests decide what time it is
+    """
+    clock = FakeClock(1000.0)
+    monkeypatch.setattr(time, "time", clock.time)
+    monkeypatch.setattr(time, "monotonic", clock.monotonic)
+    return clock
+
+
+@pytest.fixture
+def published():
+    """
+    (topic, payload) given to a helper's publish callback
+    """
+    return []
+
+
+@pytest.fixture
+def client_env(monkeypatch, tmp_path):
+    """
+    The add-on options MqttClient reads from the environment
+    """
+    env = {
+        "FIMP_SERVER": "cube", "FIMP_USERNAME": "", "FIMP_PASSWORD": "", "FIMP_PORT": "1884",
+        "CLIENT_ID": "fimp2mqtt", "DEBUG": "False", "SELECTED_DEVICES_MODE": "default",
+        "SELECTED_DEVICES": "", "DATA_PATH": str(tmp_path), "STATE_CACHE_SIZE": "0",
+    }
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+
+
+@pytest.fixture
+def mqtt_client(monkeypatch, client_env):
+    """
+    A connected MqttClient talking to a FakePahoClient. The call_later
+    callbacks are kept in `delayed` instead of being run.
+    """
+    client = MqttClient()
+    client.client = FakePahoClient(client.on_publish)
+    client.connected = True
+    client._network_thread = threading.current_thread()
+    client.delayed = []
+    monkeypatch.setattr(client, "call_later", lambda delay, callback: client.delayed.append((delay, callback)))
+    return client
@@ -0,0 +1,134 @@
+import itertools
+import json
+import threading
+
+from paho.mqtt.client import MQTTMessage, MQTTMessageInfo
+
+
+def message(topic, payload):
+    """
+    A received message, `payload` is sent as it is if it's a string, otherwise as JSON
+    """
+    msg = MQTTMessage(topic=topic.encode("utf-8"))
+    if not isinstance(payload, str):
+        payload = json.dumps(payload)
+    msg.payload = payload.encode("utf-8")
+    return msg
+
+
+class FakeMqtt:
+    """
+    Stands in for MqttClient in the helper tests, recording what is
+    published and subscribed instead of talking to a broker
+    """
+    def __init__(self, wheel=None):
+        self.published = []
+        self.callbacks = {}
+        self._callback_ids = itertools.count()
+        self.delayed = []
+        self.wheel = wheel or FakeWheel()
+        self.state_cache = None
+        self.report_scheduler = FakeReportScheduler()
+
+    def add_callback(self, callback):
+        callback_id = str(next(self._callback_ids))
+        self.callbacks[callback_id] = callback
+        return callback_id
+
+    def remove_callback(self, callback_id):
+        del self.callbacks[callback_id]
+
+    def publish(self, topic, payload, retain=False):
+        self.published.append((topic, payload, retain))
+
+    def publish_dict(self, topic, data):
+        self.publish(topic, json.dumps(data))
+
+    def call_later(self, delay, callback):
+        self.delayed.append((delay, callback))
+
+    def deliver(self, topic, data):
+        """
+        Passes a message to the callbacks subscribed to exactly `topic`
+        """
+        msg = message(topic, data)
+        for callback in list(self.callbacks.values()):
+            if callback.topic_to_subscribe == topic:
+                callback.on_dict(msg, data)
+
+
+class FakePahoClient:
+    """
+    Stands in for the paho client of MqttClient. Messages count as sent
+    to the broker right away.
+    """
+    def __init__(self, on_publish):
+        self.published = []
+        self.subscribed = []
+        self.unsubscribed = []
+        self.reconnects = 0
+        self._on_publish = on_publish
+        self._mids = itertools.count(1)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.published.append((topic, payload, retain))
+        info = MQTTMessageInfo(next(self._mids))
+        self._on_publish(self, None, info.mid)
+        return info
+
+    def subscribe(self, topic, qos=0):
+        self.subscribed.append(topic)
+
+    def unsubscribe(self, topic):
+        self.unsubscribed.append(topic)
+
+    def reconnect_delay_set(self, min_delay, max_delay):
+        pass
+
+    def reconnect(self):
+        self.reconnects += 1
+
+
+class FakeReportScheduler:
+    """
+    Records the get_report requests instead of sending them
+    """
+    def __init__(self):
+        self.added = []
+        self.event = threading.Event()
+
+    def add(self, get_reports_list, skip_known=True):
+        self.added.append((get_reports_list, skip_known))
+        self.event.set()
+
+
+class FakeWheel:
+    """
+    A TimerWheel whose timers only fire when the test says so
+    """
+    def __init__(self):
+        self.timers = {}
+
+    def schedule(self, key, delay, callback):
+        self.timers[key] = (delay, callback)
+
+    def cancel(self, key):
+        self.timers.pop(key, None)
+
+    def fire(self, key):
+        delay, callback = self.timers.pop(key)
+        callback()
+
+
+class FakeClock:
+    """
+    What time it is, see the `clock` fixture
+    """
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
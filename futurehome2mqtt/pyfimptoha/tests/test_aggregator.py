@@ -0,0 +1,116 @@
+import pytest
+
+from pyfimptoha.helpers.Aggregator import Aggregator, close_delay, parse_windows, window_label
+
+EVENT_TOPIC = "pt:j1/mt:evt/rt:dev/rn:zw/ad:1/sv:meter_elec/ad:8_0"
+
+
+def power(data):
+    return data["val"] if data["props"]["unit"] == "W" else None
+
+
+def report(watt, unit="W"):
+    return {"type": "evt.meter.report", "serv": "meter_elec", "val": watt, "props": {"unit": unit}}
+
+
+@pytest.fixture
+def windows():
+    return 60,
+
+
+@pytest.fixture
+def aggregator(mqtt, wheel, clock, windows):
+    # On a minute boundary
+    clock.now = 1200.0
+    return Aggregator(mqtt, windows, wheel)
+
+
+@pytest.fixture
+def topics(aggregator):
+    return aggregator.register(EVENT_TOPIC, "zw_8_meter_elec_W", power)
+
+
+def published_states(mqtt):
+    return {topic: payload for topic, payload, retain in mqtt.published}
+
+
+class TestParseWindows:
+    def test_windows(self):
+        assert parse_windows("10,60,900") == [10, 60, 900]
+        assert parse_windows(" 10 , 60 ") == [10, 60]
+
+    @pytest.mark.parametrize("value", [None, "", " ", "null", ","])
+    def test_unset(self, value):
+        assert parse_windows(value) == []
+
+    @pytest.mark.parametrize("value", ["0", "-60", "x", "1.5"])
+    def test_invalid_windows_are_ignored(self, value):
+        assert parse_windows(f"{value},60") == [60]
+
+    def test_labels(self):
+        assert [window_label(window) for window in [10, 60, 900, 3600, 90]] == ["10s", "1m", "15m", "1h", "90s"]
+
+
+class TestCloseDelay:
+    def test_aligned_to_the_clock(self):
+        assert close_delay(60, 1000.0) == pytest.approx(20.0)
+        assert close_delay(900, 1800.0 + 100) == pytest.approx(800.0)
+
+    def test_on_the_boundary_waits_a_whole_window(self):
+        assert close_delay(60, 1020.0) == pytest.approx(60.0)
+
+    def test_just_before_the_boundary_joins_the_next_window(self):
+        assert close_delay(60, 1019.999) == pytest.approx(60.001)
+
+
+class TestAggregator:
+    @pytest.mark.parametrize("windows", [(10, 60)])
+    def test_state_topics(self, wheel, topics):
+        assert topics[("mean", "1m")] == "fh/zw_8_meter_elec_W_mean_1m/state"
+        assert len(topics) == 8
+        assert wheel.timers[("aggregate", 10)][0] == pytest.approx(10.0)
+        assert wheel.timers[("aggregate", 60)][0] == pytest.approx(60.0)
+
+    def test_time_weighted_stats(self, mqtt, wheel, clock, topics):
+        mqtt.deliver(EVENT_TOPIC, report(100))
+        clock.now += 45
+        mqtt.deliver(EVENT_TOPIC, report(500))
+        clock.now += 15
+        wheel.fire(("aggregate", 60))
+
+        published = published_states(mqtt)
+        assert published[topics[("min", "1m")]] == "100.0"
+        assert published[topics[("max", "1m")]] == "500.0"
+        assert published[topics[("mean", "1m")]] == "200.0"
+        assert published[topics[("last", "1m")]] == "500.0"
+        # The next window is scheduled from the close
+        assert ("aggregate", 60) in wheel.timers
+
+    def test_last_value_carries_over(self, mqtt, wheel, clock, topics):
+        mqtt.deliver(EVENT_TOPIC, report(100))
+        clock.now += 60
+        wheel.fire(("aggregate", 60))
+        mqtt.published.clear()
+
+        clock.now += 30
+        mqtt.deliver(EVENT_TOPIC, report(300))
+        clock.now += 30
+        wheel.fire(("aggregate", 60))
+
+        published = published_states(mqtt)
+        assert published[topics[("min", "1m")]] == "100.0"
+        assert published[topics[("mean", "1m")]] == "200.0"
+
+    def test_nothing_published_without_values(self, mqtt, wheel, clock, topics):
+        mqtt.deliver(EVENT_TOPIC, report(1000, unit="kWh"))
+        mqtt.deliver(EVENT_TOPIC, {**report(100), "src": "homeassistant"})
+        clock.now += 60
+        wheel.fire(("aggregate", 60))
+        assert mqtt.published == []
+
+    def test_remove(self, mqtt, wheel, clock, aggregator, topics):
+        aggregator.remove(EVENT_TOPIC)
+        assert mqtt.callbacks == {}
+        clock.now += 60
+        wheel.fire(("aggregate", 60))
+        assert mqtt.published == []
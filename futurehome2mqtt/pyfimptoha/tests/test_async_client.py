@@ -0,0 +1,185 @@
+import asyncio
+import threading
+
+import paho.mqtt.client as mqtt
+import pytest
+
+from pyfimptoha.async_client import AsyncMqttClient
+from pyfimptoha.tests.fakes import FakePahoClient, message
+
+COMMAND_TOPIC = "pt:j1/mt:cmd/rt:app/rn:vinculum/ad:1"
+RESPONSE_TOPIC = "pt:j1/mt:rsp/rt:app/rn:homeassistant/ad:flow1"
+REQUEST = {"serv": "vinculum", "type": "cmd.pd7.request", "val": {"cmd": "get"}}
+
+
+@pytest.fixture
+def async_client(client_env):
+    """
+    A connected AsyncMqttClient talking to a FakePahoClient, see `attach`
+    for the event loop
+    """
+    client = AsyncMqttClient()
+    client.client = FakePahoClient(client.on_publish)
+    client.connected = True
+    return client
+
+
+def attach(client):
+    """
+    Puts the client on the running loop, as connect_async does
+    """
+    client.loop = asyncio.get_running_loop()
+    client._loop_thread = threading.current_thread()
+    client._network_thread = client._loop_thread
+    client._connack_future = client.loop.create_future()
+    client._disconnected = client.loop.create_future()
+
+
+def reply_soon(client, request, **data):
+    msg = message(RESPONSE_TOPIC, {"type": "evt.pd7.response", "corid": request.uid, **data})
+    client.loop.call_soon(client.on_message, None, None, msg)
+
+
+def test_request(async_client):
+    async def main():
+        attach(async_client)
+        request = async_client.send_request(COMMAND_TOPIC, RESPONSE_TOPIC, REQUEST)
+        reply_soon(async_client, request, val=1)
+        return await async_client.wait_request(request, timeout=1)
+
+    msg, data = asyncio.run(main())
+    assert data["val"] == 1
+    assert async_client.on_message_callbacks == {}
+    assert async_client.client.unsubscribed == [RESPONSE_TOPIC]
+
+
+def test_request_answered_before_waiting(async_client):
+    async def main():
+        attach(async_client)
+        request = async_client.send_request(COMMAND_TOPIC, RESPONSE_TOPIC, REQUEST)
+        reply_soon(async_client, request, val=1)
+        await asyncio.sleep(0)
+        assert request.done()
+        return await async_client.wait_request(request, timeout=1)
+
+    msg, data = asyncio.run(main())
+    assert data["val"] == 1
+    assert async_client.on_message_callbacks == {}
+
+
+def test_request_timeout(async_client):
+    async def main():
+        attach(async_client)
+        return await async_client.request(COMMAND_TOPIC, RESPONSE_TOPIC, REQUEST, timeout=0.01)
+
+    assert asyncio.run(main()) is None
+    assert async_client.on_message_callbacks == {}
+    assert async_client.client.unsubscribed == [RESPONSE_TOPIC]
+
+
+def test_request_kept_after_a_timeout(async_client):
+    async def main():
+        attach(async_client)
+        request = async_client.send_request(COMMAND_TOPIC, RESPONSE_TOPIC, REQUEST)
+        assert await async_client.wait_request(request, timeout=0.01, finish=False) is None
+        assert async_client.on_message_callbacks != {}
+
+        reply_soon(async_client, request, val=1)
+        return await async_client.wait_request(request, timeout=1, finish=False)
+
+    msg, data = asyncio.run(main())
+    assert data["val"] == 1
+    assert async_client.on_message_callbacks == {}
+
+
+def test_call_later_runs_on_the_loop(async_client):
+    async def main():
+        attach(async_client)
+        ran = async_client.loop.create_future()
+        threading.Thread(
+            target=async_client.call_later,
+            args=(0.01, lambda: ran.set_result(threading.current_thread()))
+        ).start()
+        return await asyncio.wait_for(ran, 1)
+
+    assert asyncio.run(main()) is threading.main_thread()
+
+
+def test_publish_from_another_thread_is_sent_by_the_loop(async_client):
+    threads = []
+    publish = async_client.client.publish
+
+    def record_thread(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return publish(*args, **kwargs)
+
+    async def main():
+        attach(async_client)
+        async_client.client.publish = record_thread
+        publisher = threading.Thread(target=async_client.publish, args=("homeassistant/test", "on"))
+        publisher.start()
+        while not async_client.client.published:
+            await asyncio.sleep(0.01)
+        publisher.join()
+
+    asyncio.run(main())
+    assert async_client.client.published == [("homeassistant/test", "on", False)]
+    assert threads == [threading.main_thread()]
+
+
+def test_flush_waits_for_the_broker(async_client):
+    async def main():
+        attach(async_client)
+        assert await async_client.flush(timeout=0.01)
+
+        async_client._unpublished_mids.add(42)
+        assert not await async_client.flush(timeout=0.01)
+
+        async_client.loop.call_soon(async_client.on_publish, async_client.client, None, 42)
+        assert await async_client.flush(timeout=1)
+
+    asyncio.run(main())
+
+
+def test_flush_stops_waiting_when_disconnected(async_client):
+    async def main():
+        attach(async_client)
+        async_client._unpublished_mids.add(42)
+        async_client.loop.call_soon(async_client.on_disconnect, async_client.client, None, mqtt.MQTT_ERR_SUCCESS)
+        return await async_client.flush(timeout=1)
+
+    assert asyncio.run(main())
+
+
+def test_wait_closed(async_client):
+    async def main():
+        attach(async_client)
+        assert not await async_client.wait_closed(0.01)
+        async_client.on_disconnect(async_client.client, None, mqtt.MQTT_ERR_SUCCESS)
+        return await async_client.wait_closed(1)
+
+    assert asyncio.run(main())
+    assert async_client._reconnect_task is None
+
+
+def test_reconnects_when_the_connection_is_lost(async_client, monkeypatch):
+    monkeypatch.setattr(async_client, "reconnect_delay", lambda: 0)
+
+    def reconnect():
+        async_client.client.reconnects += 1
+        async_client.loop.call_soon(async_client.on_connect, async_client.client, None, {}, 0)
+
+    async def main():
+        attach(async_client)
+        async_client.client.reconnect = reconnect
+        async_client.on_disconnect(async_client.client, None, mqtt.MQTT_ERR_CONN_LOST)
+        assert not async_client.connected
+        assert async_client.is_alive()
+
+        await asyncio.wait_for(async_client._reconnect_task, 1)
+        assert not await async_client.wait_closed(0.01)
+
+    asyncio.run(main())
+    assert async_client.connected
+    assert async_client.client.reconnects == 1
+    assert async_client._reconnect_task is None
@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+from pyfimptoha.helpers.CommandCoalescer import CommandCoalescer
+
+BINARY_TOPIC = "pt:j1/mt:cmd/rt:dev/rn:zw/ad:1/sv:out_bin_switch/ad:1_0"
+LEVEL_TOPIC = "pt:j1/mt:cmd/rt:dev/rn:zw/ad:1/sv:out_lvl_switch/ad:1_0"
+LEVEL_COMMAND = ("command", (LEVEL_TOPIC, "cmd.lvl.set"))
+LIGHT = "fh_1_zw_1_out_lvl_switch"
+
+
+def binary(on):
+    return {"serv": "out_bin_switch", "type": "cmd.binary.set", "val": on, "src": "homeassistant"}
+
+
+def level(value):
+    return {"serv": "out_lvl_switch", "type": "cmd.lvl.set", "val": value, "src": "homeassistant"}
+
+
+def sent(mqtt):
+    return [(topic, json.loads(payload)["val"]) for topic, payload, retain in mqtt.published]
+
+
+@pytest.fixture
+def coalescer(mqtt, wheel):
+    return CommandCoalescer(mqtt, 0.3, wheel)
+
+
+@pytest.fixture
+def binary_proxy(coalescer):
+    return coalescer.proxy(BINARY_TOPIC, LIGHT)
+
+
+@pytest.fixture
+def level_proxy(coalescer):
+    return coalescer.proxy(LEVEL_TOPIC, LIGHT)
+
+
+class TestCommandCoalescer:
+    def test_slider_burst_sends_the_last_command(self, mqtt, wheel, level_proxy):
+        assert level_proxy == "fh/cmd/rt:dev/rn:zw/ad:1/sv:out_lvl_switch/ad:1_0"
+        for value in [10, 40, 70]:
+            mqtt.deliver(level_proxy, level(value))
+        assert mqtt.published == []
+
+        wheel.fire(LEVEL_COMMAND)
+        assert sent(mqtt) == [(LEVEL_TOPIC, 70)]
+
+    def test_on_off_is_sent_right_away(self, mqtt, wheel, binary_proxy):
+        mqtt.deliver(binary_proxy, binary(True))
+        assert sent(mqtt) == [(BINARY_TOPIC, True)]
+        assert wheel.timers == {}
+
+    def test_off_after_slider_keeps_the_order(self, mqtt, wheel, binary_proxy, level_proxy):
+        mqtt.deliver(level_proxy, level(70))
+        mqtt.deliver(binary_proxy, binary(False))
+        assert sent(mqtt) == [(LEVEL_TOPIC, 70), (BINARY_TOPIC, False)]
+        # The slider command isn't sent again after the off
+        assert wheel.timers == {}
+
+    def test_other_groups_keep_waiting(self, mqtt, wheel, coalescer, level_proxy):
+        other_topic = BINARY_TOPIC.replace("ad:1_0", "ad:2_0")
+        other_proxy = coalescer.proxy(other_topic, "fh_1_zw_1_out_bin_switch_2")
+
+        mqtt.deliver(level_proxy, level(70))
+        mqtt.deliver(other_proxy, binary(True))
+        assert sent(mqtt) == [(other_topic, True)]
+        assert LEVEL_COMMAND in wheel.timers
+
+    def test_same_command_in_flight_is_dropped(self, mqtt, wheel, level_proxy):
+        for _ in range(2):
+            mqtt.deliver(level_proxy, level(70))
+            wheel.fire(LEVEL_COMMAND)
+        assert sent(mqtt) == [(LEVEL_TOPIC, 70)]
+
+        mqtt.deliver(LEVEL_TOPIC.replace("mt:cmd", "mt:evt"), {"type": "evt.lvl.report", "val": 70})
+        mqtt.deliver(level_proxy, level(70))
+        wheel.fire(LEVEL_COMMAND)
+        assert sent(mqtt) == [(LEVEL_TOPIC, 70), (LEVEL_TOPIC, 70)]
+
+    def test_remove(self, mqtt, wheel, coalescer, binary_proxy, level_proxy):
+        mqtt.deliver(level_proxy, level(70))
+        coalescer.remove(LEVEL_TOPIC)
+        assert wheel.timers == {}
+        assert [callback.topic_to_subscribe for callback in mqtt.callbacks.values()] == [
+            binary_proxy, BINARY_TOPIC.replace("pt:j1/mt:cmd", "pt:j1/mt:evt", 1)
+        ]
+
+        # The other commands of the entity aren't held up by the removed service
+        mqtt.deliver(binary_proxy, binary(False))
+        assert sent(mqtt) == [(BINARY_TOPIC, False)]
@@ -0,0 +1,110 @@
+import pytest
+
+from pyfimptoha.helpers.Deadband import Deadband, parse_rules
+
+STATE_TOPIC = "fh/zw_7_meter_elec_W/state"
+IDENTIFIER = "zw_7_meter_elec_W"
+HEARTBEAT = ("deadband", STATE_TOPIC)
+
+
+@pytest.fixture
+def rules():
+    return [("meter_elec_W", 5.0, False, None)]
+
+
+@pytest.fixture
+def deadband(rules, wheel, published):
+    helper = Deadband(rules, lambda topic, payload: published.append((topic, payload)), wheel)
+    helper.add(STATE_TOPIC, IDENTIFIER)
+    return helper
+
+
+class TestParseRules:
+    def test_rules(self):
+        assert parse_rules("sensor_temp:0.2, meter_elec_W:5%:600") == [
+            ("sensor_temp", 0.2, False, None),
+            ("meter_elec_W", 5.0, True, 600.0),
+        ]
+
+    @pytest.mark.parametrize("value", [None, "", " , ", "null"])
+    def test_unset(self, value):
+        assert parse_rules(value) == []
+
+    @pytest.mark.parametrize("rule", ["sensor_temp", "sensor_temp:x", "sensor_temp:%", "sensor_temp:1:x"])
+    def test_invalid_rules_are_ignored(self, rule):
+        assert parse_rules(f"{rule},meter_elec:1") == [("meter_elec", 1.0, False, None)]
+
+
+class TestDeadband:
+    @pytest.mark.parametrize("rules", [[("sensor_temp", 0.2, False, None)]])
+    def test_entities_without_a_rule_always_pass(self, deadband):
+        assert deadband.offer(STATE_TOPIC, "100")
+        assert deadband.offer(STATE_TOPIC, "100")
+
+    def test_absolute_threshold(self, deadband):
+        assert deadband.offer(STATE_TOPIC, "100")
+        assert not deadband.offer(STATE_TOPIC, "104.9")
+        assert not deadband.offer(STATE_TOPIC, "95.1")
+        assert deadband.offer(STATE_TOPIC, "105")
+        # Compared with the last sent state, not the last offered one
+        assert not deadband.offer(STATE_TOPIC, "101")
+        assert deadband.offer(STATE_TOPIC, "100")
+
+    def test_small_steps_do_not_creep_past_the_threshold(self, deadband):
+        deadband.offer(STATE_TOPIC, "100")
+        assert [deadband.offer(STATE_TOPIC, str(value)) for value in [102, 104, 106]] == [False, False, True]
+
+    @pytest.mark.parametrize("rules", [[("meter_elec_W", 5.0, True, None)]])
+    def test_percent_threshold(self, deadband):
+        assert deadband.offer(STATE_TOPIC, "1000")
+        assert not deadband.offer(STATE_TOPIC, "1049")
+        assert deadband.offer(STATE_TOPIC, "1050")
+        # 5% of 1050
+        assert not deadband.offer(STATE_TOPIC, "1000")
+        assert deadband.offer(STATE_TOPIC, "997")
+
+    @pytest.mark.parametrize("rules", [[("meter_elec_W", 10.0, True, None)]])
+    def test_percent_threshold_of_negative_states(self, deadband):
+        assert deadband.offer(STATE_TOPIC, "-100")
+        assert not deadband.offer(STATE_TOPIC, "-91")
+        assert deadband.offer(STATE_TOPIC, "-110")
+
+    @pytest.mark.parametrize("rules", [[("meter_elec_W", 5.0, True, None)]])
+    def test_percent_threshold_from_zero_passes_any_change(self, deadband):
+        assert deadband.offer(STATE_TOPIC, "0")
+        assert deadband.offer(STATE_TOPIC, "0.1")
+
+    @pytest.mark.parametrize("payload", ["on", "", "unknown"])
+    def test_non_numeric_states_always_pass(self, deadband, payload):
+        deadband.offer(STATE_TOPIC, "100")
+        assert deadband.offer(STATE_TOPIC, payload)
+        assert deadband.offer(STATE_TOPIC, payload)
+        # And don't change what the numeric states are compared with
+        assert not deadband.offer(STATE_TOPIC, "101")
+
+    @pytest.mark.parametrize("rules", [[("meter_elec_W", 5.0, False, 600.0)]])
+    def test_heartbeat_sends_the_latest_dropped_state(self, wheel, published, deadband):
+        assert deadband.offer(STATE_TOPIC, "100")
+        assert wheel.timers[HEARTBEAT][0] == 600.0
+        assert not deadband.offer(STATE_TOPIC, "102")
+
+        wheel.fire(HEARTBEAT)
+        assert published == [(STATE_TOPIC, "102")]
+        assert HEARTBEAT in wheel.timers
+        # The drift is now measured from the state sent by the heartbeat
+        assert not deadband.offer(STATE_TOPIC, "106")
+        assert deadband.offer(STATE_TOPIC, "107")
+
+    @pytest.mark.parametrize("rules", [[("meter_elec_W", 5.0, False, 600.0)]])
+    def test_heartbeat_restarts_when_a_state_is_sent(self, wheel, deadband):
+        deadband.offer(STATE_TOPIC, "100")
+        wheel.timers.clear()
+        assert deadband.offer(STATE_TOPIC, "110")
+        assert HEARTBEAT in wheel.timers
+
+    @pytest.mark.parametrize("rules", [[("meter_elec_W", 5.0, False, 600.0)]])
+    def test_remove(self, wheel, deadband):
+        deadband.offer(STATE_TOPIC, "100")
+        deadband.remove(STATE_TOPIC)
+        assert wheel.timers == {}
+        assert deadband.offer(STATE_TOPIC, "101")
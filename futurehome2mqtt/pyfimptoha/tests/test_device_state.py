@@ -0,0 +1,129 @@
+import json
+
+import pytest
+
+import pyfimptoha.device_state as device_state
+
+LEVEL_ADDR = "/rt:dev/rn:zw/ad:1/sv:out_lvl_switch/ad:6_0"
+METER_ADDR = "/rt:dev/rn:zw/ad:1/sv:meter_elec/ad:6_0"
+LEVEL_TOPIC = "pt:j1/mt:evt" + LEVEL_ADDR
+METER_TOPIC = "pt:j1/mt:evt" + METER_ADDR
+
+
+def state_response(services):
+    return {"val": {"param": {"state": {"devices": [{"id": 1, "services": services}]}}}}
+
+
+def service(name, addr, attribute, values):
+    return {"name": name, "addr": addr, "attributes": [{"name": attribute, "values": values}]}
+
+
+def status(topic, event_type, value, unit=None):
+    data = {"serv": "out_lvl_switch", "type": event_type, "val": value, "src": "homeassistant"}
+    if unit is not None:
+        data["props"] = {"unit": unit}
+    return topic, json.dumps(data)
+
+
+def get_report(addr, serv, report_name):
+    return "pt:j1/mt:cmd" + addr, serv, report_name
+
+
+def values(statuses):
+    return [(topic, json.loads(payload)["type"], json.loads(payload)["val"]) for topic, payload in statuses]
+
+
+@pytest.fixture
+def entity_reports():
+    """
+    (topic, event type) of the entities built in the discovery
+    """
+    return {(LEVEL_TOPIC, "evt.lvl.report"), (METER_TOPIC, "evt.meter.report")}
+
+
+@pytest.fixture
+def apply(entity_reports):
+    def apply(data, statuses_list, get_reports_list):
+        return device_state.apply(
+            data, lambda topic, event_type: (topic, event_type) in entity_reports, statuses_list, get_reports_list
+        )
+    return apply
+
+
+@pytest.mark.parametrize("data,expected", [
+    (state_response([]), True),
+    ({"val": {"param": {"state": None}}}, True),
+    ({"val": {"param": {"device": []}}}, False),
+    ({"val": None}, False),
+    ({}, False),
+])
+def test_is_state_response(data, expected):
+    assert device_state.is_state_response(data) == expected
+
+
+def test_statuses_shaped_like_events(entity_reports):
+    data = state_response([
+        service("meter_elec", METER_ADDR, "meter", [
+            {"val": 12.5, "val_t": "float", "props": {"unit": "W"}},
+            {"val": 100, "val_t": "float", "props": {"unit": "kWh"}},
+        ]),
+    ])
+    statuses = list(device_state.statuses(data, lambda topic, event_type: (topic, event_type) in entity_reports))
+    assert [json.loads(payload) for topic, payload in statuses] == [
+        {"props": {"unit": "W"}, "serv": "meter_elec", "type": "evt.meter.report", "val": 12.5, "val_t": "float", "src": "homeassistant"},
+        {"props": {"unit": "kWh"}, "serv": "meter_elec", "type": "evt.meter.report", "val": 100, "val_t": "float", "src": "homeassistant"},
+    ]
+    assert {topic for topic, payload in statuses} == {METER_TOPIC}
+
+
+def test_values_replace_the_statuses_of_the_same_reports(apply):
+    data = state_response([service("out_lvl_switch", LEVEL_ADDR, "lvl", [{"val": 80}])])
+    statuses = [
+        status(LEVEL_TOPIC, "evt.lvl.report", 10),
+        status(LEVEL_TOPIC, "evt.binary.report", True),
+    ]
+    merged, remaining = apply(data, statuses, [])
+    assert values(merged) == [(LEVEL_TOPIC, "evt.binary.report", True), (LEVEL_TOPIC, "evt.lvl.report", 80)]
+
+
+def test_statuses_of_other_units_kept(apply):
+    data = state_response([service("meter_elec", METER_ADDR, "meter", [{"val": 12.5, "props": {"unit": "W"}}])])
+    statuses = [status(METER_TOPIC, "evt.meter.report", 100, unit="kWh")]
+    merged, remaining = apply(data, statuses, [])
+    assert values(merged) == [(METER_TOPIC, "evt.meter.report", 100), (METER_TOPIC, "evt.meter.report", 12.5)]
+
+
+def test_only_entity_reports_used(apply, entity_reports):
+    entity_reports.discard((LEVEL_TOPIC, "evt.lvl.report"))
+    data = state_response([
+        service("out_lvl_switch", LEVEL_ADDR, "lvl", [{"val": 80}]),
+        service("alarm_fire", "/rt:dev/rn:zw/ad:1/sv:alarm_fire/ad:6_0", "alarm", [{"val": {"event": "smoke"}}]),
+    ])
+    merged, remaining = apply(data, [], [get_report(LEVEL_ADDR, "out_lvl_switch", "cmd.lvl.get_report")])
+    assert merged == []
+    assert len(remaining) == 1
+
+
+def test_values_without_a_value_skipped(apply):
+    data = state_response([service("out_lvl_switch", LEVEL_ADDR, "lvl", [{"val": None}])])
+    statuses = [status(LEVEL_TOPIC, "evt.lvl.report", 10)]
+    merged, remaining = apply(data, statuses, [get_report(LEVEL_ADDR, "out_lvl_switch", "cmd.lvl.get_report")])
+    assert values(merged) == [(LEVEL_TOPIC, "evt.lvl.report", 10)]
+    assert len(remaining) == 1
+
+
+def test_get_reports_answered_by_the_response_dropped(apply):
+    data = state_response([service("out_lvl_switch", LEVEL_ADDR, "lvl", [{"val": 80}])])
+    get_reports = [
+        get_report(LEVEL_ADDR, "out_lvl_switch", "cmd.lvl.get_report"),
+        get_report(LEVEL_ADDR, "out_lvl_switch", "cmd.binary.get_report"),
+        get_report(METER_ADDR, "meter_elec", "cmd.meter.get_report"),
+    ]
+    merged, remaining = apply(data, [], get_reports)
+    assert remaining == get_reports[1:]
+
+
+def test_empty_state(apply):
+    statuses = [status(LEVEL_TOPIC, "evt.lvl.report", 10)]
+    get_reports = [get_report(LEVEL_ADDR, "out_lvl_switch", "cmd.lvl.get_report")]
+    assert apply({"val": {"param": {"state": None}}}, statuses, get_reports) == (statuses, get_reports)
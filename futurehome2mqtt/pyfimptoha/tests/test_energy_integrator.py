@@ -0,0 +1,99 @@
+import pytest
+
+from pyfimptoha.helpers.EnergyIntegrator import EnergyIntegrator
+from pyfimptoha.tests.fakes import FakeMqtt
+
+EVENT_TOPIC = "pt:j1/mt:evt/rt:dev/rn:zw/ad:1/sv:meter_elec/ad:8_0"
+IDENTIFIER = "zw_8_meter_elec_kWh_integrated"
+STATE_TOPIC = f"fh/{IDENTIFIER}/state"
+
+
+def power(data):
+    return data["val"] if data["props"]["unit"] == "W" else None
+
+
+def report(watt, unit="W"):
+    return {"type": "evt.meter.report", "serv": "meter_elec", "val": watt, "props": {"unit": unit}}
+
+
+def totals(mqtt):
+    return [payload for topic, payload, retain in mqtt.published if topic == STATE_TOPIC]
+
+
+@pytest.fixture
+def integrator(mqtt, clock, tmp_path):
+    helper = EnergyIntegrator(mqtt, str(tmp_path))
+    helper.register(EVENT_TOPIC, IDENTIFIER, power)
+    return helper
+
+
+class TestEnergyIntegrator:
+    def test_state_topic(self, integrator):
+        assert integrator.register(EVENT_TOPIC, IDENTIFIER, power) == STATE_TOPIC
+
+    def test_trapezoid(self, mqtt, clock, integrator):
+        mqtt.deliver(EVENT_TOPIC, report(500))
+        clock.now += 3600
+        mqtt.deliver(EVENT_TOPIC, report(1500))
+        assert totals(mqtt) == ["1.0"]
+        assert mqtt.published[-1][2] is True
+
+    def test_first_report_only_starts_the_integration(self, mqtt, integrator):
+        # Nothing is published before the retained total can have arrived
+        assert mqtt.published == []
+        mqtt.deliver(EVENT_TOPIC, report(1000))
+        assert mqtt.published == []
+
+    def test_long_gap_between_reports(self, mqtt, clock, integrator):
+        # Meters report on change, so the power holds until the next report
+        mqtt.deliver(EVENT_TOPIC, report(1000))
+        clock.now += 2 * 3600
+        mqtt.deliver(EVENT_TOPIC, report(1000))
+        clock.now += 36
+        mqtt.deliver(EVENT_TOPIC, report(1000))
+        assert totals(mqtt) == ["2.0", "2.01"]
+
+    def test_export_and_foreign_reports_dont_count(self, mqtt, clock, integrator):
+        mqtt.deliver(EVENT_TOPIC, report(-2000))
+        clock.now += 3600
+        mqtt.deliver(EVENT_TOPIC, report(-1000))
+        mqtt.deliver(EVENT_TOPIC, report(123, unit="V"))
+        mqtt.deliver(EVENT_TOPIC, {**report(5000), "src": "homeassistant"})
+        assert mqtt.published == []
+
+    def test_restart_continues_from_the_saved_total(self, mqtt, clock, tmp_path, integrator):
+        mqtt.deliver(EVENT_TOPIC, report(1000))
+        clock.now += 3600
+        mqtt.deliver(EVENT_TOPIC, report(1000))
+        # One delayed save for a burst of changes
+        assert [delay for delay, callback in mqtt.delayed] == [EnergyIntegrator.SAVE_DELAY]
+        integrator.save()
+
+        restarted_mqtt = FakeMqtt()
+        restarted = EnergyIntegrator(restarted_mqtt, str(tmp_path))
+        restarted.register(EVENT_TOPIC, IDENTIFIER, power)
+        restarted_mqtt.deliver(EVENT_TOPIC, report(1000))
+        clock.now += 1800
+        restarted_mqtt.deliver(EVENT_TOPIC, report(1000))
+        assert totals(restarted_mqtt) == ["1.5"]
+
+    def test_retained_total_higher_than_the_saved_one(self, mqtt, clock, integrator):
+        # E.g. after a crash, the total published last wasn't saved
+        mqtt.deliver(STATE_TOPIC, 10.0)
+        mqtt.deliver(EVENT_TOPIC, report(1000))
+        clock.now += 3600
+        mqtt.deliver(EVENT_TOPIC, report(1000))
+        assert totals(mqtt) == ["11.0"]
+
+    def test_retained_total_lower_than_the_saved_one(self, mqtt, clock, integrator):
+        mqtt.deliver(EVENT_TOPIC, report(1000))
+        clock.now += 3600
+        mqtt.deliver(EVENT_TOPIC, report(1000))
+        mqtt.deliver(STATE_TOPIC, 0.5)
+        clock.now += 3600
+        mqtt.deliver(EVENT_TOPIC, report(1000))
+        assert totals(mqtt) == ["1.0", "2.0"]
+
+    def test_remove(self, mqtt, integrator):
+        integrator.remove(EVENT_TOPIC)
+        assert mqtt.callbacks == {}
@@ -0,0 +1,279 @@
+import copy
+import json
+
+import pytest
+
+from pyfimptoha.helpers.Aggregator import Aggregator
+from pyfimptoha.helpers.CommandCoalescer import CommandCoalescer
+from pyfimptoha.helpers.EnergyIntegrator import EnergyIntegrator
+from pyfimptoha.helpers.PollScheduler import PollScheduler
+from pyfimptoha.helpers.StateTranslator import StateTranslator
+from pyfimptoha.incremental import IncrementalDiscovery, topic_vinculum_evt
+from pyfimptoha.tests.fakes import FakeReportScheduler, message
+
+COMMAND_TOPIC = "pt:j1/mt:cmd/rt:app/rn:vinculum/ad:1"
+RESPONSE_TOPIC = "pt:j1/mt:rsp/rt:app/rn:homeassistant/ad:flow1"
+DISCOVER_REQUEST = {"serv": "vinculum", "type": "cmd.pd7.request", "val": {"cmd": "get"}}
+CHARGEPOINT_EVENT_TOPIC = "pt:j1/mt:evt/rt:dev/rn:easee/ad:1/sv:chargepoint/ad:8"
+
+
+def service(name, address, intf, **props):
+    return {"addr": f"/rt:dev/rn:zw/ad:1/sv:{name}/ad:{address}_0", "enabled": True, "intf": intf, "props": props}
+
+
+def device(device_id, room, address, functionality, services, name="Device"):
+    return {
+        "id": device_id, "room": room, "thing": device_id, "functionality": functionality,
+        "client": {"name": name}, "fimp": {"adapter": "zwave-ad", "address": address},
+        "model": "", "type": {"type": ""}, "param": {}, "services": services,
+    }
+
+
+def light(name="Light", room=1):
+    return device(1, room, "6", "lighting", {
+        "out_bin_switch": service("out_bin_switch", "6", ["cmd.binary.set", "evt.binary.report"]),
+        "out_lvl_switch": service("out_lvl_switch", "6", ["cmd.lvl.set", "cmd.lvl.get_report", "evt.lvl.report"]),
+        "meter_elec": service("meter_elec", "6", ["cmd.meter.get_report", "evt.meter.report"], sup_units=["W"]),
+    }, name)
+
+
+def sensor(device_id=2, address="7"):
+    return device(device_id, 2, address, None, {
+        "sensor_temp": service("sensor_temp", address, ["cmd.sensor.get_report", "evt.sensor.report"], sup_units=["C"]),
+    }, "Sensor")
+
+
+def charger():
+    return {
+        **device(3, 1, "8", None, {}, "Charger"),
+        "fimp": {"adapter": "easee", "address": "8"},
+        "services": {"chargepoint": {
+            "addr": "/rt:dev/rn:easee/ad:1/sv:chargepoint/ad:8",
+            "enabled": True,
+            "intf": [
+                "cmd.charge.start", "cmd.charge.stop", "evt.state.report",
+                "evt.current_session.report", "evt.max_current.report",
+            ],
+            "props": {},
+        }},
+    }
+
+
+def param(devices, rooms=None, shortcuts=None):
+    return {
+        "device": devices,
+        "room": rooms if rooms is not None else [{"id": 1, "alias": "Kitchen"}, {"id": 2, "alias": "Hall"}],
+        "shortcut": shortcuts or [],
+        "house": {"mode": "home"},
+    }
+
+
+def notify(cmd, component, object_id, param=None):
+    return {"type": "evt.pd7.notify", "val": {"cmd": cmd, "component": component, "id": object_id, "param": param}}
+
+
+def receive(mqtt_client, topic, data):
+    mqtt_client.on_message(None, None, message(topic, data))
+
+
+@pytest.fixture
+def client(mqtt_client, wheel):
+    """
+    The MqttClient with all helpers, running their timers on `wheel`
+    """
+    mqtt_client._discovery_snapshot = False
+    mqtt_client.wheel = wheel
+    mqtt_client.report_scheduler = FakeReportScheduler()
+    mqtt_client.translator = StateTranslator(mqtt_client)
+    mqtt_client.poll_scheduler = PollScheduler(mqtt_client, 60, 3600)
+    mqtt_client.aggregator = Aggregator(mqtt_client, [300])
+    mqtt_client.energy_integrator = EnergyIntegrator(mqtt_client, mqtt_client._data_path)
+    mqtt_client.command_coalescer = CommandCoalescer(mqtt_client, 0.3)
+    return mqtt_client
+
+
+@pytest.fixture
+def devices():
+    """
+    What the hub reported in the full discovery pass
+    """
+    return [light(), sensor()]
+
+
+@pytest.fixture
+def discovery(client, devices):
+    """
+    Started after a full discovery pass over `devices`
+    """
+    discovery = IncrementalDiscovery(
+        client, COMMAND_TOPIC, RESPONSE_TOPIC, DISCOVER_REQUEST,
+        lambda msg, data: data.get("type") == "evt.pd7.response", "default", [], False
+    )
+    client.begin_discovery()
+    client.end_discovery()
+    discovery.start(param(devices))
+    discovery.update_devices(devices)
+    client.client.published.clear()
+    client.delayed.clear()
+    return discovery
+
+
+def configs(client, address):
+    return {topic: json.loads(payload) for topic, payload in client.discovery_configs.items() if f"_{address}_" in topic}
+
+
+def published_configs(client):
+    return {topic for topic, payload, retain in client.client.published if topic.endswith("/config") and payload}
+
+
+def removed_configs(client):
+    return {topic for topic, payload, retain in client.client.published if topic.endswith("/config") and not payload}
+
+
+def subscribed(client, address):
+    return {
+        callback.topic_to_subscribe for callback in client.on_message_callbacks.values()
+        if f"ad:{address}" in callback.topic_to_subscribe
+    }
+
+
+class TestNotify:
+    def test_full_device_rebuilt(self, client, discovery):
+        receive(client, topic_vinculum_evt, notify("edit", "device", 1, light(name="Lamp")))
+
+        assert published_configs(client) == set(configs(client, "6"))
+        assert {config["device"]["name"] for config in configs(client, "6").values()} == {"Lamp"}
+        assert removed_configs(client) == set()
+
+    def test_other_changes_refreshed_once(self, client, discovery):
+        receive(client, topic_vinculum_evt, notify("edit", "room", 1))
+        receive(client, topic_vinculum_evt, notify("edit", "device", 1, {"id": 1}))
+        [(delay, refresh)] = client.delayed
+        assert delay == 1
+
+        refresh()
+        [(topic, payload, retain)] = client.client.published
+        request = json.loads(payload)
+        assert topic == COMMAND_TOPIC
+        assert request["val"] == DISCOVER_REQUEST["val"]
+
+        receive(client, RESPONSE_TOPIC, {
+            "type": "evt.pd7.response", "corid": request["uid"],
+            "val": {"param": param([light(name="Lamp"), sensor()])},
+        })
+        assert {config["device"]["name"] for config in configs(client, "6").values()} == {"Lamp"}
+
+    @pytest.mark.parametrize("data", [
+        {"type": "evt.pd7.notify", "val": None},
+        {"type": "evt.pd7.notify", "val": {"component": "device", "cmd": "edit", "param": {"id": 1, "services": {}, "fimp": None}}},
+        {"type": "evt.pd7.notify", "val": {"component": "mode", "cmd": "set"}},
+        {"type": "evt.pd7.response", "val": {"component": "device", "cmd": "delete", "id": 1}},
+    ])
+    def test_others_and_malformed_ignored(self, client, discovery, data):
+        receive(client, topic_vinculum_evt, data)
+        assert client.client.published == []
+        assert client.delayed == []
+
+
+class TestRefreshed:
+    def test_unchanged_devices_not_rebuilt(self, client, discovery):
+        changed_state = light()
+        changed_state["param"] = {"power": "on"}
+        discovery._refreshed(param([changed_state, sensor()]))
+        assert client.client.published == []
+
+    def test_added(self, client, discovery):
+        discovery._refreshed(param([light(), sensor(), sensor(4, "9")]))
+
+        assert published_configs(client) == set(configs(client, "9"))
+        assert configs(client, "9")
+        assert removed_configs(client) == set()
+
+    def test_changed(self, client, discovery):
+        discovery._refreshed(param([light(name="Lamp"), sensor()]))
+
+        assert published_configs(client) == set(configs(client, "6"))
+        assert {config["device"]["name"] for config in configs(client, "6").values()} == {"Lamp"}
+
+    def test_renamed_room(self, client, discovery):
+        discovery._refreshed(param([light(), sensor()], [{"id": 1, "alias": "Kitchen"}, {"id": 2, "alias": "Porch"}]))
+
+        assert published_configs(client) == set(configs(client, "7"))
+        assert {config["device"]["suggested_area"] for config in configs(client, "7").values()} == {"Porch"}
+
+    def test_deleted(self, client, discovery):
+        discovery._refreshed(param([sensor()]))
+        assert configs(client, "6") == {}
+        assert removed_configs(client)
+
+    def test_changed_shortcuts(self, client, discovery):
+        discovery._refreshed(param([light(), sensor()], shortcuts=[{"id": 5, "client": {"name": "Movie"}}]))
+        assert "homeassistant/button/fh_shortcut_5/config" in published_configs(client)
+
+
+class TestDelete:
+    def test_components_removed(self, client, discovery):
+        light_configs = set(configs(client, "6"))
+        receive(client, topic_vinculum_evt, notify("delete", "device", 1))
+
+        assert removed_configs(client) == light_configs
+        assert configs(client, "6") == {}
+        assert configs(client, "7")
+        assert not any("ad:6_0" in topic for topic, payload in client.discovery_statuses)
+
+    def test_helpers_stop(self, client, discovery):
+        # The coalescer, translator, poll scheduler, aggregator and energy integrator
+        assert len(subscribed(client, "6")) > 3
+        receive(client, topic_vinculum_evt, notify("delete", "device", 1))
+
+        assert subscribed(client, "6") == set()
+        assert subscribed(client, "7")
+
+    def test_unknown_device(self, client, discovery):
+        receive(client, topic_vinculum_evt, notify("delete", "device", 99))
+        assert client.client.published == []
+
+
+class TestChargepoint:
+    @pytest.fixture
+    def devices(self):
+        return []
+
+    def rebuild(self, client, discovery):
+        discovery.update_devices([charger()])
+        [(topic, payload, retain)] = client.client.published
+        client.client.published.clear()
+        return json.loads(payload)
+
+    def answer(self, client, request, max_current):
+        receive(client, CHARGEPOINT_EVENT_TOPIC, {
+            "type": "evt.max_current.report", "val": max_current, "corid": request["uid"]
+        })
+
+    @pytest.fixture
+    def built(self, client, discovery):
+        """
+        The charger, built once its max_current came
+        """
+        self.answer(client, self.rebuild(client, discovery), 32)
+        client.client.published.clear()
+        client.delayed.clear()
+        return copy.deepcopy(client.discovery_configs)
+
+    def test_built_once_max_current_comes(self, client, discovery):
+        request = self.rebuild(client, discovery)
+        assert request["type"] == "cmd.max_current.get_report"
+        assert client.discovery_configs == {}
+
+        self.answer(client, request, 32)
+        [number] = [config for topic, config in configs(client, "8").items() if topic.startswith("homeassistant/number/")]
+        assert number["max"] == 32
+
+    def test_kept_when_max_current_does_not_come(self, client, discovery, built):
+        self.rebuild(client, discovery)
+        [(delay, timeout)] = client.delayed
+        timeout()
+
+        assert removed_configs(client) == set()
+        assert client.discovery_configs == built
+        assert "homeassistant/number/fh_3_easee_8_chargepoint_current/config" in built
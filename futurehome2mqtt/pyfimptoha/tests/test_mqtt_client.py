@@ -0,0 +1,250 @@
+import json
+import threading
+import time
+
+import pytest
+
+from pyfimptoha.mqtt_client import MqttCallback, PendingRequest, Subscriptions, is_republished
+from pyfimptoha.tests.fakes import message
+
+TOPIC = "pt:j1/mt:evt/rt:dev/rn:zw/ad:1/sv:sensor_temp/ad:6_0"
+
+
+@pytest.fixture
+def received(mqtt_client):
+    """
+    (kind, payload) of the messages passed to a raw and a dict callback on TOPIC
+    """
+    received = []
+    mqtt_client.add_callback(MqttCallback(
+        topic_to_subscribe=TOPIC,
+        on_raw_message=lambda msg: received.append(("raw", msg.payload)),
+    ))
+    mqtt_client.add_callback(MqttCallback(
+        topic_to_subscribe=TOPIC,
+        on_dict_message=lambda msg, data: received.append(("dict", data)),
+    ))
+    return received
+
+
+class TestMessageDispatch:
+    def test_json_objects(self, mqtt_client, received):
+        mqtt_client.on_message(None, None, message(TOPIC, {"type": "evt.sensor.report"}))
+        assert received == [("raw", b'{"type": "evt.sensor.report"}'), ("dict", {"type": "evt.sensor.report"})]
+
+    @pytest.mark.parametrize("payload", ["123", "[1, 2]", '"x"', "null", "not json", ""])
+    def test_other_payloads_only_reach_raw_callbacks(self, mqtt_client, received, payload):
+        mqtt_client.on_message(None, None, message(TOPIC, payload))
+        assert received == [("raw", payload.encode("utf-8"))]
+
+    def test_failing_callback_does_not_stop_the_others(self, mqtt_client, received):
+        mqtt_client.add_callback(MqttCallback(topic_to_subscribe="pt:j1/mt:evt/#", on_dict_message=lambda msg, data: 1 / 0))
+        mqtt_client.on_message(None, None, message(TOPIC, {"type": "evt.sensor.report"}))
+        assert ("dict", {"type": "evt.sensor.report"}) in received
+
+    def test_subscriptions_are_shared(self, mqtt_client, received):
+        assert mqtt_client.client.subscribed == [TOPIC]
+
+        for callback_id in list(mqtt_client.on_message_callbacks):
+            mqtt_client.remove_callback(callback_id)
+        assert mqtt_client.client.unsubscribed == [TOPIC]
+        mqtt_client.on_message(None, None, message(TOPIC, {"type": "evt.sensor.report"}))
+        assert received == []
+
+
+COMMAND_TOPIC = "pt:j1/mt:cmd/rt:app/rn:vinculum/ad:1"
+RESPONSE_TOPIC = "pt:j1/mt:rsp/rt:app/rn:homeassistant/ad:flow1"
+REQUEST = {"serv": "vinculum", "type": "cmd.pd7.request", "val": {"cmd": "get"}}
+
+
+def sent_uid(mqtt_client):
+    topic, payload, retain = mqtt_client.client.published[-1]
+    assert topic == COMMAND_TOPIC
+    return json.loads(payload)["uid"]
+
+
+def reply(mqtt_client, corid, **data):
+    mqtt_client.on_message(None, None, message(RESPONSE_TOPIC, {"type": "evt.pd7.response", "corid": corid, **data}))
+
+
+class TestPendingRequest:
+    def test_matches_the_correlation_id(self):
+        request = PendingRequest(RESPONSE_TOPIC, uid="1")
+        assert request.matches(None, {"corid": "1"})
+        assert not request.matches(None, {"corid": "2"})
+        assert not request.matches(None, {})
+
+    def test_matches_the_predicate(self):
+        request = PendingRequest(RESPONSE_TOPIC, uid="1", is_correct=lambda msg, data: data.get("type") == "evt.pd7.response")
+        assert request.matches(None, {"corid": "2", "type": "evt.pd7.response"})
+        assert not request.matches(None, {"type": "evt.pd7.notify"})
+
+    def test_resolved_once(self):
+        done = []
+        request = PendingRequest(RESPONSE_TOPIC, uid="1")
+        request.on_done = done.append
+        assert request.resolve("msg", {"val": 1})
+        assert not request.resolve("msg", {"val": 2})
+        assert not request.expire()
+        assert request.wait(0) == ("msg", {"val": 1})
+        assert done == [("msg", {"val": 1})]
+
+    def test_expired(self):
+        done = []
+        request = PendingRequest(RESPONSE_TOPIC, uid="1")
+        request.on_done = done.append
+        assert request.expire()
+        assert not request.resolve("msg", {"val": 1})
+        assert request.wait(0) is None
+        assert done == [None]
+
+
+class TestRequests:
+    def test_reply_is_matched_on_the_correlation_id(self, mqtt_client):
+        request = mqtt_client.send_request(COMMAND_TOPIC, RESPONSE_TOPIC, REQUEST)
+        uid = sent_uid(mqtt_client)
+        assert uid == request.uid
+        assert mqtt_client.client.subscribed[-1] == RESPONSE_TOPIC
+
+        reply(mqtt_client, "someone else's request", val=1)
+        assert not request.done()
+        reply(mqtt_client, uid, val=2)
+        assert request.wait(0)[1]["val"] == 2
+
+    def test_every_request_gets_its_own_uid(self, mqtt_client):
+        mqtt_client.send_request(COMMAND_TOPIC, RESPONSE_TOPIC, REQUEST)
+        first = sent_uid(mqtt_client)
+        mqtt_client.send_request(COMMAND_TOPIC, RESPONSE_TOPIC, REQUEST)
+        assert sent_uid(mqtt_client) != first
+        assert "uid" not in REQUEST
+
+    def test_callback_removed_once_answered(self, mqtt_client):
+        request = mqtt_client.send_request(COMMAND_TOPIC, RESPONSE_TOPIC, REQUEST)
+        reply(mqtt_client, request.uid)
+        assert mqtt_client.on_message_callbacks == {}
+        assert mqtt_client.client.unsubscribed == [RESPONSE_TOPIC]
+        # Safe to call again
+        mqtt_client.finish_request(request)
+        assert mqtt_client.client.unsubscribed == [RESPONSE_TOPIC]
+
+    def test_on_response(self, mqtt_client):
+        responses = []
+        request = mqtt_client.send_request(COMMAND_TOPIC, RESPONSE_TOPIC, REQUEST, on_response=responses.append, timeout=10)
+        assert [delay for delay, callback in mqtt_client.delayed] == [10]
+
+        reply(mqtt_client, request.uid, val=1)
+        assert [data["val"] for msg, data in responses] == [1]
+        assert mqtt_client.on_message_callbacks == {}
+
+        # The timeout has nothing left to do
+        mqtt_client.delayed[0][1]()
+        assert len(responses) == 1
+
+    def test_on_response_timeout(self, mqtt_client):
+        responses = []
+        request = mqtt_client.send_request(COMMAND_TOPIC, RESPONSE_TOPIC, REQUEST, on_response=responses.append)
+        mqtt_client.delayed[0][1]()
+        assert responses == [None]
+        assert mqtt_client.on_message_callbacks == {}
+        assert mqtt_client.client.unsubscribed == [RESPONSE_TOPIC]
+
+        # A late reply is ignored
+        reply(mqtt_client, request.uid)
+        assert responses == [None]
+
+    def test_send_and_wait(self, mqtt_client):
+        def answer():
+            while not mqtt_client.client.published:
+                time.sleep(0.01)
+            reply(mqtt_client, sent_uid(mqtt_client), val=1)
+
+        threading.Thread(target=answer).start()
+        msg, data = mqtt_client.send_and_wait(COMMAND_TOPIC, RESPONSE_TOPIC, REQUEST, timeout=1)
+        assert data["val"] == 1
+        assert mqtt_client.on_message_callbacks == {}
+
+    def test_send_and_wait_timeout(self, mqtt_client):
+        assert mqtt_client.send_and_wait(COMMAND_TOPIC, RESPONSE_TOPIC, REQUEST, timeout=0.01) is None
+        assert mqtt_client.on_message_callbacks == {}
+        assert mqtt_client.client.unsubscribed == [RESPONSE_TOPIC]
+
+
+class TestSubscriptions:
+    def test_one_callback_per_topic(self, mqtt):
+        subscriptions = Subscriptions(mqtt)
+        subscriptions.add(TOPIC, on_dict_message=lambda msg, data: None)
+        subscriptions.add(TOPIC, on_dict_message=lambda msg, data: None)
+        assert [callback.topic_to_subscribe for callback in mqtt.callbacks.values()] == [TOPIC]
+
+    def test_remove(self, mqtt):
+        subscriptions = Subscriptions(mqtt)
+        subscriptions.add(TOPIC, on_dict_message=lambda msg, data: None)
+        subscriptions.remove(TOPIC)
+        subscriptions.remove(TOPIC)
+        assert mqtt.callbacks == {}
+
+        # And subscribed to again
+        subscriptions.add(TOPIC, on_dict_message=lambda msg, data: None)
+        assert len(mqtt.callbacks) == 1
+
+
+@pytest.mark.parametrize("data,expected", [
+    ({"type": "evt.lvl.report", "src": "homeassistant"}, True),
+    ({"type": "evt.lvl.report", "src": "zwave-ad"}, False),
+    ({"type": "evt.lvl.report"}, False),
+])
+def test_is_republished(data, expected):
+    assert is_republished(data) == expected
+
+
+CONFIG_TOPIC = "homeassistant/number/fh_9_zw_9_chargepoint_current/config"
+OTHER_CONFIG_TOPIC = "homeassistant/sensor/fh_9_zw_9_chargepoint_state/config"
+
+
+class TestKeepDiscoveryConfig:
+    def removed(self, mqtt_client):
+        return [topic for topic, payload, retain in mqtt_client.client.published if payload == ""]
+
+    @pytest.mark.parametrize("owner", [None, "device 9"])
+    def test_kept_from_the_last_pass(self, mqtt_client, owner):
+        mqtt_client.begin_discovery()
+        mqtt_client.discovery_registry.owner = "device 9"
+        mqtt_client.publish(CONFIG_TOPIC, '{"max": 32}')
+        mqtt_client.publish(OTHER_CONFIG_TOPIC, "{}")
+        mqtt_client.end_discovery()
+
+        mqtt_client.begin_discovery(owner)
+        mqtt_client.discovery_registry.owner = "device 9"
+        assert mqtt_client.keep_discovery_config(CONFIG_TOPIC)
+        mqtt_client.end_discovery()
+
+        assert self.removed(mqtt_client) == [OTHER_CONFIG_TOPIC]
+        assert mqtt_client.discovery_configs == {CONFIG_TOPIC: '{"max": 32}'}
+        # Unchanged, so not sent again
+        assert [topic for topic, payload, retain in mqtt_client.client.published].count(CONFIG_TOPIC) == 1
+
+    def test_kept_from_an_earlier_run(self, mqtt_client):
+        registry = mqtt_client.discovery_registry
+        registry.begin_pass()
+        registry.is_changed(CONFIG_TOPIC, '{"max": 32}')
+        registry.end_pass()
+
+        mqtt_client.begin_discovery()
+        assert mqtt_client.keep_discovery_config(CONFIG_TOPIC)
+        mqtt_client.end_discovery()
+        assert self.removed(mqtt_client) == []
+
+    def test_unknown(self, mqtt_client):
+        mqtt_client.begin_discovery()
+        assert not mqtt_client.keep_discovery_config(CONFIG_TOPIC)
+        mqtt_client.end_discovery()
+        assert mqtt_client.client.published == []
+
+    def test_aborted_pass_keeps_the_configs(self, mqtt_client):
+        mqtt_client.begin_discovery()
+        mqtt_client.publish(CONFIG_TOPIC, '{"max": 32}')
+        mqtt_client.end_discovery()
+
+        mqtt_client.begin_discovery()
+        mqtt_client.abort_discovery()
+        assert mqtt_client.discovery_configs == {CONFIG_TOPIC: '{"max": 32}'}
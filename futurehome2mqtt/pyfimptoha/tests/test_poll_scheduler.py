@@ -0,0 +1,139 @@
+import pytest
+
+from pyfimptoha.helpers.PollScheduler import PollScheduler
+
+TOPIC = "pt:j1/mt:cmd/rt:dev/rn:zw/ad:1/sv:sensor_temp/ad:6_0"
+EVENT_TOPIC = "pt:j1/mt:evt/rt:dev/rn:zw/ad:1/sv:sensor_temp/ad:6_0"
+REPORT_NAME = "cmd.sensor.get_report"
+KEY = (TOPIC, REPORT_NAME, None)
+TIMER = ("poll",)
+METER_TOPIC = "pt:j1/mt:cmd/rt:dev/rn:zw/ad:1/sv:meter_elec/ad:6_0"
+METER_EVENT_TOPIC = "pt:j1/mt:evt/rt:dev/rn:zw/ad:1/sv:meter_elec/ad:6_0"
+
+
+def report(src="zwave-ad"):
+    return {"serv": "sensor_temp", "type": "evt.sensor.report", "val": 21.5, "src": src}
+
+
+@pytest.fixture
+def intervals():
+    return 60, 3600
+
+
+@pytest.fixture
+def poll_scheduler(mqtt, clock, intervals):
+    helper = PollScheduler(mqtt, *intervals)
+    helper.add(TOPIC, "sensor_temp", REPORT_NAME)
+    return helper
+
+
+class TestPollScheduler:
+    def advance(self, wheel, clock, seconds):
+        """
+        Moves the clock on and fires the poll timer, which only polls what is due
+        """
+        clock.now += seconds
+        if TIMER in wheel.timers:
+            wheel.fire(TIMER)
+
+    def polled(self, mqtt):
+        polled = mqtt.report_scheduler.event.is_set()
+        mqtt.report_scheduler.event.clear()
+        return polled
+
+    def report_at(self, mqtt, clock, *times):
+        for now in times:
+            clock.now = now
+            mqtt.deliver(EVENT_TOPIC, report())
+
+    def test_polls_after_the_min_interval(self, mqtt, wheel, clock, poll_scheduler):
+        assert wheel.timers[TIMER][0] == pytest.approx(60.0)
+        self.advance(wheel, clock, 59)
+        assert not self.polled(mqtt)
+
+        self.advance(wheel, clock, 1)
+        assert self.polled(mqtt)
+        assert mqtt.report_scheduler.added == [([[TOPIC, "sensor_temp", REPORT_NAME, None]], False)]
+
+        # And again after the next interval
+        self.advance(wheel, clock, 60)
+        assert self.polled(mqtt)
+
+    def test_added_once(self, mqtt, wheel, clock, poll_scheduler):
+        poll_scheduler.add(TOPIC, "sensor_temp", REPORT_NAME)
+        assert len(mqtt.callbacks) == 1
+
+        self.advance(wheel, clock, 60)
+        assert self.polled(mqtt)
+        assert not self.polled(mqtt)
+        assert len(mqtt.report_scheduler.added) == 1
+
+    def test_report_pushes_the_poll_back(self, mqtt, wheel, clock, poll_scheduler):
+        self.report_at(mqtt, clock, 1050.0)
+        self.advance(wheel, clock, 20)
+        assert not self.polled(mqtt)
+
+        self.advance(wheel, clock, 40)
+        assert self.polled(mqtt)
+
+    def test_other_reports_of_the_topic_do_not_count(self, mqtt, wheel, clock, poll_scheduler):
+        clock.now = 1050.0
+        mqtt.deliver(EVENT_TOPIC, dict(report(), type="evt.sensor.other_report"))
+        self.advance(wheel, clock, 10)
+        assert self.polled(mqtt)
+
+    def test_republished_statuses_are_ignored(self, mqtt, wheel, clock, poll_scheduler):
+        clock.now = 1050.0
+        mqtt.deliver(EVENT_TOPIC, report(src="homeassistant"))
+        assert poll_scheduler._polls[KEY].last_report is None
+
+        self.advance(wheel, clock, 10)
+        assert self.polled(mqtt)
+
+    def test_interval_is_twice_the_time_between_reports(self, mqtt, clock, poll_scheduler):
+        self.report_at(mqtt, clock, 1000.0, 1100.0)
+        assert poll_scheduler._polls[KEY].interval == pytest.approx(200.0)
+
+        # Smoothed: 100 + 0.3 * (200 - 100)
+        self.report_at(mqtt, clock, 1300.0)
+        assert poll_scheduler._polls[KEY].interval == pytest.approx(260.0)
+
+    @pytest.mark.parametrize("intervals", [(60, 600)])
+    @pytest.mark.parametrize("times, interval", [((1000.0, 1010.0), 60.0), ((2000.0, 3000.0), 600.0)])
+    def test_interval_is_limited(self, mqtt, clock, poll_scheduler, times, interval):
+        self.report_at(mqtt, clock, *times)
+        assert poll_scheduler._polls[KEY].interval == pytest.approx(interval)
+
+    def test_answers_to_polls_do_not_change_the_interval(self, mqtt, wheel, clock, poll_scheduler):
+        self.advance(wheel, clock, 60)
+        assert self.polled(mqtt)
+
+        # Two answers, which would otherwise make the interval 2 * 5 seconds
+        self.report_at(mqtt, clock, 1062.0, 1067.0)
+        assert poll_scheduler._polls[KEY].last_report is None
+        assert poll_scheduler._polls[KEY].interval == pytest.approx(60.0)
+
+    def test_remove(self, mqtt, wheel, clock, poll_scheduler):
+        poll_scheduler.remove(TOPIC)
+        assert mqtt.callbacks == {}
+
+        self.advance(wheel, clock, 60)
+        assert not self.polled(mqtt)
+
+    def test_meter_units_polled_by_themselves(self, mqtt, wheel, clock, poll_scheduler):
+        poll_scheduler.remove(TOPIC)
+        poll_scheduler.add(METER_TOPIC, "meter_elec", "cmd.meter.get_report", "kWh")
+        poll_scheduler.add(METER_TOPIC, "meter_elec", "cmd.meter.get_report", "W")
+        assert len(mqtt.callbacks) == 1
+
+        # Only the unit reported is put off
+        clock.now = 1030.0
+        mqtt.deliver(METER_EVENT_TOPIC, {"type": "evt.meter.report", "val": 12.5, "props": {"unit": "W"}})
+
+        self.advance(wheel, clock, 30)
+        assert self.polled(mqtt)
+        assert mqtt.report_scheduler.added == [([[METER_TOPIC, "meter_elec", "cmd.meter.get_report", "kWh"]], False)]
+
+        self.advance(wheel, clock, 30)
+        assert self.polled(mqtt)
+        assert mqtt.report_scheduler.added[-1] == ([[METER_TOPIC, "meter_elec", "cmd.meter.get_report", "W"]], False)
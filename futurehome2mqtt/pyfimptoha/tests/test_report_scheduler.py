@@ -0,0 +1,125 @@
+import json
+
+import pytest
+
+from pyfimptoha.helpers.ReportScheduler import ReportScheduler, adapter_of, report_event
+from pyfimptoha.helpers.StateCache import StateCache
+
+ZW_SENSOR = "pt:j1/mt:cmd/rt:dev/rn:zw/ad:1/sv:sensor_temp/ad:6_0"
+ZW_LIGHT = "pt:j1/mt:cmd/rt:dev/rn:zw/ad:1/sv:out_lvl_switch/ad:7_0"
+ZW_METER = "pt:j1/mt:cmd/rt:dev/rn:zw/ad:1/sv:meter_elec/ad:8_0"
+ZB_SENSOR = "pt:j1/mt:cmd/rt:dev/rn:zigbee/ad:1/sv:sensor_temp/ad:2_1"
+
+
+def sent(mqtt):
+    return [(topic, json.loads(payload)["type"], json.loads(payload)["val"]) for topic, payload, retain in mqtt.published]
+
+
+@pytest.fixture
+def rate():
+    return 5
+
+
+@pytest.fixture
+def report_scheduler(mqtt, rate):
+    return ReportScheduler(mqtt, rate)
+
+
+def test_adapter_of():
+    assert adapter_of(ZW_SENSOR) == "zw"
+    assert adapter_of(ZB_SENSOR) == "zigbee"
+    assert adapter_of("homeassistant/status") is None
+
+
+def test_report_event():
+    assert report_event(ZW_SENSOR, "cmd.sensor.get_report") == (
+        "pt:j1/mt:evt/rt:dev/rn:zw/ad:1/sv:sensor_temp/ad:6_0", "evt.sensor.report"
+    )
+
+
+class TestPacing:
+    def test_one_request_per_interval_per_adapter(self, mqtt, wheel, report_scheduler):
+        report_scheduler.add([
+            [ZW_SENSOR, "sensor_temp", "cmd.sensor.get_report"],
+            [ZW_METER, "meter_elec", "cmd.meter.get_report"],
+            [ZB_SENSOR, "sensor_temp", "cmd.sensor.get_report"],
+        ])
+        # The first of each adapter right away
+        assert {topic for topic, _, _ in sent(mqtt)} == {ZW_SENSOR, ZB_SENSOR}
+        assert wheel.timers[("get_report", "zw")][0] == pytest.approx(0.2)
+        assert wheel.timers[("get_report", "zigbee")][0] == pytest.approx(0.2)
+
+        wheel.fire(("get_report", "zw"))
+        assert sent(mqtt)[-1][0] == ZW_METER
+        assert report_scheduler.pending() == 0
+
+        # Done once the queue is empty
+        wheel.fire(("get_report", "zw"))
+        wheel.fire(("get_report", "zigbee"))
+        assert wheel.timers == {}
+
+    @pytest.mark.parametrize("rate", [0])
+    def test_all_sent_right_away_without_a_rate(self, mqtt, wheel, report_scheduler):
+        report_scheduler.add([
+            [ZW_SENSOR, "sensor_temp", "cmd.sensor.get_report"],
+            [ZW_METER, "meter_elec", "cmd.meter.get_report"],
+        ])
+        assert len(mqtt.published) == 2
+        assert wheel.timers == {}
+
+    def test_interactive_services_first(self, mqtt, wheel, report_scheduler):
+        report_scheduler.add([[ZW_SENSOR, "sensor_temp", "cmd.sensor.get_report"]])
+        report_scheduler.add([
+            [ZW_METER, "meter_elec", "cmd.meter.get_report"],
+            [ZW_LIGHT, "out_lvl_switch", "cmd.lvl.get_report"],
+        ])
+        wheel.fire(("get_report", "zw"))
+        wheel.fire(("get_report", "zw"))
+        assert [topic for topic, _, _ in sent(mqtt)] == [ZW_SENSOR, ZW_LIGHT, ZW_METER]
+
+    def test_queued_once(self, mqtt, wheel, report_scheduler):
+        report_scheduler.add([[ZW_SENSOR, "sensor_temp", "cmd.sensor.get_report"]])
+        report_scheduler.add([[ZW_METER, "meter_elec", "cmd.meter.get_report"]])
+        report_scheduler.add([[ZW_METER, "meter_elec", "cmd.meter.get_report"]])
+        assert report_scheduler.pending() == 1
+
+    def test_values_queued_by_themselves(self, mqtt, wheel, report_scheduler):
+        report_scheduler.add([[ZW_SENSOR, "sensor_temp", "cmd.sensor.get_report"]])
+        report_scheduler.add([
+            [ZW_METER, "meter_elec", "cmd.meter.get_report", "kWh"],
+            [ZW_METER, "meter_elec", "cmd.meter.get_report", "W"],
+        ])
+        wheel.fire(("get_report", "zw"))
+        wheel.fire(("get_report", "zw"))
+        assert sent(mqtt) == [
+            (ZW_SENSOR, "cmd.sensor.get_report", None),
+            (ZW_METER, "cmd.meter.get_report", "kWh"),
+            (ZW_METER, "cmd.meter.get_report", "W"),
+        ]
+        assert json.loads(mqtt.published[1][1])["val_t"] == "string"
+
+
+class TestKnown:
+    @pytest.fixture
+    def state_cache(self, mqtt, tmp_path):
+        mqtt.state_cache = StateCache(str(tmp_path), 10, False, mqtt.call_later, lambda topic, event_type: True)
+        return mqtt.state_cache
+
+    def reported(self, state_cache, topic):
+        event_topic, event_type = report_event(topic, "cmd.meter.get_report")
+        data = {"type": event_type, "val": 1}
+        state_cache.update(event_topic, data, json.dumps(data))
+
+    def test_answered_requests_skipped(self, mqtt, wheel, report_scheduler, state_cache):
+        report_scheduler.add([
+            [ZW_SENSOR, "sensor_temp", "cmd.sensor.get_report"],
+            [ZW_METER, "meter_elec", "cmd.meter.get_report"],
+        ])
+        self.reported(state_cache, ZW_METER)
+        wheel.fire(("get_report", "zw"))
+        assert [topic for topic, _, _ in sent(mqtt)] == [ZW_SENSOR]
+
+    def test_polls_sent_anyway(self, mqtt, wheel, report_scheduler, state_cache):
+        self.reported(state_cache, ZW_METER)
+        report_scheduler.add([[ZW_METER, "meter_elec", "cmd.meter.get_report"]], skip_known=False)
+        assert [topic for topic, _, _ in sent(mqtt)] == [ZW_METER]
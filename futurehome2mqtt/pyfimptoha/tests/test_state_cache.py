@@ -0,0 +1,176 @@
+import json
+
+import pytest
+
+from pyfimptoha.helpers.StateCache import StateCache, is_state_report
+from pyfimptoha.helpers.storage import load_json, save_json
+
+TOPIC = "pt:j1/mt:evt/rt:dev/rn:zw/ad:1/sv:out_lvl_switch/ad:6_0"
+METER_TOPIC = "pt:j1/mt:evt/rt:dev/rn:zw/ad:1/sv:meter_elec/ad:6_0"
+OTHER_TOPIC = "pt:j1/mt:evt/rt:dev/rn:zw/ad:1/sv:out_lvl_switch/ad:7_0"
+
+
+def event(value, event_type="evt.lvl.report", unit=None):
+    data = {"serv": "out_lvl_switch", "type": event_type, "val": value}
+    if unit is not None:
+        data["props"] = {"unit": unit}
+    return data
+
+
+def update(cache, topic, data):
+    cache.update(topic, data, json.dumps(data))
+
+
+def values(statuses):
+    return [(topic, json.loads(payload)["val"]) for topic, payload in statuses]
+
+
+@pytest.fixture
+def accepted():
+    """
+    Topics the cache gives events back for
+    """
+    return {TOPIC, METER_TOPIC, OTHER_TOPIC}
+
+
+@pytest.fixture
+def make_cache(tmp_path, mqtt, accepted):
+    def make_cache(max_entries=10, persist=False):
+        return StateCache(
+            str(tmp_path), max_entries, persist, mqtt.call_later,
+            lambda topic, event_type: topic in accepted
+        )
+    return make_cache
+
+
+@pytest.fixture
+def cache(make_cache):
+    return make_cache()
+
+
+@pytest.mark.parametrize("event_type,expected", [
+    ("evt.lvl.report", True),
+    ("evt.meter.report", True),
+    ("evt.alarm.report", False),
+    ("evt.scene.report", False),
+    ("evt.lvl.set", False),
+    ("cmd.lvl.report", False),
+    (None, False),
+])
+def test_is_state_report(event_type, expected):
+    assert is_state_report(event_type) == expected
+
+
+class TestLru:
+    def test_least_recently_updated_dropped(self, make_cache):
+        cache = make_cache(max_entries=2)
+        update(cache, TOPIC, event(1))
+        update(cache, OTHER_TOPIC, event(2))
+        update(cache, TOPIC, event(3))
+        update(cache, METER_TOPIC, event(4, "evt.meter.report"))
+
+        assert values(cache.merge([], prefer_cache=True)) == [(TOPIC, 3), (METER_TOPIC, 4)]
+
+    def test_latest_event_kept(self, cache):
+        update(cache, TOPIC, event(1))
+        update(cache, TOPIC, event(2))
+        assert values(cache.merge([], prefer_cache=True)) == [(TOPIC, 2)]
+
+    def test_units_kept_apart(self, cache):
+        update(cache, METER_TOPIC, event(1, "evt.meter.report", "W"))
+        update(cache, METER_TOPIC, event(2, "evt.meter.report", "kWh"))
+        update(cache, METER_TOPIC, event(3, "evt.meter.report", "W"))
+        assert values(cache.merge([], prefer_cache=True)) == [(METER_TOPIC, 2), (METER_TOPIC, 3)]
+
+    def test_seen(self, cache):
+        update(cache, TOPIC, event(1))
+        assert cache.seen(TOPIC, "evt.lvl.report")
+        assert not cache.seen(TOPIC, "evt.binary.report")
+        assert not cache.seen(OTHER_TOPIC, "evt.lvl.report")
+
+    def test_remove(self, cache):
+        update(cache, TOPIC, event(1))
+        update(cache, OTHER_TOPIC, event(2))
+        cache.remove([TOPIC])
+        assert values(cache.merge([], prefer_cache=True)) == [(OTHER_TOPIC, 2)]
+        assert not cache.seen(TOPIC, "evt.lvl.report")
+
+    def test_purge(self, cache, accepted):
+        update(cache, TOPIC, event(1))
+        update(cache, OTHER_TOPIC, event(2))
+        accepted.discard(TOPIC)
+        cache.purge()
+        accepted.add(TOPIC)
+        assert values(cache.merge([], prefer_cache=True)) == [(OTHER_TOPIC, 2)]
+
+
+class TestMerge:
+    @pytest.fixture
+    def statuses(self):
+        return [(TOPIC, json.dumps(event(1))), (OTHER_TOPIC, json.dumps(event(2)))]
+
+    def test_cache_preferred(self, cache, statuses):
+        update(cache, TOPIC, event(10))
+        assert values(cache.merge(statuses, prefer_cache=True)) == [(OTHER_TOPIC, 2), (TOPIC, 10)]
+
+    def test_statuses_preferred(self, cache, statuses):
+        update(cache, TOPIC, event(10))
+        update(cache, METER_TOPIC, event(11, "evt.meter.report"))
+        assert values(cache.merge(statuses, prefer_cache=False)) == [(TOPIC, 1), (OTHER_TOPIC, 2), (METER_TOPIC, 11)]
+
+    def test_other_units_added(self, cache):
+        statuses = [(METER_TOPIC, json.dumps(event(1, "evt.meter.report", "W")))]
+        update(cache, METER_TOPIC, event(2, "evt.meter.report", "kWh"))
+        assert values(cache.merge(statuses, prefer_cache=False)) == [(METER_TOPIC, 1), (METER_TOPIC, 2)]
+
+    def test_events_no_longer_accepted_left_out(self, cache, accepted):
+        update(cache, TOPIC, event(10))
+        accepted.discard(TOPIC)
+        assert cache.merge([], prefer_cache=True) == []
+
+    def test_cached_events_marked_as_sent_by_the_add_on(self, cache):
+        update(cache, TOPIC, event(10))
+        [(topic, payload)] = cache.merge([], prefer_cache=True)
+        assert json.loads(payload)["src"] == "homeassistant"
+
+    def test_statuses_which_are_not_json_kept(self, cache):
+        update(cache, TOPIC, event(10))
+        assert cache.merge([(TOPIC, "on")], prefer_cache=True)[0] == (TOPIC, "on")
+
+
+class TestPersistence:
+    def test_saved_once_after_changes(self, make_cache, mqtt, tmp_path):
+        cache = make_cache(persist=True)
+        update(cache, TOPIC, event(1))
+        update(cache, OTHER_TOPIC, event(2))
+        assert [delay for delay, callback in mqtt.delayed] == [StateCache.SAVE_DELAY]
+        assert load_json(str(tmp_path), StateCache.FILE) is None
+
+        mqtt.delayed.pop()[1]()
+        update(cache, TOPIC, event(3))
+        assert len(mqtt.delayed) == 1
+
+    def test_not_saved_without_persist(self, cache, mqtt):
+        update(cache, TOPIC, event(1))
+        assert mqtt.delayed == []
+
+    def test_loaded_on_start(self, make_cache):
+        cache = make_cache(persist=True)
+        update(cache, TOPIC, event(1))
+        update(cache, OTHER_TOPIC, event(2))
+        cache.save()
+
+        loaded = make_cache(max_entries=1, persist=True)
+        assert values(loaded.merge([], prefer_cache=True)) == [(OTHER_TOPIC, 2)]
+        # Only events received since the start count as seen
+        assert not loaded.seen(OTHER_TOPIC, "evt.lvl.report")
+
+    def test_unknown_entries_dropped_on_load(self, make_cache, tmp_path):
+        alarm = event(1, "evt.alarm.report")
+        save_json(str(tmp_path), StateCache.FILE, [
+            [StateCache.key(TOPIC, event(1)), TOPIC, json.dumps(event(1))],
+            [StateCache.key(TOPIC, alarm), TOPIC, "evt.alarm.report", json.dumps(alarm)],
+            [StateCache.key(OTHER_TOPIC, event(2)), OTHER_TOPIC, "evt.lvl.report", json.dumps(event(2))],
+        ])
+        cache = make_cache(persist=True)
+        assert values(cache.merge([], prefer_cache=True)) == [(OTHER_TOPIC, 2)]
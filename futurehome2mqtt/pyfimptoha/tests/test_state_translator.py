@@ -0,0 +1,84 @@
+import pytest
+
+import pyfimptoha.translation as translation
+from pyfimptoha.helpers.StateTranslator import StateTranslator
+
+EVENT_TOPIC = "pt:j1/mt:evt/rt:dev/rn:zw/ad:7/sv:meter_elec/ad:1_0"
+POWER = "fh_7_zw_7_meter_elec_W"
+TEMPERATURE = "fh_7_zw_7_sensor_temp"
+
+
+def component(identifier):
+    return {"unique_id": identifier, "state_topic": EVENT_TOPIC, "value_template": "{{ value_json.val }}"}
+
+
+@pytest.fixture
+def enabled():
+    return False
+
+
+@pytest.fixture
+def throttle_rules():
+    return [("meter_elec_W", 5.0, None)]
+
+
+@pytest.fixture
+def deadband_rules():
+    return [("sensor_temp", 0.2, False, None)]
+
+
+@pytest.fixture
+def translator(mqtt, enabled, throttle_rules, deadband_rules):
+    mqtt.translator = StateTranslator(
+        mqtt, enabled=enabled, throttle_rules=throttle_rules, deadband_rules=deadband_rules
+    )
+    return mqtt.translator
+
+
+class TestTranslates:
+    @pytest.mark.parametrize("deadband_rules", [[]])
+    def test_entities_with_a_rule(self, translator):
+        assert translator.translates(POWER)
+        assert not translator.translates(TEMPERATURE)
+
+    @pytest.mark.parametrize("throttle_rules", [[]])
+    def test_entities_with_a_deadband_rule(self, translator):
+        assert translator.translates(TEMPERATURE)
+        assert not translator.translates(POWER)
+
+    @pytest.mark.parametrize("enabled", [True])
+    def test_everything_when_enabled(self, translator):
+        assert translator.translates(TEMPERATURE)
+
+    @pytest.mark.parametrize("throttle_rules", [[]])
+    @pytest.mark.parametrize("deadband_rules", [[]])
+    def test_nothing_without_rules(self, translator):
+        assert not translator.translates(POWER)
+
+
+class TestApply:
+    def test_translated(self, mqtt, translator):
+        translated = translation.apply(mqtt, component(POWER), translation.report("evt.meter.report"))
+        assert translated["state_topic"] == f"fh/{POWER}/state"
+        assert "value_template" not in translated
+
+        mqtt.deliver(EVENT_TOPIC, {"type": "evt.meter.report", "val": 12.5})
+        assert mqtt.published == [(f"fh/{POWER}/state", "12.5", True)]
+
+    @pytest.mark.parametrize("deadband_rules", [[]])
+    def test_not_translated(self, mqtt, translator):
+        assert translation.apply(mqtt, component(TEMPERATURE), translation.report("evt.sensor.report")) == component(TEMPERATURE)
+        assert mqtt.callbacks == {}
+
+
+def test_constant(mqtt):
+    min_current = {"unique_id": "fh_9_zw_9_chargepoint_min_current", "state_topic": EVENT_TOPIC, "value_template": "6"}
+    constant = translation.constant(mqtt, min_current, 6)
+    assert constant["state_topic"] == "fh/fh_9_zw_9_chargepoint_min_current/state"
+    assert "value_template" not in constant
+    assert mqtt.published == [("fh/fh_9_zw_9_chargepoint_min_current/state", "6", True)]
+
+    # Not published again for the events of the service
+    mqtt.deliver(EVENT_TOPIC, {"type": "evt.state.report", "val": "charging"})
+    assert len(mqtt.published) == 1
+    assert mqtt.callbacks == {}
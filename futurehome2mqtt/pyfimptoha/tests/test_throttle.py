@@ -0,0 +1,125 @@
+import pytest
+
+from pyfimptoha.helpers.Throttle import Throttle, match_rule, parse_rules
+from pyfimptoha.tests.fakes import FakeWheel
+
+STATE_TOPIC = "fh/zw_7_meter_elec_W/state"
+IDENTIFIER = "zw_7_meter_elec_W"
+TIMER = ("throttle", STATE_TOPIC)
+
+
+@pytest.fixture
+def rules():
+    return [("meter_elec_W", 5.0, None)]
+
+
+@pytest.fixture
+def throttle(rules, wheel, published):
+    helper = Throttle(rules, lambda topic, payload: published.append((topic, payload)), wheel)
+    helper.add(STATE_TOPIC, IDENTIFIER)
+    return helper
+
+
+class TestParseRules:
+    def test_rules(self):
+        assert parse_rules("meter_elec_W:5:300, meter_elec:10") == [
+            ("meter_elec_W", 5.0, 300.0),
+            ("meter_elec", 10.0, None),
+        ]
+
+    @pytest.mark.parametrize("value", [None, "", " , ", "null"])
+    def test_unset(self, value):
+        assert parse_rules(value) == []
+
+    @pytest.mark.parametrize("rule", ["meter_elec", "meter_elec:x", "meter_elec:5:x"])
+    def test_invalid_rules_are_ignored(self, rule):
+        assert parse_rules(f"{rule},sensor_temp:60") == [("sensor_temp", 60.0, None)]
+
+
+class TestMatchRule:
+    RULES = [("meter_elec_W", 5.0, None), ("meter_elec", 10.0, None)]
+
+    def test_most_specific_rule(self):
+        assert match_rule(self.RULES, "zw_7_meter_elec_W") == self.RULES[0]
+        assert match_rule(self.RULES, "zw_7_meter_elec_kWh") == self.RULES[1]
+
+    def test_no_rule(self):
+        assert match_rule(self.RULES, "zw_7_sensor_temp") is None
+
+    def test_key_must_be_a_whole_part(self):
+        assert match_rule([("temp", 5.0, None)], "zw_6_sensor_atemp") is None
+
+    def test_most_specific_rule_wins_regardless_of_order(self):
+        helper = Throttle(list(reversed(self.RULES)), lambda topic, payload: None, FakeWheel())
+        assert helper.rule("zw_7_meter_elec_W") == self.RULES[0]
+
+
+class TestThrottle:
+    @pytest.mark.parametrize("rules", [[("sensor_temp", 60.0, None)]])
+    def test_entities_without_a_rule_are_not_limited(self, clock, wheel, throttle):
+        assert throttle.offer(STATE_TOPIC, "1")
+        assert throttle.offer(STATE_TOPIC, "2")
+        assert wheel.timers == {}
+
+    def test_first_state_is_published_right_away(self, clock, wheel, throttle):
+        assert throttle.offer(STATE_TOPIC, "1")
+        assert wheel.timers == {}
+
+    def test_states_within_the_min_interval_are_coalesced(self, clock, wheel, published, throttle):
+        assert throttle.offer(STATE_TOPIC, "1")
+        clock.now += 1
+        assert not throttle.offer(STATE_TOPIC, "2")
+        clock.now += 1
+        assert not throttle.offer(STATE_TOPIC, "3")
+        assert published == []
+        # Due when the interval since the last published state has passed
+        assert wheel.timers[TIMER][0] == pytest.approx(4.0)
+
+        clock.now += 3
+        wheel.fire(TIMER)
+        assert published == [(STATE_TOPIC, "3")]
+
+    def test_state_after_the_min_interval_is_published(self, clock, throttle):
+        assert throttle.offer(STATE_TOPIC, "1")
+        clock.now += 5
+        assert throttle.offer(STATE_TOPIC, "2")
+
+    def test_state_waits_behind_a_pending_one(self, clock, wheel, published, throttle):
+        throttle.offer(STATE_TOPIC, "1")
+        clock.now += 1
+        throttle.offer(STATE_TOPIC, "2")
+        # The interval has passed, but "2" would be published after "3"
+        clock.now += 10
+        assert not throttle.offer(STATE_TOPIC, "3")
+        wheel.fire(TIMER)
+        assert published == [(STATE_TOPIC, "3")]
+
+    @pytest.mark.parametrize("rules", [[("meter_elec_W", 5.0, 300.0)]])
+    def test_last_state_is_published_again_after_the_max_interval(self, clock, wheel, published, throttle):
+        assert throttle.offer(STATE_TOPIC, "1")
+        assert wheel.timers[TIMER][0] == pytest.approx(300.0)
+
+        clock.now += 300
+        wheel.fire(TIMER)
+        assert published == [(STATE_TOPIC, "1")]
+        # And again after the next max interval
+        assert wheel.timers[TIMER][0] == pytest.approx(300.0)
+
+    @pytest.mark.parametrize("rules", [[("meter_elec_W", 5.0, 300.0)]])
+    def test_max_interval_restarts_when_a_state_is_published(self, clock, wheel, published, throttle):
+        throttle.offer(STATE_TOPIC, "1")
+        clock.now += 1
+        throttle.offer(STATE_TOPIC, "2")
+        clock.now += 4
+        wheel.fire(TIMER)
+        assert published == [(STATE_TOPIC, "2")]
+        assert wheel.timers[TIMER][0] == pytest.approx(300.0)
+
+    @pytest.mark.parametrize("rules", [[("meter_elec_W", 5.0, 300.0)]])
+    def test_remove(self, clock, wheel, throttle):
+        throttle.offer(STATE_TOPIC, "1")
+        clock.now += 1
+        throttle.offer(STATE_TOPIC, "2")
+        throttle.remove(STATE_TOPIC)
+        assert wheel.timers == {}
+        assert throttle.offer(STATE_TOPIC, "3")
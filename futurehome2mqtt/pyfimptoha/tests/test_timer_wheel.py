@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+from pyfimptoha.helpers.TimerWheel import TimerWheel
+
+
+class Recorder:
+    """
+    Records when each timer fired, and lets the test wait for them
+    """
+    def __init__(self):
+        self.fired = {}
+        self.event = threading.Event()
+
+    def callback(self, key):
+        def fire():
+            self.fired[key] = time.monotonic()
+            self.event.set()
+        return fire
+
+
+@pytest.fixture
+def recorder():
+    return Recorder()
+
+
+@pytest.fixture
+def timer_wheel():
+    return TimerWheel(tick=0.01)
+
+
+class TestTimerWheel:
+    def test_never_fires_early(self, timer_wheel, recorder):
+        start = time.monotonic()
+        for key, delay in [("a", 0.0), ("b", 0.015), ("c", 0.05)]:
+            timer_wheel.schedule(key, delay, recorder.callback(key))
+
+        time.sleep(0.2)
+        assert recorder.fired["a"] - start >= 0.0
+        assert recorder.fired["b"] - start >= 0.015
+        assert recorder.fired["c"] - start >= 0.05
+
+    def test_scheduling_again_replaces_the_timer(self, timer_wheel):
+        calls = []
+        timer_wheel.schedule("a", 0.02, lambda: calls.append("first"))
+        timer_wheel.schedule("a", 0.04, lambda: calls.append("second"))
+
+        time.sleep(0.15)
+        assert calls == ["second"]
+
+    def test_cancel(self, timer_wheel):
+        calls = []
+        timer_wheel.schedule("a", 0.02, lambda: calls.append("a"))
+        timer_wheel.schedule("b", 0.02, lambda: calls.append("b"))
+        timer_wheel.cancel("a")
+        timer_wheel.cancel("unknown")
+
+        time.sleep(0.1)
+        assert calls == ["b"]
+
+    def test_delays_longer_than_a_turn_wait_for_their_rounds(self, recorder):
+        # One turn of the wheel is 0.04 seconds
+        timer_wheel = TimerWheel(tick=0.01, slots=4)
+        start = time.monotonic()
+        timer_wheel.schedule("long", 0.1, recorder.callback("long"))
+        timer_wheel.schedule("short", 0.02, recorder.callback("short"))
+
+        time.sleep(0.3)
+        assert 0.02 <= recorder.fired["short"] - start < 0.1
+        assert recorder.fired["long"] - start >= 0.1
+
+    def test_failing_callback_does_not_stop_the_wheel(self, timer_wheel, recorder):
+        timer_wheel.schedule("fails", 0.01, lambda: 1 / 0)
+        timer_wheel.schedule("b", 0.03, recorder.callback("b"))
+
+        assert recorder.event.wait(1)
+
+    def test_resumes_after_being_idle(self, timer_wheel, recorder):
+        timer_wheel.schedule("a", 0.01, recorder.callback("a"))
+        assert recorder.event.wait(1)
+
+        recorder.event.clear()
+        time.sleep(0.05)
+        start = time.monotonic()
+        timer_wheel.schedule("b", 0.03, recorder.callback("b"))
+        assert recorder.event.wait(1)
+        assert recorder.fired["b"] - start >= 0.03
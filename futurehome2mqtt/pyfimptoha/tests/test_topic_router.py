@@ -0,0 +1,87 @@
+import pytest
+
+from pyfimptoha.helpers.TopicRouter import TopicRouter
+
+
+@pytest.fixture
+def topic_filters():
+    return ["fh/+/state"]
+
+
+@pytest.fixture
+def router(topic_filters):
+    """
+    Routes each filter to itself
+    """
+    router = TopicRouter()
+    for topic_filter in topic_filters:
+        router.add(topic_filter, topic_filter, topic_filter)
+    return router
+
+
+class TestTopicRouter:
+    @pytest.mark.parametrize("topic_filters", [["pt:j1/mt:evt/rt:dev/rn:zw/ad:1/sv:out_bin_switch/ad:1_0"]])
+    def test_exact_filter(self, router, topic_filters):
+        assert router.match("pt:j1/mt:evt/rt:dev/rn:zw/ad:1/sv:out_bin_switch/ad:1_0") == topic_filters
+        assert router.match("pt:j1/mt:evt/rt:dev/rn:zw/ad:1/sv:out_bin_switch/ad:2_0") == []
+
+    @pytest.mark.parametrize("topic_filters", [["pt:j1/mt:evt/rt:dev/+/ad:1/sv:meter_elec/+"]])
+    @pytest.mark.parametrize("topic, matches", [
+        ("pt:j1/mt:evt/rt:dev/rn:zw/ad:1/sv:meter_elec/ad:7_0", True),
+        ("pt:j1/mt:evt/rt:dev/rn:zb/ad:1/sv:meter_elec/ad:7_0", True),
+        ("pt:j1/mt:evt/rt:dev/rn:zw/ad:1/sv:meter_elec", False),
+        ("pt:j1/mt:evt/rt:dev/rn:zw/ad:1/sv:meter_elec/ad:7_0/x", False),
+    ])
+    def test_single_level_wildcard(self, router, topic_filters, topic, matches):
+        assert router.match(topic) == (topic_filters if matches else [])
+
+    # 'a/#' also matches 'a'
+    @pytest.mark.parametrize("topic_filters", [["pt:j1/mt:evt/#"]])
+    @pytest.mark.parametrize("topic, matches", [
+        ("pt:j1/mt:evt/rt:app/rn:vinculum/ad:1", True),
+        ("pt:j1/mt:evt/rt:app", True),
+        ("pt:j1/mt:evt", True),
+        ("pt:j1/mt:cmd/rt:app", False),
+        ("pt:j1", False),
+    ])
+    def test_multi_level_wildcard(self, router, topic_filters, topic, matches):
+        assert router.match(topic) == (topic_filters if matches else [])
+
+    @pytest.mark.parametrize("topic_filters", [[
+        "homeassistant/status",
+        "homeassistant/+",
+        "homeassistant/#",
+        "#",
+        "+/status",
+        "other/#",
+    ]])
+    def test_all_matching_filters(self, router, topic_filters):
+        assert sorted(router.match("homeassistant/status")) == sorted(topic_filters[:-1])
+
+    def test_handlers_of_the_same_filter(self, router):
+        router.add("fh/+/state", "a", "handler a")
+        router.add("fh/+/state", "b", "handler b")
+        assert sorted(router.match("fh/zw_1/state")) == ["fh/+/state", "handler a", "handler b"]
+
+        router.remove("fh/+/state", "a")
+        assert sorted(router.match("fh/zw_1/state")) == ["fh/+/state", "handler b"]
+
+    @pytest.mark.parametrize("topic_filters", [["fh/zw_1/state"], ["fh/+/state"], ["fh/#"]])
+    def test_remove(self, router, topic_filters):
+        router.remove(topic_filters[0], topic_filters[0])
+        assert router.match("fh/zw_1/state") == []
+        # Nothing is left behind
+        assert router._exact == {}
+        assert router._root.children == {}
+
+    @pytest.mark.parametrize("topic_filters", [["fh/+/state", "fh/+/attributes"]])
+    def test_remove_keeps_the_other_branches(self, router):
+        router.remove("fh/+/state", "fh/+/state")
+        assert router.match("fh/zw_1/state") == []
+        assert router.match("fh/zw_1/attributes") == ["fh/+/attributes"]
+
+    def test_remove_unknown(self, router):
+        router.remove("fh/+/attributes", "fh/+/attributes")
+        router.remove("fh/zw_1/state", "fh/zw_1/state")
+        router.remove("fh/+/state", "other id")
+        assert router.match("fh/zw_1/state") == ["fh/+/state"]
@@ -1,6 +1,8 @@
 import json
 import typing
 
+import pyfimptoha.coalescing as coalescing
+
 def new_thermostat(
         mqtt,
         device: typing.Any,
@@ -8,7 +10,7 @@ def new_thermostat(
         identifier,
         default_component,
         command_topic,
-        devices
+        index
 ):
     """
     Creates thermostat in Home Assistant based on FIMP services
@@ -19,7 +21,7 @@ def new_thermostat(
 
     fan_component = new_fan_component(device)
     humid_component = new_humid_component(device)
-    current_temperature_component = new_current_temperature_component(device, devices)
+    current_temperature_component = new_current_temperature_component(device, index)
 
     thermostat_component = {
         "max_temp": 40.0,
@@ -35,7 +37,7 @@ def new_thermostat(
                 "src": "homeassistant"
             }
         """,
-        "mode_command_topic": command_topic,
+        "mode_command_topic": coalescing.command_topic(mqtt, command_topic),
         "mode_state_template": f"""
             {{% if value_json.type == 'evt.mode.report' %}}
                 {{{{ value_json.val }}}}
@@ -61,7 +63,7 @@ def new_thermostat(
                 "src": "homeassistant"
             }
         """,
-        "temperature_command_topic": command_topic,
+        "temperature_command_topic": coalescing.command_topic(mqtt, command_topic),
         "temperature_state_template": """
             {% if value_json.type == 'evt.setpoint.report' %}
                 {{ value_json.val.temp }}
@@ -180,7 +182,7 @@ def new_humid_component(device):
     return humid_component
 
 
-def new_current_temperature_component(device, devices):
+def new_current_temperature_component(device, index):
     topic = None
     current_temperature_component = None
 
@@ -190,13 +192,12 @@ def new_current_temperature_component(device, devices):
         # Handling when current_temp sensor is not on the same device (channel)
         # (e.g Heatit floor sensor on _4 or room sensor on _3)
         thing_id = device["thing"]
-        for dev in devices:
-            if dev["thing"] == thing_id:
-                topic = [f"pt:j1/mt:evt{service['addr']}" for service_name, service in dev["services"].items() \
-                    if service["props"].get("thing_role") and service["props"]["thing_role"] == "main"]
-                if topic:
-                    topic = topic[0]
-                    break
+        for dev in index.thing_devices(thing_id):
+            topic = [f"pt:j1/mt:evt{service['addr']}" for service_name, service in dev["services"].items() \
+                if service["props"].get("thing_role") and service["props"]["thing_role"] == "main"]
+            if topic:
+                topic = topic[0]
+                break
 
     if topic:
         current_temperature_component = {
@@ -0,0 +1,93 @@
+"""
+Bridge-side translation of FIMP events, enabled with the `translate_states` option,
+and for the entities with a throttle or deadband rule.
+
+The builders describe how to get an entity's state out of a FIMP event with an
+extractor. Without translation the components keep their `value_template` and
+read the FIMP event topic directly.
+"""
+
+
+def _translate(component, state_topic):
+    component = {**component, "state_topic": state_topic}
+    component.pop("value_template", None)
+    return component
+
+
+def apply(mqtt, component, extractor):
+    """
+    Points `component` at a state topic published by the bridge and drops its
+    `value_template`, if its state is translated, see StateTranslator.translates
+    """
+    translator = mqtt.translator
+    if translator is None or not translator.translates(component["unique_id"]):
+        return component
+
+    state_topic = translator.register(component["state_topic"], component["unique_id"], extractor)
+    return _translate(component, state_topic)
+
+
+def split(mqtt, component, extractor):
+    """
+    Like `apply`, but regardless of the translate_states option, and only
+    publishes values that changed. For events carrying many values, like the
+    extended meter reports, where each event would otherwise be evaluated
+    by the template of every entity.
+    """
+    translator = mqtt.translator
+    if translator is None:
+        return component
+
+    state_topic = translator.register(
+        component["state_topic"], component["unique_id"], extractor, only_changed=True
+    )
+    return _translate(component, state_topic)
+
+
+def constant(mqtt, component, value):
+    """
+    Points `component` at a state topic holding `value`, published once and
+    retained, instead of a template returning it for every event of the service
+    """
+    state_topic = f"fh/{component['unique_id']}/state"
+    mqtt.publish(state_topic, str(value), retain=True)
+    return _translate(component, state_topic)
+
+
+def apply_availability(mqtt, component, extractor):
+    """
+    Same as `apply`, for the availability topic of `component`
+    """
+    translator = mqtt.translator
+    if translator is None or not translator.enabled:
+        return component
+
+    availability_topic = translator.register(
+        component["availability"]["topic"], component["unique_id"], extractor, "availability"
+    )
+    return {**component, "availability": {"topic": availability_topic}}
+
+
+def report(typ, convert=None):
+    """
+    Extracts `val` from events of type `typ`, optionally converted
+    """
+    def extract(data):
+        if data.get("type") != typ:
+            return None
+        if convert is None:
+            return data["val"]
+        return convert(data["val"])
+
+    return extract
+
+
+def rounded(digits):
+    """
+    Rounds like the `round` filter of the templates
+    """
+    return lambda val: round(float(val), digits)
+
+
+def locked(val):
+    return "LOCKED" if val else "UNLOCKED"
@@ -1,11 +1,269 @@
+import asyncio
+import atexit
 import json
+import signal
 import sys
 import time
 
 import pyfimptoha.mqtt_client as fimp
+import pyfimptoha.async_client as fimp_async
+import pyfimptoha.device_state as device_state
 import pyfimptoha.homeassistant as homeassistant
+import pyfimptoha.incremental as incremental
+import pyfimptoha.snapshot as snapshot
+from pyfimptoha.helpers.Aggregator import Aggregator
+from pyfimptoha.helpers.CommandCoalescer import CommandCoalescer
+from pyfimptoha.helpers.EnergyIntegrator import EnergyIntegrator
+from pyfimptoha.helpers.PollScheduler import PollScheduler
+from pyfimptoha.helpers.StateTranslator import StateTranslator
 
 topic_discover = "pt:j1/mt:rsp/rt:app/rn:homeassistant/ad:flow1"
+topic_vinculum = "pt:j1/mt:cmd/rt:app/rn:vinculum/ad:1"
+# Seconds to wait for the discovery response before asking again, doubled
+# after every attempt, as the hub may still be starting
+DISCOVERY_RETRY_DELAY = 5
+DISCOVERY_RETRY_MAX_DELAY = 300
+
+
+def load_discover_request():
+    path = "pyfimptoha/data/fimp_discover.json"
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+def load_state_request():
+    path = "pyfimptoha/data/fimp_state.json"
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+def is_correct(msg, data):
+    return (
+        msg.topic == topic_discover
+        and data.get("type") == "evt.pd7.response"
+        and not device_state.is_state_response(data)
+    )
+
+
+def is_state_correct(msg, data):
+    return (
+        msg.topic == topic_discover
+        and data.get("type") == "evt.pd7.response"
+        and device_state.is_state_response(data)
+    )
+
+
+def send_state_request(f):
+    """
+    Asks FIMP for the values of all devices at once, see device_state
+    """
+    if not f._bulk_state:
+        return None
+
+    print('Asking FIMP for the state of all devices...')
+    return f.send_request(topic_vinculum, topic_discover, load_state_request(), is_state_correct)
+
+
+def ask_again(f, request, data):
+    """
+    Publishes a request again with the same uid, so the request is answered
+    by the response to whichever copy comes first
+    """
+    f.publish_dict(topic_vinculum, {**data, "uid": request.uid})
+
+
+def next_retry_delay(delay):
+    return min(delay * 2, DISCOVERY_RETRY_MAX_DELAY)
+
+
+def create_components_args(f, data, state=None):
+    return dict(
+        devices=data["val"]["param"]["device"],
+        rooms=data["val"]["param"]["room"],
+        shortcuts=data["val"]["param"]["shortcut"],
+        mode=data["val"]["param"]["house"]["mode"],
+        mqtt=f,
+        selected_devices_mode=f._selected_devices_mode,
+        selected_devices=f._selected_devices,
+        debug=f._debug,
+        state=state
+    )
+
+
+def create_translator(f):
+    f.translator = StateTranslator(
+        f,
+        enabled=f._translate_states,
+        throttle_rules=f._throttle,
+        deadband_rules=f._deadband
+    )
+
+
+def create_poll_scheduler(f):
+    if f._poll_interval > 0:
+        f.poll_scheduler = PollScheduler(f, f._poll_interval, f._poll_max_interval)
+
+
+def create_aggregator(f):
+    if f._aggregate_windows:
+        f.aggregator = Aggregator(f, f._aggregate_windows)
+
+
+def create_energy_integrator(f):
+    if f._integrate_energy:
+        f.energy_integrator = EnergyIntegrator(f, f._data_path)
+        # Otherwise up to SAVE_DELAY seconds of energy are lost on a restart
+        atexit.register(f.energy_integrator.save)
+
+
+def create_command_coalescer(f):
+    if f._command_debounce > 0:
+        f.command_coalescer = CommandCoalescer(f, f._command_debounce)
+
+
+def load_snapshot(f):
+    if not f._discovery_snapshot:
+        return None
+
+    cached = snapshot.load(f._data_path)
+    if cached is not None:
+        print(f"Publishing {len(cached['configs'])} components from discovery snapshot...")
+        snapshot.publish(f, cached)
+    return cached
+
+
+def save_snapshot(f, statuses):
+    if f._discovery_snapshot:
+        snapshot.save(f._data_path, f.discovery_configs, statuses)
+
+
+def start_incremental_discovery(f, discover_request, data):
+    discovery = incremental.IncrementalDiscovery(
+        f,
+        topic_vinculum,
+        topic_discover,
+        discover_request,
+        is_correct,
+        f._selected_devices_mode,
+        f._selected_devices,
+        f._debug
+    )
+    discovery.start(data["val"]["param"])
+
+
+def run(f):
+    print('Sleeping forever...')
+    if not f.connect():
+        print("MQTT client didn't connect... Exiting")
+        exit(1)
+
+    create_translator(f)
+    create_poll_scheduler(f)
+    create_aggregator(f)
+    create_energy_integrator(f)
+    create_command_coalescer(f)
+
+    discover_request = load_discover_request()
+
+    print('Asking FIMP to expose all devices, shortcuts, rooms and mode...')
+    request = f.send_request(topic_vinculum, topic_discover, discover_request, is_correct)
+    state_request = send_state_request(f)
+
+    # Entities from the last run are available while waiting for the hub
+    load_snapshot(f)
+
+    delay = DISCOVERY_RETRY_DELAY
+    response = request.wait(delay)
+    while response is None and f.is_alive():
+        delay = next_retry_delay(delay)
+        print(f"No response from FIMP on the discovery request, asking again and waiting {delay} seconds")
+        ask_again(f, request, discover_request)
+        if state_request is not None:
+            ask_again(f, state_request, load_state_request())
+        response = request.wait(delay)
+    f.finish_request(request)
+
+    # Sent at the same time, so usually already answered
+    state = None
+    if state_request is not None:
+        state_response = state_request.wait(5)
+        f.finish_request(state_request)
+        if state_response is None:
+            print("No response from FIMP on the state request, asking each device instead")
+        else:
+            state = state_response[1]
+
+    if response is not None:
+        msg, data = response
+        f.begin_discovery()
+        statuses = homeassistant.create_components(**create_components_args(f, data, state))
+        f.end_discovery()
+        save_snapshot(f, statuses)
+        start_incremental_discovery(f, discover_request, data)
+
+    # paho reconnects by itself when the connection is lost. If that stops
+    # working, exit so the Supervisor restarts the add-on.
+    while f.is_alive():
+        time.sleep(1)
+    print("MQTT client: Not running anymore... Exiting")
+    exit(1)
+
+
+async def run_async(f):
+    if not await f.connect_async():
+        print("MQTT client didn't connect... Exiting")
+        exit(1)
+
+    create_translator(f)
+    create_poll_scheduler(f)
+    create_aggregator(f)
+    create_energy_integrator(f)
+    create_command_coalescer(f)
+
+    discover_request = load_discover_request()
+
+    print('Asking FIMP to expose all devices, shortcuts, rooms and mode...')
+    request = f.send_request(topic_vinculum, topic_discover, discover_request, is_correct)
+    state_request = send_state_request(f)
+
+    # Entities from the last run are available while waiting for the hub
+    load_snapshot(f)
+
+    delay = DISCOVERY_RETRY_DELAY
+    response = await f.wait_request(request, delay, finish=False)
+    while response is None and f.is_alive():
+        delay = next_retry_delay(delay)
+        print(f"No response from FIMP on the discovery request, asking again and waiting {delay} seconds")
+        ask_again(f, request, discover_request)
+        if state_request is not None:
+            ask_again(f, state_request, load_state_request())
+        response = await f.wait_request(request, delay, finish=False)
+    f.finish_request(request)
+
+    # Sent at the same time, so usually already answered
+    state = None
+    if state_request is not None:
+        state_response = await f.wait_request(state_request)
+        if state_response is None:
+            print("No response from FIMP on the state request, asking each device instead")
+        else:
+            state = state_response[1]
+
+    if response is not None:
+        msg, data = response
+        f.begin_discovery()
+        statuses = await homeassistant.create_components_async(**create_components_args(f, data, state))
+        f.end_discovery()
+        save_snapshot(f, statuses)
+        start_incremental_discovery(f, discover_request, data)
+
+    # Reconnects by itself when the connection is lost
+    while not await f.wait_closed(1):
+        if not f.is_alive():
+            print("MQTT client: Not running anymore... Exiting")
+            exit(1)
+    print("MQTT client: Disconnected... Exiting")
+
 
 if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == "help":
@@ -14,39 +272,9 @@ if __name__ == "__main__":
         )
     else:
         print('Starting service...')
-        f = fimp.MqttClient()
-        print('Sleeping forever...')
-        if not f.connect():
-            print("MQTT client didn't connect... Exiting")
-            exit(1)
-
-        f.client.loop_start()
-
-        path = "pyfimptoha/data/fimp_discover.json"
-        topic = "pt:j1/mt:cmd/rt:app/rn:vinculum/ad:1"
-        with open(path) as json_file:
-            data = json.load(json_file)
-
-        print('Asking FIMP to expose all devices, shortcuts, rooms and mode...')
-        def is_correct(msg, data):
-            return msg.topic == topic_discover
-        response = f.send_and_wait(topic, topic_discover, data, is_correct)
-
-        if data is not None:
-            msg, data = response
-            homeassistant.create_components(
-                devices=data["val"]["param"]["device"],
-                rooms=data["val"]["param"]["room"],
-                shortcuts=data["val"]["param"]["shortcut"],
-                mode=data["val"]["param"]["house"]["mode"],
-                mqtt=f,
-                selected_devices_mode=f._selected_devices_mode,
-                selected_devices=f._selected_devices,
-                debug=f._debug
-            )
-
-        while True:
-            if not f.connected:
-                print("MQTT client: No longer connected... Exiting")
-                break
-            time.sleep(1)
+        # The Supervisor stops the add-on with SIGTERM, exit normally so the atexit handlers run
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        if fimp.asyncio_mode_enabled():
+            asyncio.run(run_async(fimp_async.AsyncMqttClient()))
+        else:
+            run(fimp.MqttClient())
@@ -9,7 +9,28 @@ export CLIENT_ID=$(bashio::config 'client_id')
 export DEBUG=$(bashio::config 'debug')
 export SELECTED_DEVICES_MODE=$(bashio::config 'selected_devices_mode')
 export SELECTED_DEVICES=$(bashio::config 'selected_devices')
+export ASYNCIO_MODE=$(bashio::config 'asyncio_mode')
+export DISCOVERY_SNAPSHOT=$(bashio::config 'discovery_snapshot')
+export TRANSLATE_STATES=$(bashio::config 'translate_states')
+export THROTTLE=$(bashio::config 'throttle')
+export DEADBAND=$(bashio::config 'deadband')
+export MAX_QUEUED_MESSAGES=$(bashio::config 'max_queued_messages')
+export CONNECT_TIMEOUT=$(bashio::config 'connect_timeout')
+export PERSISTENT_SESSION=$(bashio::config 'persistent_session')
+export QOS_COMMANDS=$(bashio::config 'qos_commands')
+export QOS_DISCOVERY=$(bashio::config 'qos_discovery')
+export QOS_TELEMETRY=$(bashio::config 'qos_telemetry')
+export STATE_CACHE_SIZE=$(bashio::config 'state_cache_size')
+export PERSIST_STATE_CACHE=$(bashio::config 'persist_state_cache')
+export GET_REPORT_RATE=$(bashio::config 'get_report_rate')
+export BULK_STATE=$(bashio::config 'bulk_state')
+export POLL_INTERVAL=$(bashio::config 'poll_interval')
+export POLL_MAX_INTERVAL=$(bashio::config 'poll_max_interval')
+export AGGREGATE_WINDOWS=$(bashio::config 'aggregate_windows')
+export INTEGRATE_ENERGY=$(bashio::config 'integrate_energy')
+export COMMAND_DEBOUNCE=$(bashio::config 'command_debounce')
 export PYTHONUNBUFFERED=1
 
 echo Starting Futurehome FIMP to Home Assistant
-python3 run.py
+# exec, so run.py gets the SIGTERM when the add-on is stopped
+exec python3 run.py